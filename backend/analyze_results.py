@@ -7,6 +7,7 @@ import os
 from app import app
 from database import db
 from models import Participant, Task, LogEntry, QuestionnaireResponse, Movie
+from result_sets import resolve_logs
 from datetime import datetime
 from collections import defaultdict
 import pandas as pd
@@ -37,7 +38,7 @@ def get_task_logs(participant_id=None, task_id=None, interface_type=None):
             query = query.filter_by(interface_type=interface_type)
         
         logs = query.order_by(LogEntry.timestamp).all()
-        return [log.to_dict() for log in logs]
+        return resolve_logs([log.to_dict() for log in logs])
 
 def analyze_task_performance():
     """Analyze task completion times and accuracy"""
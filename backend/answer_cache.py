@@ -0,0 +1,128 @@
+"""
+Cache of RAG answers
+An answer is determined by the question, the model and the exact rows it was
+grounded in, so entries are keyed by (model, hash of the retrieved movie IDs in
+order, normalized query). Optionally, a question whose content words overlap an
+earlier question's by at least ANSWER_CACHE_SIMILARITY (Jaccard) reuses its
+answer too, but only when the retrieved rows are identical.
+
+Configuration (environment):
+    ANSWER_CACHE_SIZE           answers kept, least recently used evicted (default 512; 0 disables)
+    ANSWER_CACHE_TTL_SECONDS    answer lifetime (default 86400; 0 = never expire)
+    ANSWER_CACHE_SIMILARITY     near-duplicate threshold in (0, 1]; 0 = exact matches only (default 0)
+"""
+import hashlib
+import os
+import re
+import threading
+import time
+from caching import LRUCache
+from nl_rules import STOPWORDS
+from parse_cache import normalize_query
+
+ANSWER_CACHE_TTL_SECONDS = int(os.getenv('ANSWER_CACHE_TTL_SECONDS', '86400'))
+ANSWER_CACHE_SIMILARITY = float(os.getenv('ANSWER_CACHE_SIMILARITY', '0'))
+
+# (model, ids hash, normalized query) -> (stored_at, answer)
+_answers = LRUCache(int(os.getenv('ANSWER_CACHE_SIZE', '512')))
+
+# (model, ids hash) -> {key: content words}, for near-duplicate lookups
+_by_result_set = {}
+_index_lock = threading.Lock()
+
+_stats_lock = threading.Lock()
+_stats = {'exact_hits': 0, 'similar_hits': 0, 'misses': 0, 'stores': 0, 'expired': 0}
+
+def _count(name, amount=1):
+    with _stats_lock:
+        _stats[name] += amount
+
+def result_set_hash(movie_ids):
+    """Order-sensitive hash of the retrieved movie IDs"""
+    return hashlib.sha256(','.join(str(movie_id) for movie_id in movie_ids).encode('utf-8')).hexdigest()
+
+def content_words(nl_query):
+    return frozenset(word for word in re.findall(r"[a-z0-9$]+", normalize_query(nl_query))
+                     if word not in STOPWORDS)
+
+def jaccard(a, b):
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+def _fresh(entry):
+    return entry is not None and (ANSWER_CACHE_TTL_SECONDS <= 0
+                                  or time.time() - entry[0] <= ANSWER_CACHE_TTL_SECONDS)
+
+def get_cached_answer(nl_query, model, movie_ids):
+    """
+    Cached answer for a question over these retrieved rows
+
+    Returns (answer, match) with match 'exact' or 'similar', or (None, None).
+    """
+    if not _answers.enabled:
+        return None, None
+    group = (model, result_set_hash(movie_ids))
+    key = group + (normalize_query(nl_query),)
+    entry = _answers.get(key)
+    if _fresh(entry):
+        _count('exact_hits')
+        return entry[1], 'exact'
+    if entry is not None:
+        _answers.pop(key)
+        _count('expired')
+
+    if ANSWER_CACHE_SIMILARITY > 0:
+        words = content_words(nl_query)
+        with _index_lock:
+            candidates = list(_by_result_set.get(group, {}).items())
+        best_key, best_score = None, ANSWER_CACHE_SIMILARITY
+        for candidate_key, candidate_words in candidates:
+            score = jaccard(words, candidate_words)
+            if score >= best_score:
+                best_key, best_score = candidate_key, score
+        if best_key is not None:
+            entry = _answers.get(best_key)
+            if _fresh(entry):
+                _count('similar_hits')
+                return entry[1], 'similar'
+
+    _count('misses')
+    return None, None
+
+def store_answer(nl_query, model, movie_ids, answer):
+    """Remember a generated answer (never store fallback answers)"""
+    if not _answers.enabled or not answer:
+        return
+    group = (model, result_set_hash(movie_ids))
+    key = group + (normalize_query(nl_query),)
+    _answers.set(key, (time.time(), answer))
+    _count('stores')
+    if ANSWER_CACHE_SIMILARITY > 0:
+        with _index_lock:
+            _by_result_set.setdefault(group, {})[key] = content_words(nl_query)
+            if sum(len(keys) for keys in _by_result_set.values()) > 2 * _answers.max_size:
+                _prune_index()
+
+def _prune_index():
+    """Drop index entries whose answers were evicted (caller holds _index_lock)"""
+    for group in list(_by_result_set):
+        keys = {key: words for key, words in _by_result_set[group].items() if key in _answers}
+        if keys:
+            _by_result_set[group] = keys
+        else:
+            del _by_result_set[group]
+
+def clear_answer_cache():
+    _answers.clear()
+    with _index_lock:
+        _by_result_set.clear()
+
+def get_answer_cache_stats():
+    """Hit/miss counters for the monitoring endpoint"""
+    with _stats_lock:
+        stats = dict(_stats)
+    lookups = stats['exact_hits'] + stats['similar_hits'] + stats['misses']
+    stats['size'] = len(_answers)
+    stats['hit_rate'] = (stats['exact_hits'] + stats['similar_hits']) / lookups if lookups else 0.0
+    return stats
@@ -22,11 +22,12 @@ from models import Movie, Participant, Task, LogEntry, QuestionnaireResponse
 
 # Import and register routes
 def register_routes():
-    from routes import experiment, search, logging_routes, questionnaire
+    from routes import experiment, search, logging_routes, questionnaire, metrics
     app.register_blueprint(experiment.bp)
     app.register_blueprint(search.bp)
     app.register_blueprint(logging_routes.bp)
     app.register_blueprint(questionnaire.bp)
+    app.register_blueprint(metrics.bp)
 
 register_routes()
 
@@ -50,6 +51,10 @@ def handle_preflight():
         headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization'
         return response
 
+# Drop cached movie data when another process (e.g. preprocess_data.py) has changed it
+from data_access import check_data_version
+app.before_request(check_data_version)
+
 if __name__ == '__main__':
     with app.app_context():
         db.create_all()
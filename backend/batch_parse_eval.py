@@ -0,0 +1,193 @@
+"""
+Batch evaluation of the NL parser against logged parses
+Re-parses the queries of logged nl_query_sent/parsed_preview pairs (or a JSONL
+file of {"query", "parsed"} records) with a pool of workers and a token-bucket
+rate limit, then diffs every new parse against the logged one. Useful to check
+a prompt or model change before it reaches participants. Only previews the LLM
+produced (parsed_preview source 'llm') serve as the logged reference; rule,
+cache and fallback parses are not LLM output.
+
+Distinct queries are parsed once. With --cache, parses go through the persistent
+parse cache, which is keyed by model and PROMPT_VERSION: re-running an eval for
+the same prompt is free, while a bumped PROMPT_VERSION re-parses everything.
+
+Usage:
+    python batch_parse_eval.py --workers 16 --rate 8
+    python batch_parse_eval.py --jsonl recorded_parses.jsonl --cache --output new_parses.jsonl
+
+Python API:
+    from batch_parse_eval import batch_parse, evaluate
+    results = batch_parse(['dramas after 2015', ...], workers=16, rate=8)
+"""
+import argparse
+import json
+import os
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from app import app
+from benchmark_nl_parser import load_logged_pairs, load_jsonl_pairs, field_differences
+from llm_integration import parse_with_llm, PROMPT_VERSION
+from nl_rules import try_parse
+from parse_cache import get_cached_parse, normalize_query
+
+class RateLimiter:
+    """Token bucket: on average at most `rate` acquisitions per second, bursts up to `burst`"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(1.0, rate)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+def parse_one(query, limiter=None, use_cache=False, use_rules=False):
+    """
+    Parse one query inside an app context, like parse_nl_query
+
+    Rule and cache answers skip the rate limit; the cache is looked up once. The
+    source is 'rules', 'cache', 'llm' or 'fallback' (the LLM call failed).
+    """
+    model = os.getenv('OPENAI_MODEL', 'gpt-4')
+    start = time.perf_counter()
+    with app.app_context():
+        parsed = try_parse(query) if use_rules else None
+        source = 'rules'
+        if parsed is None and use_cache:
+            parsed = get_cached_parse(query, model, PROMPT_VERSION)
+            source = 'cache'
+        if parsed is None:
+            if limiter is not None:
+                limiter.acquire()
+            parsed, source = parse_with_llm(query, model, store=use_cache)
+    return {
+        'query': query,
+        'parsed': parsed,
+        'source': source,
+        'latency_ms': (time.perf_counter() - start) * 1000
+    }
+
+def batch_parse(queries, workers=8, rate=None, use_cache=False, use_rules=False):
+    """
+    Parse many queries concurrently
+
+    Args:
+        queries: NL query strings (duplicates, up to normalization, are parsed once)
+        workers: concurrent parse calls
+        rate: optional limit on parse calls per second (token bucket)
+        use_cache: read and fill the persistent parse cache
+        use_rules: let the rule-based fast path answer confident queries
+
+    Returns:
+        dict normalized query -> {'query', 'parsed', 'source', 'latency_ms'}
+    """
+    distinct = {}
+    for query in queries:
+        distinct.setdefault(normalize_query(query), query)
+    limiter = RateLimiter(rate) if rate else None
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = {key: pool.submit(parse_one, query, limiter, use_cache, use_rules)
+                   for key, query in distinct.items()}
+        return {key: future.result() for key, future in futures.items()}
+
+def evaluate(pairs, workers=8, rate=None, use_cache=False, use_rules=False):
+    """
+    Re-parse the queries of (query, logged parse, ...) pairs and diff against the logged parses
+
+    Returns (per-pair results, summary dict).
+    """
+    pairs = [pair for pair in pairs if pair[0]]
+    start = time.perf_counter()
+    parses = batch_parse([pair[0] for pair in pairs], workers=workers, rate=rate,
+                         use_cache=use_cache, use_rules=use_rules)
+    wall_seconds = time.perf_counter() - start
+
+    results = []
+    for query, logged, *_ in pairs:
+        parse = parses[normalize_query(query)]
+        # Empty parses (JSONL records of past LLM failures) are no reference
+        has_reference = bool(logged.get('filters') or logged.get('sort'))
+        results.append({
+            'query': query,
+            'logged': logged,
+            'parsed': parse['parsed'],
+            'source': parse['source'],
+            'latency_ms': parse['latency_ms'],
+            'differences': field_differences(logged, parse['parsed']) if has_reference else None
+        })
+
+    compared = [result for result in results if result['differences'] is not None]
+    agreed = [result for result in compared if not result['differences']]
+    latencies = sorted(parse['latency_ms'] for parse in parses.values())
+    summary = {
+        'pairs': len(pairs),
+        'distinct_queries': len(parses),
+        'sources': dict(Counter(parse['source'] for parse in parses.values())),
+        'empty_parses': sum(1 for parse in parses.values()
+                            if not (parse['parsed'].get('filters') or parse['parsed'].get('sort'))),
+        'compared': len(compared),
+        'agreement': len(agreed) / len(compared) if compared else None,
+        'disagreements_by_field': dict(Counter(field for result in compared for field in result['differences'])),
+        'wall_seconds': wall_seconds,
+        'sum_latency_seconds': sum(latencies) / 1000,
+        'slowest_ms': latencies[-1] if latencies else None
+    }
+    return results, summary
+
+def print_summary(summary):
+    print(f"{summary['pairs']} logged queries, {summary['distinct_queries']} distinct "
+          f"({', '.join(f'{source}={count}' for source, count in summary['sources'].items())})")
+    print(f"wall time {summary['wall_seconds']:.1f} s for {summary['sum_latency_seconds']:.1f} s of parse calls"
+          + (f" (slowest {summary['slowest_ms']:.0f} ms)" if summary['slowest_ms'] is not None else ''))
+    print(f"empty parses (LLM failures or nothing recognized): {summary['empty_parses']}")
+    if summary['agreement'] is not None:
+        print(f"agreement with logged parses: {summary['agreement']:.1%} of {summary['compared']}")
+    if summary['disagreements_by_field']:
+        print("disagreements by field: " + ', '.join(
+            f"{field}={count}" for field, count in Counter(summary['disagreements_by_field']).most_common()))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Re-parse logged NL queries and diff against the logged parses')
+    parser.add_argument('--jsonl', help='read {"query", "parsed"} records instead of the log table')
+    parser.add_argument('--limit', type=int, help='evaluate at most N pairs')
+    parser.add_argument('--workers', type=int, default=8, help='concurrent parse calls')
+    parser.add_argument('--rate', type=float, help='max parse calls per second')
+    parser.add_argument('--cache', action='store_true', help='use the persistent parse cache')
+    parser.add_argument('--rules', action='store_true', help='let the rule-based fast path answer confident queries')
+    parser.add_argument('--output', help='write per-query results to this JSONL file')
+    parser.add_argument('--show-mismatches', action='store_true', help='print queries whose parse changed')
+    args = parser.parse_args()
+
+    pairs = load_jsonl_pairs(args.jsonl) if args.jsonl else load_logged_pairs()
+    if args.limit:
+        pairs = pairs[:args.limit]
+    results, summary = evaluate(pairs, workers=args.workers, rate=args.rate,
+                                use_cache=args.cache, use_rules=args.rules)
+    print_summary(summary)
+
+    if args.show_mismatches:
+        for result in results:
+            if result['differences']:
+                print(f"\n{result['query']!r} differs on {', '.join(result['differences'])}")
+                print(f"  logged: {json.dumps(result['logged'], sort_keys=True)}")
+                print(f"  new:    {json.dumps(result['parsed'], sort_keys=True)}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            for result in results:
+                f.write(json.dumps(result) + '\n')
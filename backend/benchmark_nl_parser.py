@@ -0,0 +1,172 @@
+"""
+Agreement benchmark for the rule-based NL parser (nl_rules) against recorded LLM parses
+Pairs every logged nl_query_sent event with the parsed_preview that followed it when
+that parse came from the LLM (or reads a JSONL file of {"query": ..., "parsed": {...}, "latency_ms": ...} records),
+runs the rule parser on each query and reports, per confidence threshold, how many
+queries would skip the LLM, how often the fast path agrees with the LLM and how
+much LLM latency it would save.
+
+Usage:
+    python benchmark_nl_parser.py
+    python benchmark_nl_parser.py --jsonl recorded_parses.jsonl --show-mismatches
+"""
+import argparse
+import json
+import statistics
+import time
+from collections import Counter
+from app import app
+from models import LogEntry, normalize_genre
+from nl_rules import parse_with_rules, NL_RULES_MIN_CONFIDENCE
+
+THRESHOLDS = [0.5, 0.6, 0.7, 0.8, 0.9, 0.95, 1.0]
+
+# parsed_preview sources that did not come from an LLM completion
+NOT_LLM_SOURCES = ('rules', 'cache', 'fallback')
+
+def load_logged_pairs():
+    """
+    (query, parsed, llm latency ms) for every logged LLM-assisted parse made by the LLM
+    
+    Previews answered by the rule parser, the parse cache or a failed LLM call
+    (parsed_preview source 'rules', 'cache' or 'fallback') are skipped: they are no
+    LLM reference and their latency is not an LLM call's. Previews logged before the
+    source was recorded (the existing study data) are taken as LLM parses; empty
+    ones, past LLM failures, are left out by the callers.
+    """
+    with app.app_context():
+        entries = LogEntry.query.filter(
+            LogEntry.interface_type == 'llm_assist',
+            LogEntry.event_type.in_(['nl_query_sent', 'parsed_preview'])
+        ).order_by(LogEntry.participant_id, LogEntry.task_id, LogEntry.timestamp, LogEntry.id).all()
+
+        pairs = []
+        pending = {}
+        for entry in entries:
+            payload = json.loads(entry.payload) if entry.payload else {}
+            session_key = (entry.participant_id, entry.task_id)
+            if entry.event_type == 'nl_query_sent':
+                pending[session_key] = (payload.get('query'), entry.timestamp)
+            elif session_key in pending:
+                query, sent_at = pending.pop(session_key)
+                if payload.get('source', 'llm') in NOT_LLM_SOURCES:
+                    continue
+                latency_ms = (entry.timestamp - sent_at).total_seconds() * 1000
+                pairs.append((query, payload.get('parsed_query') or {}, latency_ms))
+        return pairs
+
+def load_jsonl_pairs(path):
+    """(query, parsed, latency ms or None) from a JSONL file"""
+    pairs = []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                pairs.append((record['query'], record.get('parsed') or {}, record.get('latency_ms')))
+    return pairs
+
+def normalize_parse(parsed):
+    """Comparable form of a parse: no nulls, numbers as floats, genres as a lower-cased set"""
+    filters = {}
+    for key, value in (parsed.get('filters') or {}).items():
+        if value is None or value == [] or value == '':
+            continue
+        if key == 'genres':
+            value = tuple(sorted({normalize_genre(genre) for genre in value}))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            value = float(value)
+        elif isinstance(value, str):
+            value = ' '.join(value.lower().split())
+        filters[key] = value
+
+    sort = {key: value for key, value in (parsed.get('sort') or {}).items() if value is not None}
+    if sort.get('field') == 'relevance':
+        sort.pop('direction', None)  # relevance is always best first
+    elif sort.get('field'):
+        sort.setdefault('direction', 'asc')  # run_structured_query's default
+    return filters, sort
+
+def field_differences(expected, actual):
+    """Names of filters (and 'sort') on which two parses disagree"""
+    expected_filters, expected_sort = normalize_parse(expected)
+    actual_filters, actual_sort = normalize_parse(actual)
+    differences = [key for key in sorted(set(expected_filters) | set(actual_filters))
+                   if expected_filters.get(key) != actual_filters.get(key)]
+    if expected_sort != actual_sort:
+        differences.append('sort')
+    return differences
+
+def time_rules(query, repeat):
+    """Median rule-parse latency in milliseconds, with the parse and confidence"""
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        parsed, confidence = parse_with_rules(query)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return parsed, confidence, statistics.median(latencies)
+
+def run_benchmark(pairs, repeat=5, show_mismatches=False):
+    """Print coverage/agreement/latency per threshold and return the per-query results"""
+    results = []
+    skipped = 0
+    for query, recorded, llm_ms in pairs:
+        if not query or not (recorded.get('filters') or recorded.get('sort')):
+            skipped += 1  # empty recorded parses are LLM failures, not ground truth
+            continue
+        parsed, confidence, rules_ms = time_rules(query, repeat)
+        results.append({
+            'query': query,
+            'recorded': recorded,
+            'parsed': parsed,
+            'confidence': confidence,
+            'rules_ms': rules_ms,
+            'llm_ms': llm_ms,
+            'differences': field_differences(recorded, parsed)
+        })
+
+    print(f"{len(results)} recorded parses ({skipped} skipped: empty query or parse)")
+    if not results:
+        return results
+
+    rules_latencies = sorted(result['rules_ms'] for result in results)
+    print(f"rule parser latency: median {statistics.median(rules_latencies):.3f} ms, "
+          f"p95 {rules_latencies[int(0.95 * (len(rules_latencies) - 1))]:.3f} ms")
+    llm_latencies = [result['llm_ms'] for result in results if result['llm_ms'] is not None]
+    if llm_latencies:
+        print(f"recorded LLM parse latency: median {statistics.median(llm_latencies):.0f} ms")
+
+    print(f"\n{'threshold':>9} {'fast path':>10} {'agree':>8} {'wrong':>6} {'LLM ms saved':>13}")
+    for threshold in THRESHOLDS:
+        accepted = [result for result in results if result['confidence'] >= threshold]
+        agreed = [result for result in accepted if not result['differences']]
+        saved = sum(result['llm_ms'] or 0 for result in accepted)
+        coverage = len(accepted) / len(results)
+        agreement = len(agreed) / len(accepted) if accepted else 0.0
+        marker = '  <- NL_RULES_MIN_CONFIDENCE' if threshold == NL_RULES_MIN_CONFIDENCE else ''
+        print(f"{threshold:>9.2f} {coverage:>9.1%} {agreement:>7.1%} {len(accepted) - len(agreed):>6} "
+              f"{saved:>13.0f}{marker}")
+
+    accepted = [result for result in results if result['confidence'] >= NL_RULES_MIN_CONFIDENCE]
+    field_counts = Counter(field for result in accepted for field in result['differences'])
+    if field_counts:
+        print(f"\nDisagreements at {NL_RULES_MIN_CONFIDENCE} by field: "
+              + ', '.join(f"{field}={count}" for field, count in field_counts.most_common()))
+
+    if show_mismatches:
+        for result in accepted:
+            if result['differences']:
+                print(f"\n{result['query']!r} (confidence {result['confidence']:.2f})")
+                print(f"  llm:   {json.dumps(result['recorded'], sort_keys=True)}")
+                print(f"  rules: {json.dumps(result['parsed'], sort_keys=True)}")
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the rule-based NL parser with recorded LLM parses')
+    parser.add_argument('--jsonl', help='read {"query", "parsed", "latency_ms"} records instead of the log table')
+    parser.add_argument('--repeat', type=int, default=5, help='timed rule-parser runs per query')
+    parser.add_argument('--show-mismatches', action='store_true',
+                        help='print fast-path parses that disagree with the LLM')
+    args = parser.parse_args()
+
+    pairs = load_jsonl_pairs(args.jsonl) if args.jsonl else load_logged_pairs()
+    run_benchmark(pairs, repeat=args.repeat, show_mismatches=args.show_mismatches)
@@ -0,0 +1,198 @@
+"""
+Load benchmark for the search endpoints
+Drives the faceted, LLM-assisted (parse + execute) and LLM-only endpoints of a
+running backend at several concurrency levels and reports throughput and latency
+percentiles. Run the backend against llm_stub_server.py to load-test the LLM
+paths without an OpenAI key:
+
+    python llm_stub_server.py --latency-ms 1200 &
+    OPENAI_BASE_URL=http://localhost:8001/v1 OPENAI_API_KEY=stub python app.py &
+    python benchmark_search.py --concurrency 1 4 16 --requests 64
+
+Requests are logged like any participant's under --participant-id (default
+"benchmark"), so use a scratch database or delete those log entries afterwards.
+"""
+import argparse
+import json
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+NL_QUERIES = [
+    "Find dramas released after 2015",
+    "movies under 100 minutes with a female lead sorted by highest revenue",
+    "thrillers with a budget under $10M",
+    "comedies from the 90s sorted by year",
+    "sci-fi movies between 2000 and 2010 sorted by runtime descending",
+    "feel-good movies about friendship",
+    "the highest grossing animated movies",
+    "horror films with revenue over 100 million dollars",
+]
+
+FACETED_STATES = [
+    ({'release_year_min': 2016, 'runtime_max': 99}, None),
+    ({'genres': ['Drama', 'Thriller'], 'lead_gender': 'female', 'budget_max': 10000000},
+     {'field': 'revenue', 'direction': 'desc'}),
+    ({'release_year_min': 2000, 'release_year_max': 2009}, {'field': 'release_year', 'direction': 'asc'}),
+    ({'genres': ['Comedy']}, {'field': 'title', 'direction': 'asc'}),
+    ({}, {'field': 'budget', 'direction': 'desc'}),
+]
+
+SCENARIOS = ['faceted', 'llm_assist', 'llm_only', 'llm_only_stream']
+
+def post(base_url, path, body, timeout):
+    """POST JSON and return the decoded response (raises on HTTP errors)"""
+    request = urllib.request.Request(base_url + path, data=json.dumps(body).encode('utf-8'),
+                                     headers={'Content-Type': 'application/json'}, method='POST')
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read())
+
+def timed(function):
+    start = time.perf_counter()
+    result = function()
+    return result, (time.perf_counter() - start) * 1000
+
+class Workload:
+    """One request of a scenario, returning {metric: latency_ms}"""
+
+    def __init__(self, base_url, participant_id, task_id, timeout, page_size):
+        self.base_url = base_url.rstrip('/')
+        self.participant_id = participant_id
+        self.task_id = task_id
+        self.timeout = timeout
+        self.page_size = page_size
+        self.counter = 0
+        self.lock = threading.Lock()
+
+    def next_index(self):
+        with self.lock:
+            self.counter += 1
+            return self.counter
+
+    def body(self, **fields):
+        return {'participant_id': self.participant_id, 'task_id': self.task_id, **fields}
+
+    def faceted(self):
+        filters, sort = FACETED_STATES[self.next_index() % len(FACETED_STATES)]
+        extra = {'page_size': self.page_size} if self.page_size else {}
+        _, elapsed = timed(lambda: post(self.base_url, '/api/search/faceted',
+                                        self.body(filters=filters, sort=sort, **extra), self.timeout))
+        return {'faceted': elapsed}
+
+    def llm_assist(self):
+        """Parse, then execute the unchanged parse with its preview token, as the interface does"""
+        nl_query = NL_QUERIES[self.next_index() % len(NL_QUERIES)]
+        # Same page size on both requests, or the speculated first page cannot be used
+        extra = {'page_size': self.page_size} if self.page_size else {}
+        parsed, parse_ms = timed(lambda: post(self.base_url, '/api/search/llm_assist/parse',
+                                              self.body(nl_query=nl_query, **extra), self.timeout))
+        _, execute_ms = timed(lambda: post(self.base_url, '/api/search/llm_assist/execute',
+                                           self.body(parsed_query=parsed['parsed_query'],
+                                                     preview_token=parsed.get('preview_token'), **extra),
+                                           self.timeout))
+        return {'llm_assist': parse_ms + execute_ms, 'llm_assist.parse': parse_ms,
+                'llm_assist.execute': execute_ms}
+
+    def llm_only(self):
+        nl_query = NL_QUERIES[self.next_index() % len(NL_QUERIES)]
+        _, elapsed = timed(lambda: post(self.base_url, '/api/search/llm_only',
+                                        self.body(nl_query=nl_query), self.timeout))
+        return {'llm_only': elapsed}
+
+    def llm_only_stream(self):
+        """Total time plus time to the first event (the retrieved results)"""
+        nl_query = NL_QUERIES[self.next_index() % len(NL_QUERIES)]
+        request = urllib.request.Request(
+            self.base_url + '/api/search/llm_only/stream',
+            data=json.dumps(self.body(nl_query=nl_query)).encode('utf-8'),
+            headers={'Content-Type': 'application/json'}, method='POST')
+        start = time.perf_counter()
+        first_event_ms = None
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            for line in response:
+                if first_event_ms is None and line.startswith(b'event:'):
+                    first_event_ms = (time.perf_counter() - start) * 1000
+        total_ms = (time.perf_counter() - start) * 1000
+        return {'llm_only_stream': total_ms, 'llm_only_stream.first_event': first_event_ms or total_ms}
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an ascending list"""
+    return sorted_values[min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))]
+
+def run_level(workload, scenario, concurrency, requests):
+    """Run `requests` scenario requests with `concurrency` workers; returns a summary"""
+    latencies = {}
+    errors = []
+    lock = threading.Lock()
+    action = getattr(workload, scenario)
+
+    def one():
+        try:
+            result = action()
+        except (urllib.error.URLError, OSError, ValueError, KeyError) as e:
+            with lock:
+                errors.append(str(e))
+            return
+        with lock:
+            for metric, value in result.items():
+                latencies.setdefault(metric, []).append(value)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for _ in range(requests):
+            pool.submit(one)
+    wall = time.perf_counter() - start
+
+    completed = requests - len(errors)
+    return {
+        'scenario': scenario,
+        'concurrency': concurrency,
+        'requests': requests,
+        'errors': len(errors),
+        'first_error': errors[0] if errors else None,
+        'throughput': completed / wall if wall else 0.0,
+        'latency_ms': {metric: {
+            'p50': percentile(sorted(values), 0.50),
+            'p90': percentile(sorted(values), 0.90),
+            'p99': percentile(sorted(values), 0.99),
+            'mean': statistics.fmean(values),
+        } for metric, values in latencies.items()}
+    }
+
+def print_summary(summary):
+    print(f"\n{summary['scenario']} @ concurrency {summary['concurrency']}: "
+          f"{summary['requests']} requests, {summary['errors']} errors, {summary['throughput']:.2f} req/s")
+    if summary['first_error']:
+        print(f"  first error: {summary['first_error']}")
+    for metric, stats in sorted(summary['latency_ms'].items()):
+        print(f"  {metric:<30} p50 {stats['p50']:>9.1f}  p90 {stats['p90']:>9.1f}  "
+              f"p99 {stats['p99']:>9.1f}  mean {stats['mean']:>9.1f} ms")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Throughput and latency benchmark for the search endpoints')
+    parser.add_argument('--base-url', default='http://localhost:5001', help='backend URL')
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument('--concurrency', nargs='+', type=int, default=[1, 4, 16])
+    parser.add_argument('--requests', type=int, default=32, help='requests per scenario and concurrency level')
+    parser.add_argument('--page-size', type=int, default=0,
+                        help='request paginated results of this size (0 = full result lists)')
+    parser.add_argument('--participant-id', default='benchmark')
+    parser.add_argument('--task-id', default='BENCH')
+    parser.add_argument('--timeout', type=float, default=120)
+    parser.add_argument('--json', help='also write the summaries to this file')
+    args = parser.parse_args()
+
+    workload = Workload(args.base_url, args.participant_id, args.task_id, args.timeout, args.page_size)
+    summaries = []
+    for scenario in args.scenarios:
+        for concurrency in args.concurrency:
+            summary = run_level(workload, scenario, concurrency, args.requests)
+            print_summary(summary)
+            summaries.append(summary)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(summaries, f, indent=2)
@@ -1,12 +1,60 @@
 """
 Data Access Layer: Handles structured queries on the movies dataset
+
+Everything derived from the movies table (query results, catalog, encoded rows,
+RAG answers, the in-memory index) is cached per process and dropped when the
+data changes: immediately for changes committed by this process, and within
+DATA_VERSION_CHECK_SECONDS for changes made by another process (e.g.
+preprocess_data.py), which bump the movies row of the data_versions table.
+
+Configuration (environment):
+    DATA_VERSION_CHECK_SECONDS    how often requests re-read the data version (default 1)
 """
 from database import db
-from models import Movie
-from sqlalchemy import and_, or_
+from models import Movie, MovieGenre, DataVersion, normalize_genre
+from movie_index import get_movie_index, reset_movie_index, normalize_sort, RANGE_FIELDS
+from full_text import match_subquery, normalize_text_query, reset_full_text_state
+from semantic_index import get_semantic_index, reset_semantic_index
+from answer_cache import clear_answer_cache
+from caching import LRUCache
+from sqlalchemy import and_, or_, select, event, func, literal, insert, update
+from sqlalchemy.orm import Session
+from datetime import datetime
+import base64
+import itertools
 import json
+import os
+import threading
+import time
+
+# Fields of Movie.to_dict, in output order
+MOVIE_FIELDS = ['id', 'title', 'release_year', 'runtime', 'genres', 'lead_gender',
+                'budget', 'revenue', 'language', 'overview']
+_FULL_ROW_KEYS = frozenset(MOVIE_FIELDS)
+
+# Structured query results keyed by canonical_query_key (QUERY_CACHE_SIZE=0 disables)
+_query_cache = LRUCache(int(os.getenv('QUERY_CACHE_SIZE', '256')))
+
+# Genre list and dataset statistics, computed on first use
+_catalog = {}
+
+# Pre-encoded JSON of full movie rows keyed by id (ROW_JSON_CACHE_SIZE=0 disables)
+_row_json_cache = LRUCache(int(os.getenv('ROW_JSON_CACHE_SIZE', '20000')))
 
-def run_structured_query(filters=None, sort=None, limit=1000):
+# Bumped whenever the movies table changes, so in-flight results are not cached
+_movies_generation = 0
+
+DATA_VERSION_CHECK_SECONDS = float(os.getenv('DATA_VERSION_CHECK_SECONDS', '1'))
+
+# Movies data version (data_versions table) the caches were built from, and when it was last read
+_data_version = {'version': None, 'checked_at': 0.0}
+_data_version_lock = threading.Lock()
+
+def copy_rows(rows):
+    """Copies of movie dicts that callers may modify (cached rows are shared between requests)"""
+    return [dict(row, genres=list(row['genres'])) if 'genres' in row else dict(row) for row in rows]
+
+def run_structured_query(filters=None, sort=None, limit=1000, after=None):
     """
     Execute a structured query on movies table
     
@@ -22,22 +70,191 @@ def run_structured_query(filters=None, sort=None, limit=1000):
             - budget_max: float
             - revenue_min: float
             - revenue_max: float
-        sort: dict with 'field' and 'direction' ('asc' or 'desc')
+            - text: keywords that must all appear in the title or overview
+        sort: dict with 'field' and 'direction' ('asc' or 'desc'); field 'relevance'
+            orders keyword matches best first and adds a 'relevance' score to each row
         limit: max number of results
+        after: optional keyset position (sort value, id) of the last row already
+            returned; only rows after it in sort order are returned
     
     Returns:
         list of Movie dicts
     """
+    cache_key = canonical_query_key(filters, sort, limit, after)
+    cached = _query_cache.get(cache_key)
+    if cached is not None:
+        return copy_rows(cached)
+    generation = _movies_generation
+    
+    # Optional in-memory engine (MOVIE_QUERY_ENGINE=index) with identical results
+    if use_movie_index():
+        results = get_movie_index().query(filters=filters, sort=sort, limit=limit, after=after)
+    else:
+        movies = build_movie_query(filters=filters, sort=sort, after=after).limit(limit).all()
+        if normalize_sort(sort)[0] == 'relevance':
+            results = [dict(movie.to_dict(), relevance=float(score)) for movie, score in movies]
+        else:
+            results = [movie.to_dict() for movie in movies]
+    
+    # Skip caching if the movies table changed while the query was running
+    if generation == _movies_generation:
+        _query_cache.set(cache_key, tuple(results))
+    return copy_rows(results)
+
+def canonical_query_key(filters=None, sort=None, limit=1000, after=None):
+    """
+    Canonical cache key for a structured query
+    
+    Equivalent requests map to the same key: empty/zero filter values are dropped
+    (they are ignored by the query), genres are de-duplicated, lower-cased and
+    sorted, numbers are compared as floats and sort defaults are filled in.
+    """
+    key_filters = []
+    if filters:
+        if normalize_text_query(filters.get('text')):
+            key_filters.append(('text', normalize_text_query(filters['text'])))
+        if filters.get('genres'):
+            genres = sorted({normalize_genre(genre) for genre in filters['genres']})
+            key_filters.append(('genres', tuple(genres)))
+        if filters.get('lead_gender'):
+            key_filters.append(('lead_gender', filters['lead_gender']))
+        for field in RANGE_FIELDS:
+            for bound in ('min', 'max'):
+                value = filters.get(f'{field}_{bound}')
+                if value:
+                    try:
+                        value = float(value)
+                    except (TypeError, ValueError):
+                        value = str(value)
+                    key_filters.append((f'{field}_{bound}', value))
+    
+    after = tuple(after) if after is not None else None
+    return (tuple(key_filters), normalize_sort(sort), limit, after)
+
+def invalidate_movie_caches():
+    """Drop every cache derived from the movies table"""
+    global _movies_generation, _genre_table_ready
+    _movies_generation += 1
+    _query_cache.clear()
+    _catalog.clear()
+    _row_json_cache.clear()
+    clear_answer_cache()
+    reset_movie_index()
+    reset_full_text_state()
+    reset_semantic_index()
+    _genre_table_ready = False
+
+def _bump_data_version(connection):
+    """Increment the movies data version within the connection's transaction; returns the new version"""
+    now = datetime.utcnow()
+    result = connection.execute(update(DataVersion).where(DataVersion.name == 'movies')
+                                .values(version=DataVersion.version + 1, updated_at=now))
+    if not result.rowcount:
+        connection.execute(insert(DataVersion).values(name='movies', version=1, updated_at=now))
+    return connection.execute(select(DataVersion.version).where(DataVersion.name == 'movies')).scalar()
+
+def bump_data_version():
+    """Make every server process drop its movie caches (after loading data or rebuilding indexes)"""
+    with db.engine.begin() as connection:
+        return _bump_data_version(connection)
+
+def check_data_version():
+    """
+    Drop this process's movie caches if another process changed the data
+    
+    Called before every request; the version is read at most once every
+    DATA_VERSION_CHECK_SECONDS, so stale data is served for at most that long.
+    """
+    now = time.monotonic()
+    with _data_version_lock:
+        if now - _data_version['checked_at'] < DATA_VERSION_CHECK_SECONDS:
+            return
+        _data_version['checked_at'] = now
+    try:
+        with db.engine.connect() as connection:
+            version = connection.execute(
+                select(DataVersion.version).where(DataVersion.name == 'movies')
+            ).scalar() or 0
+    except Exception as e:
+        print(f"Data version check failed: {e}")
+        return
+    with _data_version_lock:
+        seen, _data_version['version'] = _data_version['version'], version
+    if seen is not None and version != seen:
+        invalidate_movie_caches()
+
+def get_query_cache_stats():
+    """Hit/miss counters of the structured query cache"""
+    return _query_cache.stats()
+
+@event.listens_for(Session, 'after_flush')
+def _track_movie_changes(session, flush_context):
+    """Remember whether a flush touched the movies tables and bump the data version in the same transaction"""
+    changed = itertools.chain(session.new, session.dirty, session.deleted)
+    if any(isinstance(obj, (Movie, MovieGenre)) for obj in changed):
+        session.info['movies_changed'] = True
+        if 'movies_version' not in session.info:
+            session.info['movies_version'] = _bump_data_version(session.connection())
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_after_movie_commit(session):
+    """Invalidate movie caches once changes to the movies tables are committed"""
+    version = session.info.pop('movies_version', None)
+    if session.info.pop('movies_changed', False):
+        invalidate_movie_caches()
+        if version is not None:
+            with _data_version_lock:
+                _data_version['version'] = version  # already invalidated for our own change
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_movie_changes(session):
+    session.info.pop('movies_changed', None)
+    session.info.pop('movies_version', None)
+
+def use_movie_index():
+    """Whether structured queries are answered from the in-memory movie index"""
+    return os.getenv('MOVIE_QUERY_ENGINE', 'sql').lower() == 'index'
+
+_genre_table_ready = False
+
+def genre_table_ready():
+    """Whether movie_genres has been populated (see preprocess_data.sync_movie_genres)"""
+    global _genre_table_ready
+    if not _genre_table_ready:
+        _genre_table_ready = db.session.query(MovieGenre.movie_id).first() is not None
+    return _genre_table_ready
+
+def build_movie_query(filters=None, sort=None, indexed_genres=None, after=None):
+    """
+    Build the SQLAlchemy query for run_structured_query (without the limit)
+    
+    indexed_genres forces the movie_genres lookup on or off; by default it is
+    used once the table has been populated. after is a keyset position as in
+    run_structured_query.
+    """
     query = Movie.query
+    if indexed_genres is None:
+        indexed_genres = genre_table_ready()
+    
+    # Keyword filter: join the full-text matches (their score drives relevance sorting)
+    text_match = match_subquery(filters.get('text')) if filters else None
+    if text_match is not None:
+        query = query.join(text_match, text_match.c.movie_id == Movie.id)
     
     if filters:
-        # Genre filter (genres stored as JSON array string)
+        # Genre filter (OR of genres), an indexed lookup on the movie_genres table
         if 'genres' in filters and filters['genres']:
-            genre_conditions = []
-            for genre in filters['genres']:
-                genre_conditions.append(Movie.genres.contains(f'"{genre}"'))
-            if genre_conditions:
-                query = query.filter(or_(*genre_conditions))
+            if indexed_genres:
+                genre_keys = sorted({normalize_genre(genre) for genre in filters['genres']})
+                matching_ids = select(MovieGenre.movie_id).where(MovieGenre.genre.in_(genre_keys))
+                query = query.filter(Movie.id.in_(matching_ids))
+            else:
+                # movie_genres not populated yet: scan the JSON string instead
+                genre_conditions = []
+                for genre in filters['genres']:
+                    genre_conditions.append(Movie.genres.contains(f'"{genre}"'))
+                if genre_conditions:
+                    query = query.filter(or_(*genre_conditions))
         
         # Lead gender filter
         if 'lead_gender' in filters and filters['lead_gender']:
@@ -67,7 +284,7 @@ def run_structured_query(filters=None, sort=None, limit=1000):
         if 'revenue_max' in filters and filters['revenue_max']:
             query = query.filter(Movie.revenue <= filters['revenue_max'])
     
-    # Sorting
+    # Sorting (NULLs first ascending / last descending on every backend, ties broken by id)
     if sort:
         field = sort.get('field')
         direction = sort.get('direction', 'asc')
@@ -82,19 +299,159 @@ def run_structured_query(filters=None, sort=None, limit=1000):
             order_field = Movie.revenue
         elif field == 'title':
             order_field = Movie.title
+        elif field == 'relevance':
+            # Best matches first; every row scores 0 without a keyword filter
+            order_field = text_match.c.score if text_match is not None else literal(0.0)
+            direction = 'desc'
+            query = query.add_columns(order_field.label('relevance'))
         else:
             order_field = Movie.id
         
         if direction == 'desc':
-            query = query.order_by(order_field.desc())
+            query = query.order_by(order_field.desc().nulls_last(), Movie.id)
         else:
-            query = query.order_by(order_field.asc())
+            query = query.order_by(order_field.asc().nulls_first(), Movie.id)
     else:
+        order_field, direction = Movie.id, 'asc'
         query = query.order_by(Movie.id)
     
-    # Limit results
-    movies = query.limit(limit).all()
-    return [movie.to_dict() for movie in movies]
+    # Keyset pagination: rows strictly after (value, id) in the order above
+    if after is not None:
+        value, last_id = after
+        tie = and_(order_field == value, Movie.id > last_id)
+        if direction == 'desc':
+            if value is None:
+                query = query.filter(order_field.is_(None), Movie.id > last_id)
+            else:
+                query = query.filter(or_(order_field < value, tie, order_field.is_(None)))
+        else:
+            if value is None:
+                query = query.filter(or_(and_(order_field.is_(None), Movie.id > last_id),
+                                         order_field.isnot(None)))
+            else:
+                query = query.filter(or_(order_field > value, tie))
+    
+    return query
+
+def encode_cursor(sort, row):
+    """Opaque keyset cursor pointing just after the given row"""
+    field, direction = normalize_sort(sort)
+    position = [field, direction, row.get(field), row['id']]
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+def decode_cursor(cursor, sort):
+    """Keyset position (value, id) from a cursor; raises ValueError if invalid for this sort"""
+    try:
+        field, direction, value, last_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        last_id = int(last_id)
+    except (AttributeError, TypeError, ValueError):
+        raise ValueError('Invalid cursor')
+    if (field, direction) != normalize_sort(sort):
+        raise ValueError('Cursor does not match the requested sort')
+    return value, last_id
+
+def serialize_movie_rows(rows):
+    """
+    Encode movie dicts as a JSON array
+    
+    Full rows (exactly the MOVIE_FIELDS keys) are encoded once and their JSON
+    fragments reused across responses. Anything else, projected rows or rows
+    carrying a query's relevance score, is encoded directly: a fragment is shared
+    by every query returning that movie.
+    """
+    fragments = []
+    for row in rows:
+        if row.keys() == _FULL_ROW_KEYS:
+            fragment = _row_json_cache.get(row['id'])
+            if fragment is None:
+                fragment = json.dumps(row, separators=(',', ':'))
+                _row_json_cache.set(row['id'], fragment)
+        else:
+            fragment = json.dumps(row, separators=(',', ':'))
+        fragments.append(fragment)
+    return '[' + ','.join(fragments) + ']'
+
+def get_row_json_cache_stats():
+    """Hit/miss counters of the pre-encoded row cache"""
+    return _row_json_cache.stats()
+
+def project_rows(rows, fields=None):
+    """Keep only the requested movie fields ('id', and 'relevance' when present, are always included)"""
+    if not fields:
+        return rows
+    unknown = set(fields) - set(MOVIE_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+    keep = ['id'] + [field for field in MOVIE_FIELDS if field in fields and field != 'id']
+    return [
+        {field: row[field] for field in keep + (['relevance'] if 'relevance' in row else [])}
+        for row in rows
+    ]
+
+def run_paginated_query(filters=None, sort=None, page_size=100, cursor=None, fields=None):
+    """
+    Fetch one page of a structured query
+    
+    Args:
+        filters, sort: as in run_structured_query
+        page_size: number of rows per page
+        cursor: next_cursor from the previous page, or None for the first page
+        fields: optional list of movie fields to return
+    
+    Returns:
+        (list of Movie dicts, next_cursor or None when there are no more rows)
+    """
+    after = decode_cursor(cursor, sort) if cursor else None
+    rows = run_structured_query(filters=filters, sort=sort, limit=page_size + 1, after=after)
+    return paginate_rows(rows, sort, page_size, fields)
+
+def get_result_ids(filters=None, sort=None, limit=None):
+    """
+    Ids of every row of a structured query, in sort order (limit=None: no limit)
+    
+    The query's whole result, e.g. for logging while the client is sent one page
+    of it. Only ids are fetched; results are cached like run_structured_query's.
+    """
+    cache_key = ('ids',) + canonical_query_key(filters, sort, limit)
+    cached = _query_cache.get(cache_key)
+    if cached is not None:
+        return list(cached)
+    generation = _movies_generation
+    
+    if use_movie_index():
+        ids = [row['id'] for row in get_movie_index().query(filters=filters, sort=sort, limit=limit)]
+    else:
+        query = build_movie_query(filters=filters, sort=sort).with_entities(Movie.id)
+        if limit is not None:
+            query = query.limit(limit)
+        ids = [movie_id for (movie_id,) in query]
+    
+    if generation == _movies_generation:
+        _query_cache.set(cache_key, tuple(ids))
+    return ids
+
+def paginate_rows(rows, sort, page_size, fields=None):
+    """
+    Cut a page from rows fetched with a limit above page_size
+    
+    Returns (page, next_cursor or None), like run_paginated_query.
+    """
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = encode_cursor(sort, rows[-1])
+    return project_rows(rows, fields), next_cursor
+
+def get_facet_counts(filters=None):
+    """
+    Facet counts for a filter state: per-genre and per-lead_gender counts plus
+    histogram buckets for year/runtime/budget/revenue, from precomputed bitsets
+    
+    Always answered by the in-memory MovieIndex (built on first use), also when
+    MOVIE_QUERY_ENGINE is 'sql': counting every facet value with all-but-one filter
+    applied would take one GROUP BY query per facet in SQL.
+    """
+    return get_movie_index().facet_counts(filters)
 
 def get_movie_by_id(movie_id):
     """Get a single movie by ID"""
@@ -106,32 +463,71 @@ def get_movies_by_ids(movie_ids):
     movies = Movie.query.filter(Movie.id.in_(movie_ids)).all()
     return [movie.to_dict() for movie in movies]
 
+def get_matching_ids(filters):
+    """Ids of every movie matching the filters (unordered, no limit)"""
+    if use_movie_index():
+        index = get_movie_index()
+        return index.ids[index.filter_mask(filters)].tolist()
+    return [movie_id for (movie_id,) in build_movie_query(filters=filters).with_entities(Movie.id)]
+
+def semantic_search_movies(query_text, filters=None, limit=50):
+    """
+    Movies ranked by semantic similarity of their overview to query_text
+    
+    Structured filters restrict the candidates first; the keyword filter is
+    ignored because the semantic ranking already covers the topic. Returns None
+    when the semantic index has not been built or knows none of the query words.
+    """
+    index = get_semantic_index()
+    if index is None:
+        return None
+    
+    filters = {key: value for key, value in (filters or {}).items()
+               if key != 'text' and value not in (None, '', [])}
+    allowed_ids = get_matching_ids(filters) if filters else None
+    ranked = index.search(query_text, k=limit, allowed_ids=allowed_ids)
+    if not ranked:
+        return None
+    
+    movies = {movie['id']: movie for movie in get_movies_by_ids([movie_id for movie_id, _ in ranked])}
+    return [movies[movie_id] for movie_id, _ in ranked if movie_id in movies]
+
 def get_all_genres():
-    """Get all unique genres from the database"""
-    movies = Movie.query.all()
-    genres_set = set()
-    for movie in movies:
-        if movie.genres:
-            try:
-                genres = json.loads(movie.genres)
-                genres_set.update(genres)
-            except:
-                pass
-    return sorted(list(genres_set))
+    """Get all unique genres from the database (computed once per data change)"""
+    genres = _catalog.get('genres')
+    if genres is None:
+        generation = _movies_generation
+        genres_set = set()
+        for (genres_json,) in db.session.query(Movie.genres):
+            if genres_json:
+                try:
+                    genres_set.update(json.loads(genres_json))
+                except (TypeError, ValueError):
+                    pass
+        genres = tuple(sorted(genres_set))
+        if generation == _movies_generation:
+            _catalog['genres'] = genres
+    return list(genres)
 
 def get_statistics():
-    """Get dataset statistics"""
-    total_movies = Movie.query.count()
-    movies_with_year = Movie.query.filter(Movie.release_year.isnot(None)).count()
-    movies_with_runtime = Movie.query.filter(Movie.runtime.isnot(None)).count()
-    movies_with_budget = Movie.query.filter(Movie.budget.isnot(None)).count()
-    movies_with_revenue = Movie.query.filter(Movie.revenue.isnot(None)).count()
-    
-    return {
-        'total_movies': total_movies,
-        'movies_with_year': movies_with_year,
-        'movies_with_runtime': movies_with_runtime,
-        'movies_with_budget': movies_with_budget,
-        'movies_with_revenue': movies_with_revenue
-    }
-
+    """Get dataset statistics (one aggregate query, computed once per data change)"""
+    statistics = _catalog.get('statistics')
+    if statistics is None:
+        generation = _movies_generation
+        counts = db.session.query(
+            func.count(Movie.id),
+            func.count(Movie.release_year),
+            func.count(Movie.runtime),
+            func.count(Movie.budget),
+            func.count(Movie.revenue)
+        ).one()
+        statistics = {
+            'total_movies': counts[0],
+            'movies_with_year': counts[1],
+            'movies_with_runtime': counts[2],
+            'movies_with_budget': counts[3],
+            'movies_with_revenue': counts[4]
+        }
+        if generation == _movies_generation:
+            _catalog['statistics'] = statistics
+    return dict(statistics)
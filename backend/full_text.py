@@ -0,0 +1,116 @@
+"""
+Full-text search over movie titles and overviews
+SQLite uses an FTS5 table (movies_fts) ranked with BM25; PostgreSQL uses a GIN
+index on a tsvector expression ranked with ts_rank. Both are built by
+preprocess_data.py; without them keyword filters fall back to LIKE matching.
+"""
+import re
+from sqlalchemy import text, func, and_, or_, select, literal, column, table
+from database import db
+from models import Movie
+
+FTS_TABLE = 'movies_fts'
+PG_INDEX = 'ix_movies_fulltext'
+
+# Text configuration used by PostgreSQL for both the index and queries
+PG_TEXT_CONFIG = 'english'
+
+def keyword_tokens(query_text):
+    """Lower-cased word tokens of a keyword query"""
+    return re.findall(r'\w+', str(query_text or '').lower())
+
+def normalize_text_query(query_text):
+    """Canonical form of a keyword query (used for cache keys)"""
+    return ' '.join(keyword_tokens(query_text))
+
+def build_full_text_index():
+    """Create (or rebuild) the full-text index for the current database"""
+    dialect = db.engine.dialect.name
+    if dialect == 'sqlite':
+        db.session.execute(text(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+            f"title, overview, content='movies', content_rowid='id')"
+        ))
+        db.session.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES('rebuild')"))
+    elif dialect == 'postgresql':
+        db.session.execute(text(
+            f"CREATE INDEX IF NOT EXISTS {PG_INDEX} ON movies USING GIN ("
+            f"to_tsvector('{PG_TEXT_CONFIG}', coalesce(title, '') || ' ' || coalesce(overview, '')))"
+        ))
+    else:
+        print(f"Full-text index not supported for {dialect}; keyword filters will use LIKE")
+        return False
+    db.session.commit()
+    reset_full_text_state()
+    return True
+
+_full_text_ready = False
+
+def full_text_ready():
+    """Whether the dialect's full-text index exists (falls back to LIKE otherwise)"""
+    global _full_text_ready
+    if not _full_text_ready:
+        dialect = db.engine.dialect.name
+        if dialect == 'sqlite':
+            found = db.session.execute(
+                text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                {'name': FTS_TABLE}
+            ).first()
+            _full_text_ready = found is not None
+        else:
+            _full_text_ready = dialect == 'postgresql'
+    return _full_text_ready
+
+def reset_full_text_state():
+    """Forget the cached index check (after building or dropping the index)"""
+    global _full_text_ready
+    _full_text_ready = False
+
+def match_subquery(query_text):
+    """
+    Subquery of (movie_id, score) for movies matching all keywords
+
+    Higher scores are more relevant. Returns None when the query has no keywords.
+    """
+    tokens = keyword_tokens(query_text)
+    if not tokens:
+        return None
+
+    dialect = db.engine.dialect.name
+    if full_text_ready() and dialect == 'sqlite':
+        # Quote every token so user input cannot inject FTS5 query syntax
+        match = ' '.join(f'"{token}"' for token in tokens)
+        fts = table(FTS_TABLE, column('rowid'), column(FTS_TABLE))
+        return select(
+            fts.c.rowid.label('movie_id'),
+            (-func.bm25(text(FTS_TABLE))).label('score')
+        ).where(fts.c[FTS_TABLE].op('MATCH')(match)).subquery('text_match')
+
+    if full_text_ready() and dialect == 'postgresql':
+        document = func.to_tsvector(
+            PG_TEXT_CONFIG,
+            func.coalesce(Movie.title, '') + ' ' + func.coalesce(Movie.overview, '')
+        )
+        ts_query = func.plainto_tsquery(PG_TEXT_CONFIG, ' '.join(tokens))
+        return select(
+            Movie.id.label('movie_id'),
+            func.ts_rank(document, ts_query).label('score')
+        ).where(document.op('@@')(ts_query)).subquery('text_match')
+
+    # No full-text index: every keyword must appear in the title or overview
+    conditions = [
+        or_(Movie.title.ilike(f'%{token}%'), Movie.overview.ilike(f'%{token}%'))
+        for token in tokens
+    ]
+    return select(
+        Movie.id.label('movie_id'),
+        literal(0.0).label('score')
+    ).where(and_(*conditions)).subquery('text_match')
+
+def match_scores(query_text):
+    """Dict of movie id -> relevance score for movies matching the keywords"""
+    subquery = match_subquery(query_text)
+    if subquery is None:
+        return {}
+    rows = db.session.execute(select(subquery.c.movie_id, subquery.c.score)).all()
+    return {movie_id: float(score) for movie_id, score in rows}
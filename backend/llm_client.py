@@ -0,0 +1,182 @@
+"""
+LLM transport: one pooled OpenAI client with timeouts and a retry policy
+All chat-completion calls go through chat_completion(), which
+- reuses keep-alive connections from a shared httpx pool,
+- retries rate limits (429), server errors (5xx), timeouts and connection errors
+  with exponential backoff and full jitter (honouring Retry-After),
+- remembers per model which sampling parameters it rejects, so the
+  temperature=0 fallback costs one extra request per process instead of one per call.
+
+Configuration (environment):
+    OPENAI_TIMEOUT            seconds per request (default 60)
+    OPENAI_CONNECT_TIMEOUT    seconds to establish a connection (default 5)
+    OPENAI_MAX_RETRIES        retries after the first attempt (default 3)
+    OPENAI_BACKOFF_BASE       first backoff in seconds (default 0.5)
+    OPENAI_BACKOFF_MAX        backoff cap in seconds (default 8)
+    OPENAI_MAX_CONNECTIONS    connection pool size (default 20)
+    OPENAI_BASE_URL           alternative OpenAI-compatible endpoint (default: api.openai.com)
+"""
+import atexit
+import os
+import random
+import threading
+import time
+
+OPENAI_TIMEOUT = float(os.getenv('OPENAI_TIMEOUT', '60'))
+OPENAI_CONNECT_TIMEOUT = float(os.getenv('OPENAI_CONNECT_TIMEOUT', '5'))
+OPENAI_MAX_RETRIES = int(os.getenv('OPENAI_MAX_RETRIES', '3'))
+OPENAI_BACKOFF_BASE = float(os.getenv('OPENAI_BACKOFF_BASE', '0.5'))
+OPENAI_BACKOFF_MAX = float(os.getenv('OPENAI_BACKOFF_MAX', '8'))
+OPENAI_MAX_CONNECTIONS = int(os.getenv('OPENAI_MAX_CONNECTIONS', '20'))
+
+# Sampling parameters dropped together when a model rejects one of them
+SAMPLING_PARAMS = ('temperature', 'top_p')
+
+# Lazy initialization of OpenAI client
+_client = None
+_client_lock = threading.Lock()
+
+# model -> sampling parameters it rejected
+_unsupported_params = {}
+
+_stats_lock = threading.Lock()
+_stats = {'calls': 0, 'retries': 0, 'failures': 0, 'capability_fallbacks': 0}
+
+def _count(name, amount=1):
+    with _stats_lock:
+        _stats[name] += amount
+
+def get_client():
+    """Get or create the shared OpenAI client (lazy initialization)"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                api_key = os.getenv('OPENAI_API_KEY')
+                if not api_key:
+                    raise ValueError("OPENAI_API_KEY environment variable is not set")
+                try:
+                    import httpx
+                    from openai import OpenAI
+                    http_client = httpx.Client(
+                        timeout=httpx.Timeout(OPENAI_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT),
+                        limits=httpx.Limits(
+                            max_connections=OPENAI_MAX_CONNECTIONS,
+                            max_keepalive_connections=OPENAI_MAX_CONNECTIONS
+                        )
+                    )
+                    # Retries are handled by chat_completion, not the SDK. OPENAI_BASE_URL points
+                    # the client at any OpenAI-compatible server (e.g. llm_stub_server.py)
+                    _client = OpenAI(api_key=api_key, base_url=os.getenv('OPENAI_BASE_URL') or None,
+                                     http_client=http_client, max_retries=0)
+                except Exception as e:
+                    raise ValueError(f"Failed to initialize OpenAI client: {e}")
+    return _client
+
+def close_client():
+    """Close pooled connections (the next call creates a new client)"""
+    global _client
+    with _client_lock:
+        if _client is not None:
+            try:
+                _client.close()
+            except Exception:
+                pass
+            _client = None
+
+atexit.register(close_client)
+
+def status_code(error):
+    """HTTP status of an SDK error, if any"""
+    code = getattr(error, 'status_code', None)
+    if code is None:
+        code = getattr(getattr(error, 'response', None), 'status_code', None)
+    return code
+
+def is_retryable(error):
+    """Rate limits, server errors, timeouts and dropped connections are worth retrying"""
+    code = status_code(error)
+    if code is not None:
+        return code == 429 or code == 408 or code >= 500
+    name = type(error).__name__
+    return name in ('APIConnectionError', 'APITimeoutError') or isinstance(error, (ConnectionError, TimeoutError))
+
+def rejected_sampling_param(error):
+    """
+    Whether the model rejected temperature/top_p (the request itself is fine otherwise)
+
+    Only a 400 whose error body names one of the parameters counts: anything else
+    (a connection error, a 422 about the messages, an "unsupported" without the
+    parameter) is a real failure and must not disable sampling for the model.
+    """
+    if status_code(error) != 400:
+        return False
+    body = getattr(error, 'body', None)
+    if isinstance(body, dict):
+        if body.get('param') in SAMPLING_PARAMS:
+            return True
+        message = str(body.get('message') or '')
+    else:
+        message = str(getattr(error, 'message', None) or error)
+    message = message.lower()
+    return any(param in message for param in SAMPLING_PARAMS)
+
+def backoff_delay(attempt, error=None):
+    """Seconds to wait before retry number attempt (0-based): full jitter, Retry-After wins"""
+    headers = getattr(getattr(error, 'response', None), 'headers', None) or {}
+    retry_after = headers.get('retry-after') if hasattr(headers, 'get') else None
+    if retry_after:
+        try:
+            return min(float(retry_after), OPENAI_BACKOFF_MAX)
+        except ValueError:
+            pass
+    return random.uniform(0, min(OPENAI_BACKOFF_MAX, OPENAI_BACKOFF_BASE * (2 ** attempt)))
+
+def chat_completion(messages, model=None, stream=False, timeout=None, max_retries=None, call=None, **params):
+    """
+    Create a chat completion with the shared client and retry policy
+
+    Sampling parameters the model has rejected before are left out. Returns the
+    SDK response (or stream iterator when stream=True; only opening the stream is
+    retried). Raises the last error once retries are exhausted. Retries are also
+    counted on call, an llm_metrics.LLMCall, when given.
+    """
+    client = get_client()
+    model = model or os.getenv('OPENAI_MODEL', 'gpt-4')
+    max_retries = OPENAI_MAX_RETRIES if max_retries is None else max_retries
+    _count('calls')
+
+    attempt = 0
+    while True:
+        unsupported = _unsupported_params.get(model, ())
+        request = {key: value for key, value in params.items() if key not in unsupported}
+        if timeout is not None:
+            request['timeout'] = timeout
+        if stream:
+            request['stream'] = True
+        try:
+            return client.chat.completions.create(model=model, messages=messages, **request)
+        except Exception as error:
+            if not unsupported and any(key in params for key in SAMPLING_PARAMS) and rejected_sampling_param(error):
+                # Remember for this process; retry at once with the model's defaults
+                print(f"Model {model} doesn't support {'/'.join(SAMPLING_PARAMS)}, using defaults from now on")
+                _unsupported_params[model] = SAMPLING_PARAMS
+                _count('capability_fallbacks')
+                continue
+            if attempt >= max_retries or not is_retryable(error):
+                _count('failures')
+                raise
+            delay = backoff_delay(attempt, error)
+            print(f"LLM call failed ({error}); retrying in {delay:.2f}s")
+            _count('retries')
+            if call is not None:
+                call.retries += 1
+            attempt += 1
+            time.sleep(delay)
+
+def get_llm_client_stats():
+    """Call/retry counters for the monitoring endpoint"""
+    with _stats_lock:
+        stats = dict(_stats)
+    stats['unsupported_params'] = {model: list(params) for model, params in _unsupported_params.items()}
+    return stats
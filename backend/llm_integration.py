@@ -1,26 +1,18 @@
 """
 LLM Integration Layer: Handles LLM calls for parsing NL queries and RAG-based answering
 """
+import copy
+import hashlib
 import os
 import json
 import re
-
-# Lazy initialization of OpenAI client
-_client = None
-
-def get_client():
-    """Get or create OpenAI client (lazy initialization)"""
-    global _client
-    if _client is None:
-        api_key = os.getenv('OPENAI_API_KEY')
-        if not api_key:
-            raise ValueError("OPENAI_API_KEY environment variable is not set")
-        try:
-            from openai import OpenAI
-            _client = OpenAI(api_key=api_key)
-        except Exception as e:
-            raise ValueError(f"Failed to initialize OpenAI client: {e}")
-    return _client
+from parse_cache import get_cached_parse, store_parse, normalize_query
+from singleflight import SingleFlight
+from nl_rules import try_parse
+from llm_client import get_client, chat_completion
+from rag_context import select_columns, build_movies_table, count_tokens
+from llm_metrics import track_llm_call
+from answer_cache import get_cached_answer, store_answer
 
 MOVIE_SCHEMA = """
 The movies dataset has the following fields:
@@ -35,17 +27,60 @@ The movies dataset has the following fields:
 - overview: text description
 """
 
-def parse_nl_to_filters(nl_query, schema_metadata=None):
+# Bump whenever the parse prompt changes so cached parses from the old prompt are not reused
+PROMPT_VERSION = '1'
+
+# Coalesce concurrent identical parse and answer completions
+_parse_flight = SingleFlight()
+_answer_flight = SingleFlight()
+
+def get_coalescing_stats():
+    """Upstream calls made and saved by coalescing, for the monitoring endpoint"""
+    return {'parse': _parse_flight.stats(), 'answer': _answer_flight.stats()}
+
+def parse_nl_to_filters(nl_query, schema_metadata=None, use_cache=True, use_rules=True):
     """
     Parse a natural language query into structured filters and sort options
     
     Args:
         nl_query: natural language query string
         schema_metadata: optional schema description
+        use_cache: consult and fill the persistent parse cache
+        use_rules: try the rule-based parser (nl_rules) before the cache and the LLM
     
     Returns:
         dict with 'filters' and 'sort' keys
     """
+    return parse_nl_query(nl_query, use_cache=use_cache, use_rules=use_rules)[0]
+
+def parse_nl_query(nl_query, use_cache=True, use_rules=True):
+    """
+    parse_nl_to_filters, also telling where the parse came from
+    
+    Returns (parsed, source) with source 'rules' (nl_rules fast path), 'cache'
+    (parse cache), 'llm' (a completion) or 'fallback' (the LLM call failed and
+    the parse is empty).
+    """
+    if use_rules:
+        parsed = try_parse(nl_query)
+        if parsed is not None:
+            return parsed, 'rules'
+    
+    model = os.getenv('OPENAI_MODEL', 'gpt-4')
+    if use_cache:
+        cached = get_cached_parse(nl_query, model, PROMPT_VERSION)
+        if cached is not None:
+            return cached, 'cache'
+    
+    return parse_with_llm(nl_query, model, store=use_cache)
+
+def parse_with_llm(nl_query, model=None, store=True):
+    """
+    Parse with a completion (the parse cache is not consulted; store=True fills it)
+    
+    Returns (parsed, 'llm'), or an empty parse and 'fallback' when the call fails.
+    """
+    model = model or os.getenv('OPENAI_MODEL', 'gpt-4')
     prompt = f"""You are a query parser for a movie database. Convert the following natural language query into structured filters and sorting options.
 
 {MOVIE_SCHEMA}
@@ -64,10 +99,11 @@ Parse this query and return ONLY a valid JSON object with this exact structure:
         "budget_min": float or null,
         "budget_max": float or null,
         "revenue_min": float or null,
-        "revenue_max": float or null
+        "revenue_max": float or null,
+        "text": "keywords to match in title or overview" or null
     }},
     "sort": {{
-        "field": "release_year" | "runtime" | "budget" | "revenue" | "title" or null,
+        "field": "release_year" | "runtime" | "budget" | "revenue" | "title" | "relevance" or null,
         "direction": "asc" | "desc" or null
     }}
 }}
@@ -79,84 +115,63 @@ Rules:
 - For runtime, convert to minutes (e.g., "under 100 minutes" -> runtime_max: 99)
 - For budget/revenue, convert to numbers (e.g., "under $10M" -> budget_max: 10000000)
 - For sorting, detect phrases like "sort by", "order by", "highest", "lowest"
+- For topics or plot descriptions, put the key words in text (e.g., "movies about space robots" -> text: "space robots") and sort by relevance unless another order is requested
 - Return null for fields not mentioned
 
 Return ONLY the JSON object, no other text."""
 
+    def call_llm():
+        with track_llm_call('parse', model) as call:
+            messages = [
+                {"role": "system", "content": "You are a precise query parser. Return only valid JSON."},
+                {"role": "user", "content": prompt}
+            ]
+            
+            # temperature=0 for deterministic parsing (dropped for models that reject it)
+            response = chat_completion(messages, model=model, call=call, temperature=0, top_p=1)
+            call.add_usage(response)
+            
+            content = response.choices[0].message.content.strip()
+            
+            # Extract JSON from response (in case LLM adds extra text)
+            json_match = re.search(r'\{[\s\S]*\}', content)
+            if json_match:
+                content = json_match.group(0)
+            
+            parsed = json.loads(content)
+            
+            # Clean up: remove null values from filters
+            if 'filters' in parsed:
+                parsed['filters'] = {k: v for k, v in parsed['filters'].items() if v is not None}
+            if 'sort' in parsed:
+                parsed['sort'] = {k: v for k, v in parsed['sort'].items() if v is not None}
+            
+            if store:
+                store_parse(nl_query, model, PROMPT_VERSION, parsed)
+            return parsed
+
     try:
-        client = get_client()
-        model = os.getenv('OPENAI_MODEL', 'gpt-4')
-        
-        messages = [
-            {"role": "system", "content": "You are a precise query parser. Return only valid JSON."},
-            {"role": "user", "content": prompt}
-        ]
-        
-        # Try with temperature=0 first (for deterministic parsing)
-        # If the model doesn't support it, retry without temperature parameter
-        try:
-            response = client.chat.completions.create(
-                model=model,
-                messages=messages,
-                temperature=0,
-                top_p=1
-            )
-        except Exception as temp_error:
-            # If temperature=0 is not supported, retry without temperature
-            if "temperature" in str(temp_error).lower() or "unsupported" in str(temp_error).lower():
-                print(f"Model {model} doesn't support temperature=0, using default temperature")
-                response = client.chat.completions.create(
-                    model=model,
-                    messages=messages
-                )
-            else:
-                raise  # Re-raise if it's a different error
-        
-        content = response.choices[0].message.content.strip()
-        
-        # Extract JSON from response (in case LLM adds extra text)
-        json_match = re.search(r'\{[\s\S]*\}', content)
-        if json_match:
-            content = json_match.group(0)
-        
-        parsed = json.loads(content)
-        
-        # Clean up: remove null values from filters
-        if 'filters' in parsed:
-            parsed['filters'] = {k: v for k, v in parsed['filters'].items() if v is not None}
-        if 'sort' in parsed:
-            parsed['sort'] = {k: v for k, v in parsed['sort'].items() if v is not None}
-        
-        return parsed
+        # Identical queries parsed at the same moment share one completion
+        parsed, shared = _parse_flight.do((model, PROMPT_VERSION, normalize_query(nl_query)), call_llm)
+        return (copy.deepcopy(parsed) if shared else parsed), 'llm'
         
     except Exception as e:
         print(f"Error parsing NL query: {e}")
         return {
             'filters': {},
             'sort': {}
-        }
+        }, 'fallback'
 
-def answer_with_rag(nl_query, retrieved_rows):
+def build_rag_messages(nl_query, retrieved_rows, parsed=None):
     """
-    Generate a natural language answer using RAG on retrieved movie rows
-    
-    Args:
-        nl_query: original natural language query
-        retrieved_rows: list of movie dicts
+    Chat messages asking the model to answer nl_query from the retrieved movie rows
     
-    Returns:
-        string: natural language answer
+    Only the columns the parsed query refers to are included, and rows are packed
+    up to the RAG_CONTEXT_TOKENS budget (see rag_context).
     """
-    # Format retrieved movies as a table
-    movies_table = "ID | Title | Year | Runtime | Genres | Lead Gender | Budget | Revenue\n"
-    movies_table += "-" * 100 + "\n"
-    
-    for movie in retrieved_rows[:50]:  # Limit to 50 movies for context
-        genres_str = ", ".join(movie.get('genres', []))
-        budget_str = f"${movie.get('budget', 0):,.0f}" if movie.get('budget') else "N/A"
-        revenue_str = f"${movie.get('revenue', 0):,.0f}" if movie.get('revenue') else "N/A"
-        
-        movies_table += f"{movie.get('id')} | {movie.get('title', 'N/A')} | {movie.get('release_year', 'N/A')} | {movie.get('runtime', 'N/A')} min | {genres_str} | {movie.get('lead_gender', 'N/A')} | {budget_str} | {revenue_str}\n"
+    movies_table, included = build_movies_table(retrieved_rows, select_columns(parsed))
+    if included < len(retrieved_rows):
+        movies_table += f"\n(Showing the first {included} of {len(retrieved_rows)} retrieved movies.)\n"
     
     prompt = f"""You are a helpful assistant answering questions about movies from a database.
 
@@ -168,66 +183,139 @@ Here are the relevant movies from the database:
 
 Based on this data, provide a clear, concise answer to the user's question. Format your response as:
 1. A brief summary statement (e.g., "I found X movies matching your criteria:")
-2. A list of the movies with key details (title, year, runtime, revenue if relevant)
+2. A list of the movies with the key details shown in the table
 3. If sorting was requested, mention how they are ordered
 
 Be specific and accurate. Only mention movies that are actually in the table above."""
 
+    return [
+        {"role": "system", "content": "You are a helpful movie database assistant. Provide clear, accurate answers based on the provided data."},
+        {"role": "user", "content": prompt}
+    ]
+
+def rag_fallback_answer(retrieved_rows):
+    """Answer shown when the LLM call fails"""
+    return f"I found {len(retrieved_rows)} movies matching your criteria. Please review the results below."
+
+def lookup_cached_answer(nl_query, retrieved_rows):
+    """
+    A cached answer to nl_query over exactly these rows (see answer_cache)
+    
+    Returns (answer, match) with match 'exact' or 'similar', or (None, None).
+    """
+    return get_cached_answer(nl_query, os.getenv('OPENAI_MODEL', 'gpt-4'), [row['id'] for row in retrieved_rows])
+
+def answer_with_rag(nl_query, retrieved_rows, parsed=None):
+    """
+    Generate a natural language answer using RAG on retrieved movie rows
+    
+    Args:
+        nl_query: original natural language query
+        retrieved_rows: list of movie dicts
+        parsed: the query's parse_nl_to_filters result (selects the context columns)
+    
+    Returns:
+        string: natural language answer
+    """
     try:
-        client = get_client()
+        messages = build_rag_messages(nl_query, retrieved_rows, parsed)
         model = os.getenv('OPENAI_MODEL', 'gpt-4')
         
-        messages = [
-            {"role": "system", "content": "You are a helpful movie database assistant. Provide clear, accurate answers based on the provided data."},
-            {"role": "user", "content": prompt}
-        ]
-        
-        # Try with temperature=0 first (for deterministic answers)
-        # If the model doesn't support it, retry without temperature parameter
-        try:
-            response = client.chat.completions.create(
-                model=model,
-                messages=messages,
-                temperature=0,
-                top_p=1
-            )
-        except Exception as temp_error:
-            # If temperature=0 is not supported, retry without temperature
-            if "temperature" in str(temp_error).lower() or "unsupported" in str(temp_error).lower():
-                print(f"Model {model} doesn't support temperature=0, using default temperature")
-                response = client.chat.completions.create(
-                    model=model,
-                    messages=messages
-                )
-            else:
-                raise  # Re-raise if it's a different error
+        def call_llm():
+            with track_llm_call('answer', model) as call:
+                # temperature=0 for deterministic answers (dropped for models that reject it)
+                response = chat_completion(messages, model=model, call=call, temperature=0, top_p=1)
+                call.add_usage(response)
+                answer = response.choices[0].message.content.strip()
+            store_answer(nl_query, model, [row['id'] for row in retrieved_rows], answer)
+            return answer
         
-        return response.choices[0].message.content.strip()
+        # Identical prompts (same question and retrieved rows) share one completion
+        prompt_key = hashlib.sha256(json.dumps(messages, sort_keys=True).encode('utf-8')).hexdigest()
+        answer, _ = _answer_flight.do((model, prompt_key), call_llm)
+        return answer
         
     except Exception as e:
         print(f"Error generating RAG answer: {e}")
-        return f"I found {len(retrieved_rows)} movies matching your criteria. Please review the results below."
+        return rag_fallback_answer(retrieved_rows)
 
-def retrieve_movies_for_rag(nl_query, query_function):
+def answer_with_rag_stream(nl_query, retrieved_rows, parsed=None):
     """
-    Simple rule-based retrieval for RAG (can be enhanced with embeddings later)
+    Generate the RAG answer incrementally
+    
+    Yields text chunks as the model produces them; joined, they form the same
+    answer answer_with_rag would return. Falls back to rag_fallback_answer if the
+    call fails before any text was produced.
+    """
+    produced = False
+    pieces = []
+    messages = []
+    model = os.getenv('OPENAI_MODEL', 'gpt-4')
+    with track_llm_call('answer_stream', model, stream=True) as call:
+        try:
+            messages = build_rag_messages(nl_query, retrieved_rows, parsed)
+            stream = chat_completion(messages, model=model, stream=True, call=call, temperature=0, top_p=1)
+            
+            for chunk in stream:
+                if not chunk.choices:
+                    continue
+                text = chunk.choices[0].delta.content
+                if text:
+                    # Match answer_with_rag, which strips the completed answer
+                    if not produced:
+                        text = text.lstrip()
+                        if not text:
+                            continue
+                    produced = True
+                    call.mark_first_token()
+                    pieces.append(text)
+                    yield text
+            
+            store_answer(nl_query, model, [row['id'] for row in retrieved_rows], ''.join(pieces).strip())
+            
+        except Exception as e:
+            call.fail(e)
+            print(f"Error streaming RAG answer: {e}")
+            if not produced:
+                yield rag_fallback_answer(retrieved_rows)
+        finally:
+            # Streams carry no usage block: count the prompt, and about one token per chunk
+            call.estimate_usage(sum(count_tokens(message['content']) for message in messages), len(pieces))
+
+def retrieve_movies_for_rag(nl_query, query_function, semantic_function=None, parsed=None):
+    """
+    Retrieve the movies a RAG answer is based on
     
     Args:
         nl_query: natural language query
         query_function: function to execute structured queries (run_structured_query)
+        semantic_function: optional semantic ranking (data_access.semantic_search_movies),
+            used for topic-style queries the structured filters cannot express
+        parsed: the query's parse_nl_to_filters result, if the caller already has it
     
     Returns:
-        list of movie dicts
+        list of movie dicts (up to 100; build_rag_messages packs what fits the answer's
+        context budget, the rest are still shown and logged)
     """
-    # Use the same parser to get initial filters
-    parsed = parse_nl_to_filters(nl_query)
+    if parsed is None:
+        parsed = parse_nl_to_filters(nl_query)
+    filters = parsed.get('filters', {})
+    sort = parsed.get('sort')
+    limit = 100
+    
+    # Vague or topical questions (nothing parsed, or only keywords) are ranked by meaning,
+    # within any structured filters; an explicit ordering keeps the structured query
+    topical = not filters or filters.get('text')
+    if semantic_function is not None and topical and (not sort or sort.get('field') in (None, 'relevance')):
+        movies = semantic_function(nl_query, filters=filters, limit=limit)
+        if movies:
+            return movies
     
     # Execute query with parsed filters using the provided function
     movies = query_function(
-        filters=parsed.get('filters', {}),
-        sort=parsed.get('sort'),
-        limit=100
+        filters=filters,
+        sort=sort,
+        limit=limit
     )
     
     return movies
-
@@ -0,0 +1,171 @@
+"""
+Instrumentation of LLM calls
+Every parse/answer completion is measured (latency, time to first token for
+streams, prompt/completion tokens, model, retries, outcome). Each call is stored
+as an `llm_call` log entry for the participant/task of the request that made it,
+and rolling latency percentiles are kept per endpoint for /api/metrics.
+
+Outcomes: 'ok', 'fallback' (the call failed and the caller fell back to its
+default answer) and 'cancelled' (the client left a streamed answer).
+
+Configuration (environment):
+    LLM_METRICS_LOG       store each call as an llm_call log entry, 1/0 (default 1)
+    LLM_METRICS_WINDOW    calls per endpoint and kind kept for percentiles (default 1000)
+"""
+import os
+import threading
+import time
+from collections import deque
+from flask import g, has_app_context, has_request_context, request
+from log_sink import log_event
+
+LLM_METRICS_LOG = os.getenv('LLM_METRICS_LOG', '1') == '1'
+LLM_METRICS_WINDOW = int(os.getenv('LLM_METRICS_WINDOW', '1000'))
+
+_lock = threading.Lock()
+# (endpoint, kind) -> rolling window and totals
+_series = {}
+
+def set_request_context(participant_id, interface_type, task_id):
+    """Attach the current request's participant/task to the LLM calls it makes"""
+    g.llm_context = {'participant_id': participant_id, 'interface_type': interface_type, 'task_id': task_id}
+
+def _request_context():
+    if has_request_context():
+        return request.path, getattr(g, 'llm_context', None)
+    return None, None
+
+def _usage_tokens(usage, name):
+    value = getattr(usage, name, None)
+    if value is None and isinstance(usage, dict):
+        value = usage.get(name)
+    return value
+
+class LLMCall:
+    """Measurements of one logical LLM call, retries included; use as a context manager"""
+
+    def __init__(self, kind, model, stream=False):
+        self.kind = kind
+        self.model = model
+        self.stream = stream
+        self.retries = 0
+        self.prompt_tokens = None
+        self.completion_tokens = None
+        self.tokens_estimated = False
+        self.first_token_ms = None
+        self.error = None
+        self.outcome = None
+        self.started = time.perf_counter()
+
+    def add_usage(self, response):
+        """Take token counts from a completion response's usage block"""
+        usage = getattr(response, 'usage', None)
+        if usage is not None:
+            self.prompt_tokens = _usage_tokens(usage, 'prompt_tokens')
+            self.completion_tokens = _usage_tokens(usage, 'completion_tokens')
+
+    def estimate_usage(self, prompt_tokens, completion_tokens):
+        """Token counts for streams, which carry no usage block"""
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.tokens_estimated = True
+
+    def mark_first_token(self):
+        if self.first_token_ms is None:
+            self.first_token_ms = (time.perf_counter() - self.started) * 1000
+
+    def fail(self, error):
+        """The call failed and the caller is falling back"""
+        self.outcome = 'fallback'
+        self.error = f"{type(error).__name__}: {error}"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is GeneratorExit:
+            self.outcome = 'cancelled'
+        elif exc is not None:
+            self.fail(exc)
+        record_call(self, (time.perf_counter() - self.started) * 1000)
+        return False
+
+def track_llm_call(kind, model, stream=False):
+    """Start measuring an LLM call of the given kind ('parse', 'answer', 'answer_stream')"""
+    return LLMCall(kind, model, stream)
+
+def record_call(call, latency_ms):
+    """Aggregate a finished call and store it as an llm_call log entry"""
+    outcome = call.outcome or 'ok'
+    endpoint, context = _request_context()
+    endpoint = endpoint or 'background'
+
+    with _lock:
+        series = _series.get((endpoint, call.kind))
+        if series is None:
+            series = _series[(endpoint, call.kind)] = {
+                'latency_ms': deque(maxlen=LLM_METRICS_WINDOW),
+                'first_token_ms': deque(maxlen=LLM_METRICS_WINDOW),
+                'calls': 0, 'retries': 0, 'prompt_tokens': 0, 'completion_tokens': 0, 'outcomes': {}
+            }
+        series['latency_ms'].append(latency_ms)
+        if call.first_token_ms is not None:
+            series['first_token_ms'].append(call.first_token_ms)
+        series['calls'] += 1
+        series['retries'] += call.retries
+        series['prompt_tokens'] += call.prompt_tokens or 0
+        series['completion_tokens'] += call.completion_tokens or 0
+        series['outcomes'][outcome] = series['outcomes'].get(outcome, 0) + 1
+
+    if not (LLM_METRICS_LOG and context and context.get('participant_id') and has_app_context()):
+        return
+    payload = {
+        'kind': call.kind,
+        'endpoint': endpoint,
+        'model': call.model,
+        'latency_ms': round(latency_ms, 1),
+        'prompt_tokens': call.prompt_tokens,
+        'completion_tokens': call.completion_tokens,
+        'retries': call.retries,
+        'outcome': outcome
+    }
+    if call.stream:
+        payload['first_token_ms'] = round(call.first_token_ms, 1) if call.first_token_ms is not None else None
+    if call.tokens_estimated:
+        payload['tokens_estimated'] = True
+    if call.error:
+        payload['error'] = call.error[:500]
+    try:
+        log_event(context['participant_id'], context['interface_type'], context['task_id'], 'llm_call', payload)
+    except Exception as e:
+        print(f"Failed to log LLM call: {e}")
+
+def percentiles(values):
+    """p50/p90/p99/max of a sample (nearest rank)"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    pick = lambda fraction: ordered[min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))]
+    return {'p50': pick(0.50), 'p90': pick(0.90), 'p99': pick(0.99), 'max': ordered[-1]}
+
+def get_llm_metrics():
+    """Per endpoint and call kind: counts, outcomes, tokens and latency percentiles of recent calls"""
+    with _lock:
+        snapshot = {key: dict(series, latency_ms=list(series['latency_ms']),
+                              first_token_ms=list(series['first_token_ms']),
+                              outcomes=dict(series['outcomes']))
+                    for key, series in _series.items()}
+    metrics = {}
+    for (endpoint, kind), series in sorted(snapshot.items()):
+        entry = {
+            'calls': series['calls'],
+            'outcomes': series['outcomes'],
+            'retries': series['retries'],
+            'prompt_tokens': series['prompt_tokens'],
+            'completion_tokens': series['completion_tokens'],
+            'latency_ms': percentiles(series['latency_ms'])
+        }
+        if series['first_token_ms']:
+            entry['first_token_ms'] = percentiles(series['first_token_ms'])
+        metrics.setdefault(endpoint, {})[kind] = entry
+    return metrics
@@ -0,0 +1,221 @@
+"""
+Local OpenAI-compatible stand-in for load testing the LLM search paths
+Serves POST /v1/chat/completions (plain and streamed) without a network or API
+key. Parse prompts are answered with the rule-based parser (nl_rules), RAG
+prompts with a short answer listing the movies in the prompt's table. Latency,
+streaming speed and injected errors are configurable.
+
+Usage:
+    python llm_stub_server.py --port 8001 --latency-ms 1500 --jitter 0.3 --error-rate 0.02
+    OPENAI_BASE_URL=http://localhost:8001/v1 OPENAI_API_KEY=stub python app.py
+
+Set NL_RULES_ENABLED=0 and PARSE_CACHE_ENABLED=0 on the app to send every parse
+to the stub.
+"""
+import argparse
+import json
+import random
+import re
+import socket
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from nl_rules import parse_with_rules
+
+class StubConfig:
+    """Behaviour knobs shared by all request threads"""
+
+    def __init__(self, latency_ms=800, jitter=0.3, token_ms=15, error_rate=0.0,
+                 rate_limit_rate=0.0, reject_temperature=False, seed=None):
+        self.latency_ms = latency_ms  # median time to the full response / first token
+        self.jitter = jitter  # log-normal sigma of the latency
+        self.token_ms = token_ms  # delay between streamed chunks
+        self.error_rate = error_rate  # share of requests answered with a 500
+        self.rate_limit_rate = rate_limit_rate  # share of requests answered with a 429
+        self.reject_temperature = reject_temperature  # 400 for requests that set temperature
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+
+    def sample_latency(self):
+        """Seconds to wait before answering (log-normal around latency_ms)"""
+        with self.lock:
+            factor = self.random.lognormvariate(0, self.jitter) if self.jitter > 0 else 1.0
+        return self.latency_ms * factor / 1000
+
+    def sample_error(self):
+        """(status, message) of an injected error, or None"""
+        with self.lock:
+            self.requests += 1
+            draw = self.random.random()
+        if draw < self.rate_limit_rate:
+            return 429, 'Rate limit reached (injected by llm_stub_server)'
+        if draw < self.rate_limit_rate + self.error_rate:
+            return 500, 'Internal server error (injected by llm_stub_server)'
+        return None
+
+def parse_completion(prompt):
+    """Canned parse for a parse_nl_to_filters prompt"""
+    match = re.search(r'User query: "(.*)"', prompt)
+    parsed, _ = parse_with_rules(match.group(1) if match else '')
+    return json.dumps(parsed)
+
+def rag_completion(prompt):
+    """Canned answer listing the movies in an answer_with_rag prompt"""
+    lines = prompt.split('\n')
+    titles = []
+    for index, line in enumerate(lines):
+        if line.startswith('ID | '):
+            for row in lines[index + 2:]:
+                cells = [cell.strip() for cell in row.split(' | ')]
+                if len(cells) < 2:
+                    break
+                titles.append(f"{cells[1]} ({cells[2]})" if len(cells) > 2 else cells[1])
+            break
+    if not titles:
+        return "I couldn't find any movies matching your criteria."
+    listed = '\n'.join(f"{position}. {title}" for position, title in enumerate(titles, 1))
+    return f"I found {len(titles)} movies matching your criteria:\n{listed}"
+
+def completion_text(messages):
+    prompt = '\n'.join(str(message.get('content', '')) for message in messages)
+    if 'You are a query parser' in prompt or 'precise query parser' in prompt:
+        return parse_completion(prompt)
+    return rag_completion(prompt)
+
+def chunk_text(text):
+    """Split text into word-sized pieces, roughly like model tokens"""
+    return re.findall(r'\s*\S+', text) or ['']
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    config = StubConfig()
+
+    def setup(self):
+        super().setup()
+        # Send streamed chunks immediately instead of letting Nagle batch them
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, format, *args):
+        pass  # keep load tests quiet
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        if status == 429:
+            self.send_header('Retry-After', '1')
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_error_json(self, status, message):
+        self.send_json(status, {'error': {'message': message, 'type': 'stub_error', 'code': status}})
+
+    def do_GET(self):
+        if self.path.rstrip('/') in ('/v1/models', '/models'):
+            self.send_json(200, {'object': 'list', 'data': [{'id': 'stub', 'object': 'model'}]})
+        else:
+            self.send_error_json(404, 'Not found')
+
+    def do_POST(self):
+        if self.path.rstrip('/') not in ('/v1/chat/completions', '/chat/completions'):
+            self.send_error_json(404, 'Not found')
+            return
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            request = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            self.send_error_json(400, 'Invalid JSON body')
+            return
+
+        config = self.config
+        if config.reject_temperature and 'temperature' in request:
+            self.send_error_json(400, "Unsupported value: 'temperature' does not support 0 with this model.")
+            return
+        error = config.sample_error()
+        time.sleep(config.sample_latency())
+        if error:
+            self.send_error_json(*error)
+            return
+
+        model = request.get('model', 'stub')
+        text = completion_text(request.get('messages') or [])
+        completion_id = f"chatcmpl-stub-{uuid.uuid4().hex[:12]}"
+        prompt_tokens = sum(len(str(message.get('content', ''))) for message in request.get('messages') or []) // 4
+        completion_tokens = len(chunk_text(text))
+
+        if not request.get('stream'):
+            self.send_json(200, {
+                'id': completion_id,
+                'object': 'chat.completion',
+                'created': int(time.time()),
+                'model': model,
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': text},
+                             'finish_reason': 'stop'}],
+                'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+                          'total_tokens': prompt_tokens + completion_tokens}
+            })
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+
+        def send_chunk(delta, finish_reason=None):
+            chunk = {
+                'id': completion_id,
+                'object': 'chat.completion.chunk',
+                'created': int(time.time()),
+                'model': model,
+                'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}]
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+
+        try:
+            send_chunk({'role': 'assistant', 'content': ''})
+            for piece in chunk_text(text):
+                send_chunk({'content': piece})
+                time.sleep(config.token_ms / 1000)
+            send_chunk({}, 'stop')
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # client went away mid-stream
+
+def make_server(host='127.0.0.1', port=8001, config=None):
+    """Create (but do not start) a stub server; handy for tests and benchmarks"""
+    handler = type('ConfiguredStubHandler', (StubHandler,), {'config': config or StubConfig()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='OpenAI-compatible stub server for load testing')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--latency-ms', type=float, default=800, help='median response (or first token) latency')
+    parser.add_argument('--jitter', type=float, default=0.3, help='log-normal sigma of the latency (0 = fixed)')
+    parser.add_argument('--token-ms', type=float, default=15, help='delay between streamed chunks')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of requests failing with 500')
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='share of requests failing with 429')
+    parser.add_argument('--reject-temperature', action='store_true',
+                        help='reject requests that set temperature, like some reasoning models')
+    parser.add_argument('--seed', type=int, help='random seed for latencies and errors')
+    args = parser.parse_args()
+
+    server = make_server(args.host, args.port, StubConfig(
+        latency_ms=args.latency_ms, jitter=args.jitter, token_ms=args.token_ms,
+        error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate,
+        reject_temperature=args.reject_temperature, seed=args.seed
+    ))
+    print(f"LLM stub listening on http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,218 @@
+"""
+Buffered writer for LogEntry events
+Events are queued in memory and written by a background thread in bulk inserts,
+one transaction per batch, whenever LOG_SINK_BATCH_SIZE events are waiting or
+LOG_SINK_FLUSH_SECONDS have passed. Timestamps are taken when an event is queued,
+so batching never changes the recorded time. The queue is flushed at exit.
+
+LOG_SINK_MODE=sync writes every event immediately in the caller's session (the
+previous behaviour), e.g. for tests that read the log right after a request.
+
+An event may carry result_sets rows its payload references by hash; they are
+inserted in the same transaction as the event, just before it.
+
+When a bulk insert fails, the batch's events are written one at a time, so only
+the events that fail on their own are retried. Failed writes and events dropped
+after MAX_ATTEMPTS are reported at error level on the 'log_sink' logger, with
+the event types involved.
+
+Configuration (environment):
+    LOG_SINK_MODE             buffered | sync (default buffered)
+    LOG_SINK_BATCH_SIZE       events per bulk insert (default 200)
+    LOG_SINK_FLUSH_SECONDS    longest time an event waits in the queue (default 0.5)
+    LOG_SINK_MAX_QUEUE        queued events before callers write a batch themselves (default 50000)
+"""
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+from database import db
+from models import LogEntry
+from result_sets import insert_result_sets, mark_stored
+
+LOG_SINK_MODE = os.getenv('LOG_SINK_MODE', 'buffered')
+LOG_SINK_BATCH_SIZE = int(os.getenv('LOG_SINK_BATCH_SIZE', '200'))
+LOG_SINK_FLUSH_SECONDS = float(os.getenv('LOG_SINK_FLUSH_SECONDS', '0.5'))
+LOG_SINK_MAX_QUEUE = int(os.getenv('LOG_SINK_MAX_QUEUE', '50000'))
+
+# Attempts at writing a batch before its events are dropped
+MAX_ATTEMPTS = 3
+
+logger = logging.getLogger(__name__)
+
+_queue = deque()
+_condition = threading.Condition()
+_write_lock = threading.Lock()  # one batch written at a time
+_app = None
+_thread = None
+_stopping = False
+
+_stats = {'queued': 0, 'written': 0, 'batches': 0, 'failures': 0, 'dropped': 0}
+
+def _count(name, amount=1):
+    with _condition:
+        _stats[name] += amount
+
+def make_row(participant_id, interface_type, task_id, event_type, payload, timestamp=None):
+    """Column values of one log entry"""
+    return {
+        'timestamp': timestamp or datetime.utcnow(),
+        'participant_id': participant_id,
+        'interface_type': interface_type,
+        'task_id': task_id,
+        'event_type': event_type,
+        'payload': json.dumps(payload) if payload else None
+    }
+
+def log_event(participant_id, interface_type, task_id, event_type, payload, timestamp=None, result_sets=()):
+    """
+    Record an event (needs an app context)
+
+    result_sets are rows for the result_sets table (see result_sets.reference_result_sets)
+    written with the event. Returns the new entry's id in sync mode, None when the
+    event was queued (its id is only assigned when the writer inserts it).
+    """
+    row = make_row(participant_id, interface_type, task_id, event_type, payload, timestamp)
+    result_sets = list(result_sets)
+    if LOG_SINK_MODE == 'sync':
+        insert_result_sets(db.session, result_sets)
+        log_entry = LogEntry(**row)
+        db.session.add(log_entry)
+        db.session.commit()
+        mark_stored(result_sets)
+        return log_entry.id
+
+    _start(current_app._get_current_object())
+    with _condition:
+        _queue.append([row, 0, result_sets])
+        _stats['queued'] += 1
+        backlog = len(_queue)
+        if backlog == 1 or backlog >= LOG_SINK_BATCH_SIZE:
+            _condition.notify()  # start the flush timer, or flush a full batch
+    if backlog > LOG_SINK_MAX_QUEUE:
+        flush()  # writer can't keep up: apply backpressure instead of growing without bound
+    return None
+
+def _start(app):
+    global _app, _thread
+    if _thread is not None:
+        return
+    with _condition:
+        if _thread is None:
+            _app = app
+            _thread = threading.Thread(target=_run, name='log-sink', daemon=True)
+            _thread.start()
+
+def _take_batch():
+    with _condition:
+        return [_queue.popleft() for _ in range(min(LOG_SINK_BATCH_SIZE, len(_queue)))]
+
+def _event_types(batch):
+    """'type x count' summary of a batch for error messages"""
+    counts = Counter(row['event_type'] for row, _, _ in batch)
+    return ', '.join(f"{event_type} x{count}" for event_type, count in counts.most_common())
+
+def _insert(batch):
+    """Insert events and their result sets in one transaction"""
+    result_sets = [result_set for _, _, rows in batch for result_set in rows]
+    with _app.app_context(), Session(db.engine) as session:
+        insert_result_sets(session, result_sets)
+        session.execute(insert(LogEntry), [row for row, _, _ in batch])
+        session.commit()
+    mark_stored(result_sets)
+    _count('written', len(batch))
+    _count('batches')
+
+def _write_batch(batch):
+    """
+    Bulk insert one batch. If that fails, its events are inserted one at a time, so
+    one bad event cannot take the rest of the batch with it; the events that still
+    fail go back to the queue until MAX_ATTEMPTS.
+    """
+    try:
+        _insert(batch)
+        return True
+    except Exception as e:
+        logger.error("Failed to write %d log entries (%s): %s", len(batch), _event_types(batch), e)
+        _count('failures')
+        failed = batch
+
+    if len(batch) > 1:
+        failed = []
+        for entry in batch:
+            try:
+                _insert([entry])
+            except Exception as e:
+                failed.append(entry)
+                error = e
+        if not failed:
+            return True
+        logger.error("Failed to write %d of %d log entries one at a time (%s): %s", len(failed), len(batch),
+                     _event_types(failed), error)
+
+    retry = [[row, attempts + 1, rows] for row, attempts, rows in failed if attempts + 1 < MAX_ATTEMPTS]
+    dropped = [entry for entry in failed if entry[1] + 1 >= MAX_ATTEMPTS]
+    if dropped:
+        logger.error("Dropped %d log entries after %d attempts (%s)", len(dropped), MAX_ATTEMPTS,
+                     _event_types(dropped))
+        _count('dropped', len(dropped))
+    with _condition:
+        _queue.extendleft(reversed(retry))
+    return False
+
+def flush():
+    """Write every queued event now; returns False if a batch failed"""
+    with _write_lock:
+        while True:
+            batch = _take_batch()
+            if not batch:
+                return True
+            if not _write_batch(batch):
+                return False
+
+def _run():
+    while True:
+        with _condition:
+            if not _queue and not _stopping:
+                _condition.wait()
+            deadline = time.monotonic() + LOG_SINK_FLUSH_SECONDS
+            # Wait for a full batch, but no longer than the flush interval
+            while len(_queue) < LOG_SINK_BATCH_SIZE and not _stopping:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                _condition.wait(remaining)
+            stopping = _stopping
+        if not flush() and not stopping:
+            time.sleep(LOG_SINK_FLUSH_SECONDS)  # back off before retrying a failed batch
+        if stopping:
+            return  # shutdown() retries whatever is left
+
+def shutdown():
+    """Stop the writer and flush what is left (registered at exit)"""
+    global _stopping
+    with _condition:
+        _stopping = True
+        _condition.notify()
+    if _thread is not None:
+        _thread.join(timeout=10)
+    if _app is not None:
+        # Failed events are retried until written or dropped, never left in the queue
+        while not flush():
+            pass
+
+atexit.register(shutdown)
+
+def get_log_sink_stats():
+    """Queue and write counters for the monitoring endpoint"""
+    with _condition:
+        stats = dict(_stats, mode=LOG_SINK_MODE, pending=len(_queue))
+    stats['mean_batch_size'] = stats['written'] / stats['batches'] if stats['batches'] else 0.0
+    return stats
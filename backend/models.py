@@ -1,9 +1,14 @@
 from database import db
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, Float, DateTime, Text, JSON, Boolean
+from sqlalchemy import Column, Integer, String, Float, DateTime, Text, JSON, Boolean, ForeignKey, Index, LargeBinary
 from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.orm import relationship
 import json
 
+def normalize_genre(genre):
+    """Lookup key for a genre name (genre filters are case-insensitive)"""
+    return str(genre).strip().lower()
+
 class Movie(db.Model):
     __tablename__ = 'movies'
     
@@ -19,6 +24,27 @@ class Movie(db.Model):
     overview = Column(Text)
     tmdb_id = Column(Integer, unique=True)
     
+    # Normalized copy of `genres` used for indexed genre filtering
+    genre_links = relationship('MovieGenre', cascade='all, delete-orphan')
+    
+    # Indexes for the filter/sort combinations run_structured_query produces
+    # (see benchmark_queries.py for the plans and timings behind each one)
+    __table_args__ = (
+        Index('ix_movies_release_year_runtime', 'release_year', 'runtime'),  # year range + runtime cap
+        Index('ix_movies_lead_gender_budget', 'lead_gender', 'budget'),  # lead gender + budget range
+        Index('ix_movies_lead_gender_release_year', 'lead_gender', 'release_year'),  # lead gender + year range
+        Index('ix_movies_runtime', 'runtime'),  # runtime range / sort
+        Index('ix_movies_budget', 'budget'),  # budget range / sort
+        Index('ix_movies_revenue', 'revenue'),  # revenue range / sort
+        Index('ix_movies_title', 'title'),  # sort by title
+    )
+    
+    def set_genres(self, genres):
+        """Set the genres JSON and the matching movie_genres rows"""
+        self.genres = json.dumps(genres)
+        keys = {normalize_genre(genre) for genre in genres}
+        self.genre_links = [MovieGenre(genre=key) for key in sorted(keys)]
+    
     def to_dict(self):
         return {
             'id': self.id,
@@ -33,6 +59,16 @@ class Movie(db.Model):
             'overview': self.overview
         }
 
+class MovieGenre(db.Model):
+    __tablename__ = 'movie_genres'
+    
+    movie_id = Column(Integer, ForeignKey('movies.id'), primary_key=True)
+    genre = Column(String(100), primary_key=True)  # normalized genre name (see normalize_genre)
+    
+    __table_args__ = (
+        Index('ix_movie_genres_genre_movie_id', 'genre', 'movie_id'),
+    )
+
 class Participant(db.Model):
     __tablename__ = 'participants'
     
@@ -84,6 +120,13 @@ class LogEntry(db.Model):
     event_type = Column(String(100), nullable=False)  # 'page_load', 'task_started', 'filter_change', etc.
     payload = Column(Text)  # JSON string
     
+    __table_args__ = (
+        # Per-participant/task log reads in analyze_results (get_task_logs, count_reformulations)
+        Index('ix_log_entries_participant_task_interface_ts', 'participant_id', 'task_id', 'interface_type', 'timestamp'),
+        # Event-type scans ordered by time (analyze_task_performance, parse benchmarks)
+        Index('ix_log_entries_event_type_ts', 'event_type', 'timestamp'),
+    )
+    
     def to_dict(self):
         return {
             'id': self.id,
@@ -115,3 +158,41 @@ class QuestionnaireResponse(db.Model):
             'submitted_at': self.submitted_at.isoformat() if self.submitted_at else None
         }
 
+
+class ParseCacheEntry(db.Model):
+    __tablename__ = 'parse_cache'
+    
+    cache_key = Column(String(64), primary_key=True)  # sha256 of prompt version, model, endpoint and normalized query
+    query = Column(Text, nullable=False)  # normalized query text
+    model = Column(String(100))
+    prompt_version = Column(String(20))
+    parsed = Column(Text, nullable=False)  # JSON: {'filters': ..., 'sort': ...}
+    created_at = Column(DateTime, default=datetime.utcnow)
+    last_used_at = Column(DateTime, default=datetime.utcnow, index=True)
+    hit_count = Column(Integer, default=0)
+
+class ClientEventSeq(db.Model):
+    __tablename__ = 'client_event_seqs'
+    
+    # One row per client event ingested through /api/log/batch, so resent batches are not logged twice
+    participant_id = Column(String(100), primary_key=True)
+    client_session = Column(String(64), primary_key=True)  # random id per page load
+    seq = Column(Integer, primary_key=True)  # client-side sequence number within the session
+    received_at = Column(DateTime, default=datetime.utcnow)
+
+class ResultSet(db.Model):
+    __tablename__ = 'result_sets'
+    
+    # Ordered movie ID lists referenced from log payloads, stored once per distinct list
+    hash = Column(String(64), primary_key=True)  # sha256 of data
+    count = Column(Integer, nullable=False)
+    data = Column(LargeBinary, nullable=False)  # zigzag delta varints (see result_sets.encode_ids)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class DataVersion(db.Model):
+    __tablename__ = 'data_versions'
+    
+    # Change counter per dataset, so every server process notices data loaded by another process
+    name = Column(String(50), primary_key=True)  # 'movies'
+    version = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow)
@@ -0,0 +1,330 @@
+"""
+Movie Index: In-memory columnar copy of the movies table for structured queries
+
+The movies table is read-only once preprocess_data.py has loaded it, so the
+index is built once per process and answers the same filters/sort/limit
+contract as data_access.run_structured_query with NumPy masks instead of SQL.
+"""
+import threading
+import numpy as np
+from models import Movie, normalize_genre
+from full_text import match_scores, keyword_tokens
+
+# Numeric columns that can be range-filtered and sorted on
+RANGE_FIELDS = ['release_year', 'runtime', 'budget', 'revenue']
+
+# Every field run_structured_query can order by ('id' is the fallback)
+SORT_FIELDS = RANGE_FIELDS + ['title', 'id']
+
+def normalize_sort(sort):
+    """(field, direction) that run_structured_query actually orders by for a sort dict"""
+    if not sort:
+        return 'id', 'asc'
+    field = sort.get('field')
+    if field == 'relevance':
+        return 'relevance', 'desc'  # keyword relevance always lists best matches first
+    if field not in SORT_FIELDS:
+        field = 'id'
+    direction = 'desc' if sort.get('direction', 'asc') == 'desc' else 'asc'
+    return field, direction
+
+# Histogram bucket edges for facet counts (release_year uses decades from the data)
+HISTOGRAM_EDGES = {
+    'runtime': [0, 60, 90, 120, 150, 180],
+    'budget': [0, 1000000, 10000000, 50000000, 100000000, 200000000],
+    'revenue': [0, 1000000, 10000000, 100000000, 500000000, 1000000000],
+}
+
+# Set bits per byte value, for counting rows in packed bitsets
+_POPCOUNT = np.array([bin(value).count('1') for value in range(256)], dtype=np.int64)
+
+def count_bits(bitsets):
+    """Number of set bits in packed bitsets (summed over the last axis)"""
+    return _POPCOUNT[bitsets].sum(axis=-1)
+
+class MovieIndex:
+    """Column arrays over all movies, ordered by id"""
+
+    def __init__(self, rows):
+        rows = sorted(rows, key=lambda row: row['id'])
+        self.rows = rows
+        self.size = len(rows)
+        self.ids = np.array([row['id'] for row in rows], dtype=np.int64)
+
+        # Nullable numeric columns: NULL becomes NaN so comparisons are False, as in SQL
+        self.columns = {}
+        for field in RANGE_FIELDS:
+            self.columns[field] = np.array(
+                [row[field] if row[field] is not None else np.nan for row in rows],
+                dtype=np.float64
+            )
+
+        # Titles are only sorted on, so keep a dense rank (ties share a rank)
+        titles = np.array([row['title'] or '' for row in rows], dtype=str)
+        self.title_values, title_rank = np.unique(titles, return_inverse=True)
+        self.columns['title'] = title_rank.reshape(-1).astype(np.float64)
+        self.columns['id'] = self.ids.astype(np.float64)
+
+        # Lead gender as small integer codes (-1 for NULL)
+        self.gender_values = sorted({row['lead_gender'] for row in rows if row['lead_gender'] is not None})
+        gender_codes = {value: code for code, value in enumerate(self.gender_values)}
+        self.gender_codes = np.array(
+            [gender_codes.get(row['lead_gender'], -1) for row in rows],
+            dtype=np.int16
+        )
+
+        # Genre bitmasks: one bit per genre, packed into as many 64-bit words as needed
+        self.genre_bits = {}
+        self.genre_names = {}  # first spelling seen for each genre key
+        for row in rows:
+            for genre in row['genres']:
+                key = normalize_genre(genre)
+                if key not in self.genre_bits:
+                    self.genre_bits[key] = len(self.genre_bits)
+                    self.genre_names[key] = genre
+        words = max(1, (len(self.genre_bits) + 63) // 64)
+        self.genre_masks = np.zeros((self.size, words), dtype=np.uint64)
+        for position, row in enumerate(rows):
+            for genre in row['genres']:
+                bit = self.genre_bits[normalize_genre(genre)]
+                self.genre_masks[position, bit // 64] |= np.uint64(1 << (bit % 64))
+
+        # Precomputed orderings, so a query only has to select from them.
+        # NULLs sort first ascending and last descending; ties break on id.
+        self.orderings = {}
+        positions = np.arange(self.size)
+        for field in SORT_FIELDS:
+            values = self.columns[field]
+            is_null = np.isnan(values)
+            filled = np.where(is_null, 0.0, values)
+            self.orderings[(field, 'asc')] = np.lexsort((positions, filled, ~is_null))
+            self.orderings[(field, 'desc')] = np.lexsort((positions, -filled, is_null))
+
+        # Built here rather than on first use, so concurrent requests never build them twice
+        self.facet_bitsets = self.build_facet_bitsets()
+
+    def packed_rows(self, masks):
+        """Boolean row masks packed into a (len(masks), ceil(size / 8)) bitset array"""
+        packed = np.zeros((len(masks), (self.size + 7) // 8), dtype=np.uint8)
+        for row, mask in enumerate(masks):
+            packed[row] = np.packbits(mask)
+        return packed
+
+    def build_facet_bitsets(self):
+        """Packed per-value bitsets (one bit per movie) for every facet value"""
+        genre_keys = sorted(self.genre_bits, key=lambda key: self.genre_names[key])
+        genre_bitsets = self.packed_rows([self.genre_member_mask([key]) for key in genre_keys])
+        gender_bitsets = self.packed_rows([self.gender_codes == code for code in range(len(self.gender_values))])
+
+        histograms = {}
+        for field in RANGE_FIELDS:
+            column = self.columns[field]
+            if field == 'release_year':
+                years = column[~np.isnan(column)]
+                first = int(years.min()) // 10 * 10 if years.size else 1900
+                last = int(years.max()) // 10 * 10 if years.size else 2020
+                edges = list(range(first, last + 10, 10))
+            else:
+                edges = HISTOGRAM_EDGES[field]
+            # Half-open [low, high) buckets, the last one unbounded
+            buckets = list(zip(edges, edges[1:] + [None]))
+            bitsets = []
+            for low, high in buckets:
+                in_bucket = column >= low
+                if high is not None:
+                    in_bucket &= column < high
+                bitsets.append(in_bucket)
+            histograms[field] = {'buckets': buckets, 'bitsets': self.packed_rows(bitsets)}
+
+        return {
+            'genres': ([self.genre_names[key] for key in genre_keys], genre_bitsets),
+            'lead_gender': (list(self.gender_values), gender_bitsets),
+            'histograms': histograms,
+        }
+
+    def facet_counts(self, filters=None):
+        """
+        Per-value counts for every facet under the given filter state
+
+        Each facet is counted with all other filters applied but not its own,
+        so the UI can show how many results selecting another value would give.
+        """
+        filters = filters or {}
+
+        # Pack each filter's mask once, then combine all-but-one per facet
+        parts = {}
+        for name, mask in self.filter_masks(filters).items():
+            parts[name] = np.packbits(mask)
+        everything = np.packbits(np.ones(self.size, dtype=bool))
+
+        def combined(excluding):
+            result = everything.copy()
+            for name, packed in parts.items():
+                if name != excluding:
+                    result &= packed
+            return result
+
+        genre_names, genre_bitsets = self.facet_bitsets['genres']
+        genre_counts = count_bits(genre_bitsets & combined('genres'))
+        gender_values, gender_bitsets = self.facet_bitsets['lead_gender']
+        gender_counts = count_bits(gender_bitsets & combined('lead_gender'))
+
+        histograms = {}
+        for field, histogram in self.facet_bitsets['histograms'].items():
+            counts = count_bits(histogram['bitsets'] & combined(field))
+            histograms[field] = [
+                {'min': low, 'max': high, 'count': int(count)}
+                for (low, high), count in zip(histogram['buckets'], counts)
+            ]
+
+        return {
+            'total': int(count_bits(combined(None))),
+            'genres': {name: int(count) for name, count in zip(genre_names, genre_counts)},
+            'lead_gender': {value: int(count) for value, count in zip(gender_values, gender_counts)},
+            'histograms': histograms,
+        }
+
+    def genre_query_bits(self, genres):
+        """Bitmask selecting any of the given genres (None if none of them exist)"""
+        query_bits = np.zeros(self.genre_masks.shape[1], dtype=np.uint64)
+        found = False
+        for genre in genres:
+            bit = self.genre_bits.get(normalize_genre(genre))
+            if bit is not None:
+                query_bits[bit // 64] |= np.uint64(1 << (bit % 64))
+                found = True
+        return query_bits if found else None
+
+    def genre_member_mask(self, genres):
+        """Boolean mask of movies having any of the given genres"""
+        query_bits = self.genre_query_bits(genres)
+        if query_bits is None:
+            return np.zeros(self.size, dtype=bool)
+        return (self.genre_masks & query_bits).any(axis=1)
+
+    def text_scores(self, filters):
+        """Relevance score per row for the keyword filter (None without one)"""
+        if not filters or not keyword_tokens(filters.get('text')):
+            return None
+        scores = np.full(self.size, np.nan)
+        matches = match_scores(filters['text'])
+        if matches:
+            matched_ids = np.fromiter(matches.keys(), dtype=np.int64, count=len(matches))
+            positions = np.searchsorted(self.ids, matched_ids)
+            found = (positions < self.size) & (self.ids[np.minimum(positions, self.size - 1)] == matched_ids)
+            scores[positions[found]] = np.fromiter(matches.values(), dtype=np.float64, count=len(matches))[found]
+        return scores
+
+    def filter_masks(self, filters, scores=None):
+        """
+        Boolean mask per active filter group ('genres', 'lead_gender', 'text' or a range field)
+
+        Uses the same truthiness rules as the SQL path: empty or zero values are ignored.
+        Keyword matches come from the database's full-text index unless scores
+        (from text_scores) are passed in.
+        """
+        masks = {}
+        if not filters:
+            return masks
+
+        if scores is None:
+            scores = self.text_scores(filters)
+        if scores is not None:
+            masks['text'] = ~np.isnan(scores)
+
+        if filters.get('genres'):
+            masks['genres'] = self.genre_member_mask(filters['genres'])
+
+        if filters.get('lead_gender'):
+            value = filters['lead_gender']
+            if value in self.gender_values:
+                masks['lead_gender'] = self.gender_codes == self.gender_values.index(value)
+            else:
+                masks['lead_gender'] = np.zeros(self.size, dtype=bool)
+
+        for field in RANGE_FIELDS:
+            column = self.columns[field]
+            if filters.get(f'{field}_min'):
+                masks[field] = masks.get(field, True) & (column >= float(filters[f'{field}_min']))
+            if filters.get(f'{field}_max'):
+                masks[field] = masks.get(field, True) & (column <= float(filters[f'{field}_max']))
+
+        return masks
+
+    def filter_mask(self, filters, scores=None):
+        """Boolean mask of rows matching all filters"""
+        mask = np.ones(self.size, dtype=bool)
+        for part in self.filter_masks(filters, scores).values():
+            mask &= part
+        return mask
+
+    def title_rank(self, title):
+        """Position of a title in title order (between ranks if it is not in the data)"""
+        rank = int(np.searchsorted(self.title_values, title))
+        if rank < len(self.title_values) and self.title_values[rank] == title:
+            return float(rank)
+        return rank - 0.5
+
+    def after_mask(self, field, direction, after, column=None):
+        """Rows strictly after the keyset position after=(value, id) in the given ordering"""
+        value, last_id = after
+        if column is None:
+            column = self.columns[field]
+        is_null = np.isnan(column)
+        if value is not None:
+            value = self.title_rank(value) if field == 'title' else float(value)
+
+        # NaN comparisons are False, so NULLs only match through is_null
+        if direction == 'asc':
+            if value is None:
+                return (is_null & (self.ids > last_id)) | ~is_null
+            return (column > value) | ((column == value) & (self.ids > last_id))
+        if value is None:
+            return is_null & (self.ids > last_id)
+        return (column < value) | ((column == value) & (self.ids > last_id)) | is_null
+
+    def query(self, filters=None, sort=None, limit=1000, after=None):
+        """Run a structured query and return matching movie dicts in sort order"""
+        field, direction = normalize_sort(sort)
+        scores = self.text_scores(filters)
+        mask = self.filter_mask(filters, scores)
+
+        if field == 'relevance':
+            # Relevance depends on the keywords, so order the matches per query
+            relevance = np.zeros(self.size) if scores is None else np.nan_to_num(scores)
+            if after is not None:
+                mask &= self.after_mask(field, direction, after, column=relevance)
+            matched = np.flatnonzero(mask)
+            positions = matched[np.lexsort((matched, -relevance[matched]))]
+            if limit is not None:
+                positions = positions[:limit]
+            return [dict(self.rows[position], relevance=float(relevance[position])) for position in positions]
+
+        if after is not None:
+            mask &= self.after_mask(field, direction, after)
+        ordering = self.orderings[(field, direction)]
+        positions = ordering[mask[ordering]]
+        if limit is not None:
+            positions = positions[:limit]
+
+        # Rows are shared between requests and must be treated as read-only
+        return [self.rows[position] for position in positions]
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_movie_index():
+    """Get or build the process-wide movie index (requires an app context)"""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                movies = Movie.query.order_by(Movie.id).all()
+                _index = MovieIndex([movie.to_dict() for movie in movies])
+    return _index
+
+def reset_movie_index():
+    """Drop the index so it is rebuilt from the database on next use"""
+    global _index
+    with _index_lock:
+        _index = None
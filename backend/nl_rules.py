@@ -0,0 +1,322 @@
+"""
+Rule-based parser for common natural language movie queries
+Handles the phrasings the parse_nl_to_filters prompt describes ("after 2015",
+"under 100 minutes", "budget under $10M", "dramas or thrillers", "sorted by
+highest revenue") and returns the same {filters, sort} structure in well under a
+millisecond. The confidence score is the share of meaningful words the rules
+explained; parse_nl_to_filters only skips the LLM when it reaches
+NL_RULES_MIN_CONFIDENCE.
+
+Configuration (environment):
+    NL_RULES_ENABLED          1/0 (default 1)
+    NL_RULES_MIN_CONFIDENCE   confidence needed to skip the LLM (default 0.95)
+"""
+import os
+import re
+import threading
+import time
+
+NL_RULES_ENABLED = os.getenv('NL_RULES_ENABLED', '1') == '1'
+NL_RULES_MIN_CONFIDENCE = float(os.getenv('NL_RULES_MIN_CONFIDENCE', '0.95'))
+
+# Dataset genre -> surface forms (regex alternatives, matched as whole words)
+GENRE_PATTERNS = {
+    'Action': r'action',
+    'Adventure': r'adventures?',
+    'Animation': r'animat(?:ion|ed)|cartoons?',
+    'Comedy': r'comed(?:y|ies)',
+    'Crime': r'crime',
+    'Documentary': r'documentar(?:y|ies)',
+    'Drama': r'dramas?|dramatic',
+    'Family': r'family|kids?',
+    'Fantasy': r'fantasy|fantasies',
+    'Foreign': r'foreign',
+    'History': r'history|historical',
+    'Horror': r'horrors?|scary',
+    'Music': r'music|musicals?',
+    'Mystery': r'myster(?:y|ies)',
+    'Romance': r'romances?|romantic|rom[- ]?coms?',
+    'Science Fiction': r'science[- ]fiction|sci[- ]?fi',
+    'TV Movie': r'tv[- ]movies?',
+    'Thriller': r'thrillers?',
+    'War': r'war',
+    'Western': r'westerns?',
+}
+
+# Words that carry no constraint on their own
+STOPWORDS = {
+    'a', 'an', 'the', 'and', 'or', 'of', 'in', 'on', 'from', 'for', 'with', 'that', 'which',
+    'who', 'are', 'were', 'was', 'is', 'be', 'been', 'have', 'has', 'had', 'their', 'them',
+    'movies', 'movie', 'films', 'film', 'titles', 'ones', 'genre', 'genres',
+    'show', 'me', 'find', 'list', 'give', 'get', 'i', 'want', 'to', 'see', 'looking', 'look',
+    'search', 'please', 'all', 'any', 'some', 'what', 'can', 'you', 'would', 'like', 'also',
+    'released', 'release', 'made', 'came', 'come', 'out', 'produced',
+    'sort', 'sorted', 'order', 'ordered', 'rank', 'ranked', 'by', 'it', 'its',
+    'only', 'just', 'both', 'either',
+}
+
+# Words that flip or restrict a constraint in ways {filters, sort} cannot express
+NEGATIONS = {'not', 'no', 'non', 'without', 'except', 'excluding', 'exclude'}
+
+# Comparator phrase -> (bound, inclusive)
+COMPARATORS = {
+    'under': ('max', False), 'below': ('max', False), 'less than': ('max', False),
+    'lower than': ('max', False), 'fewer than': ('max', False), 'shorter than': ('max', False),
+    'cheaper than': ('max', False),
+    'at most': ('max', True), 'no more than': ('max', True), 'up to': ('max', True),
+    'maximum of': ('max', True), 'max': ('max', True),
+    'over': ('min', False), 'above': ('min', False), 'more than': ('min', False),
+    'greater than': ('min', False), 'higher than': ('min', False), 'longer than': ('min', False),
+    'exceeding': ('min', False),
+    'at least': ('min', True), 'no less than': ('min', True), 'minimum of': ('min', True),
+    'min': ('min', True),
+}
+# Used as the first group (?P<cmp>...) of a pattern, so amounts start at group 2
+_CMP = '|'.join(re.escape(phrase) for phrase in sorted(COMPARATORS, key=len, reverse=True))
+
+_MONEY_UNITS = {'k': 1e3, 'thousand': 1e3, 'm': 1e6, 'mm': 1e6, 'mil': 1e6, 'million': 1e6,
+                'b': 1e9, 'bn': 1e9, 'billion': 1e9}
+_AMOUNT = r'\$?\s?(\d[\d,]*(?:\.\d+)?)\s?(thousand|million|billion|mil|mm|bn|k|m|b)?\b(?:\s(?:dollars|usd)\b)?'
+_MONEY_FIELDS = {
+    'budget': r'budgets?|cost(?:s|ing)?|costs? to make',
+    'revenue': r'revenues?|box[- ]office|gross(?:ed|ing)?|earn(?:ed|ings|ing)?',
+}
+_DURATION = r'(\d+(?:\.\d+)?)\s?(minutes?|mins?|hours?|hrs?|h)\b'
+
+# Superlatives: (pattern, field, direction)
+SORT_PHRASES = [
+    (r'(?:highest|top|most)[- ]grossing|biggest (?:box[- ]office )?hits?|most (?:money|successful)', 'revenue', 'desc'),
+    (r'lowest[- ]grossing|least (?:money|successful)', 'revenue', 'asc'),
+    (r'most expensive|(?:biggest|largest|highest) budgets?', 'budget', 'desc'),
+    (r'cheapest|least expensive|(?:smallest|lowest) budgets?', 'budget', 'asc'),
+    (r'newest|latest|most recent(?:ly released)?|recent first', 'release_year', 'desc'),
+    (r'oldest|earliest', 'release_year', 'asc'),
+    (r'longest', 'runtime', 'desc'),
+    (r'shortest', 'runtime', 'asc'),
+    (r'alphabetical(?:ly)?(?: order)?|a[- ]to[- ]z|a-z', 'title', 'asc'),
+]
+SORT_FIELDS = {
+    'revenue': r'revenues?|box[- ]office|gross(?:ing)?|earnings',
+    'budget': r'budgets?|costs?',
+    'runtime': r'runtimes?|running[- ]times?|length|duration',
+    'release_year': r'release (?:year|date)s?|years?|dates?',
+    'title': r'titles?|names?',
+}
+_SORT_FIELD = '|'.join(f'(?P<{field}>{pattern})' for field, pattern in SORT_FIELDS.items())
+_DIRECTION_WORDS = {
+    'desc': r'desc(?:ending)?|high(?:est)? to low(?:est)?|largest first|most|highest|biggest|largest|top|greatest',
+    'asc': r'asc(?:ending)?|low(?:est)? to high(?:est)?|smallest first|least|lowest|smallest|fewest',
+}
+_GENDER_WORDS = {'female': 'female', 'woman': 'female', 'women': 'female', 'girl': 'female',
+                 'male': 'male', 'man': 'male', 'men': 'male', 'mixed': 'mixed'}
+_GENDER = r'female|woman|women|girl|male|man|men|mixed'
+
+_stats_lock = threading.Lock()
+_stats = {'attempts': 0, 'accepted': 0, 'fallbacks': 0, 'total_ms': 0.0}
+
+def _money(number, unit):
+    value = float(number.replace(',', ''))
+    return value * _MONEY_UNITS.get((unit or '').lower(), 1)
+
+def _minutes(number, unit):
+    value = float(number)
+    return int(round(value * 60)) if unit.startswith('h') else int(round(value))
+
+def _bound(filters, field, bound, value, inclusive, integer):
+    """Set field_min/field_max, turning strict integer comparisons into inclusive ones"""
+    if integer and not inclusive:
+        value = value - 1 if bound == 'max' else value + 1
+    filters[f'{field}_{bound}'] = int(value) if integer else float(value)
+
+class _Parse:
+    """Working state: the query with explained spans blanked out, plus the result"""
+
+    def __init__(self, query):
+        self.text = ' ' + ' '.join(query.lower().split()) + ' '
+        self.filters = {}
+        self.sort = {}
+
+    def consume(self, pattern, handler):
+        """Apply handler to every match of pattern and blank the matched text"""
+        def replace(match):
+            if handler(match) is False:
+                return match.group(0)
+            return ' ' * len(match.group(0))
+        self.text = re.sub(pattern, replace, self.text)
+
+def _parse_money(state):
+    for field, words in _MONEY_FIELDS.items():
+        # "budget under $10M", "grossed more than 500 million", "budget of at most $20M"
+        def comparison(match, field=field):
+            bound, inclusive = COMPARATORS[match.group('cmp')]
+            _bound(state.filters, field, bound, _money(match.group(2), match.group(3)), inclusive, False)
+        state.consume(rf'\b(?:{words})\s(?:(?:is|was|of)\s)?(?P<cmp>{_CMP})\s{_AMOUNT}', comparison)
+
+        # "budget between $10M and $50M"
+        def between(match, field=field):
+            low = _money(match.group(1), match.group(2) or match.group(4))
+            high = _money(match.group(3), match.group(4))
+            state.filters[f'{field}_min'] = low
+            state.filters[f'{field}_max'] = high
+        state.consume(rf'\b(?:{words})\s(?:of\s)?between\s{_AMOUNT}\s(?:and|to|-)\s{_AMOUNT}', between)
+
+        # "under $10M budget", "over $500M in revenue"
+        def trailing(match, field=field):
+            bound, inclusive = COMPARATORS[match.group('cmp')]
+            _bound(state.filters, field, bound, _money(match.group(2), match.group(3)), inclusive, False)
+        state.consume(rf'(?P<cmp>{_CMP})\s{_AMOUNT}\s(?:in\s|of\s)?(?:{words})\b', trailing)
+
+def _parse_runtime(state):
+    def between(match):
+        unit = match.group(3)
+        state.filters['runtime_min'] = _minutes(match.group(1), unit)
+        state.filters['runtime_max'] = _minutes(match.group(2), unit)
+    state.consume(rf'\b(?:runtimes?\s|running time\s|lasting\s)?(?:of\s)?between\s(\d+(?:\.\d+)?)\s(?:and|to|-)\s{_DURATION}',
+                  between)
+
+    def comparison(match):
+        bound, inclusive = COMPARATORS[match.group('cmp')]
+        _bound(state.filters, 'runtime', bound, _minutes(match.group(2), match.group(3)), inclusive, True)
+    state.consume(rf'\b(?:(?:runtimes?|running time|length|lasting)\s(?:(?:is|of)\s)?)?(?P<cmp>{_CMP})\s{_DURATION}(?:\s(?:long|runtime|in length))?',
+                  comparison)
+
+    # "runtime under 100" (minutes implied)
+    def bare(match):
+        bound, inclusive = COMPARATORS[match.group('cmp')]
+        _bound(state.filters, 'runtime', bound, int(match.group(2)), inclusive, True)
+    state.consume(rf'\b(?:runtimes?|running time)\s(?:(?:is|of)\s)?(?P<cmp>{_CMP})\s(\d+)\b', bare)
+
+def _parse_years(state):
+    def decade(match):
+        start = int(match.group(1))
+        if start < 100:
+            start += 1900 if start >= 20 else 2000
+        state.filters['release_year_min'] = start
+        state.filters['release_year_max'] = start + 9
+    state.consume(r"\b(?:in\s|from\s)?(?:the\s)?'?(\d{2}|\d{4})[']?s\b", lambda m: decade(m) if m.group(1)[-1] == '0' else False)
+
+    def between(match):
+        state.filters['release_year_min'] = int(match.group(1))
+        state.filters['release_year_max'] = int(match.group(2))
+    state.consume(r'\b(?:between|from)\s(\d{4})\s(?:and|to|through|until|-)\s(\d{4})\b', between)
+    state.consume(r'\b(\d{4})\s?-\s?(\d{4})\b', between)
+
+    def after(match):
+        state.filters['release_year_min'] = int(match.group(1)) + 1
+    state.consume(r'\b(?:after|later than)\s(\d{4})\b', after)
+
+    def since(match):
+        state.filters['release_year_min'] = int(match.group(1) or match.group(2))
+    state.consume(r'\b(?:since|from)\s(\d{4})\s?(?:on|onwards?|or later|and later)\b|\b(?:since\s|(?:in\s)?)(\d{4})\s(?:or|and)\s(?:later|after|newer)\b', since)
+    state.consume(r'\bsince\s(\d{4})()\b', since)
+
+    def before(match):
+        state.filters['release_year_max'] = int(match.group(1)) - 1
+    state.consume(r'\b(?:before|prior to|earlier than)\s(\d{4})\b', before)
+
+    def until(match):
+        state.filters['release_year_max'] = int(match.group(1) or match.group(2))
+    state.consume(r'\b(?:until|through|up to)\s(\d{4})\b|\b(?:in\s)?(\d{4})\s(?:or|and)\s(?:earlier|before|older)\b', until)
+
+    def exact(match):
+        year = int(match.group(1))
+        state.filters['release_year_min'] = year
+        state.filters['release_year_max'] = year
+    state.consume(r'\b(?:in|from|of)\s(\d{4})\b', exact)
+
+def _parse_gender(state):
+    def gender(match):
+        state.filters['lead_gender'] = _GENDER_WORDS[(match.group('g1') or match.group('g2'))]
+    state.consume(
+        rf'\b(?:(?:with|having|has)\s)?(?:an?\s)?(?P<g1>{_GENDER})[- ](?:led|leads?|protagonists?|main characters?|leading (?:roles?|characters?)|stars?)\b'
+        rf'|\b(?:led|starring|headlined)\sby\s(?:an?\s)?(?P<g2>{_GENDER})\b',
+        gender
+    )
+
+def _parse_sort(state):
+    for pattern, field, direction in SORT_PHRASES:
+        def phrase(match, field=field, direction=direction):
+            state.sort = {'field': field, 'direction': direction}
+        state.consume(rf'\b(?:{pattern})(?:\sfirst)?\b', phrase)
+
+    directions = '|'.join(f'(?P<{name}>{pattern})' for name, pattern in _DIRECTION_WORDS.items())
+
+    def explicit(match):
+        field = next(name for name in SORT_FIELDS if match.group(name))
+        # Without a direction word run_structured_query sorts ascending
+        direction = 'desc' if match.group('desc') or match.group('desc2') else 'asc'
+        if match.group('asc') or match.group('asc2'):
+            direction = 'asc'
+        state.sort = {'field': field, 'direction': direction}
+    trailing = '|'.join(f'(?P<{name}2>{pattern})' for name, pattern in _DIRECTION_WORDS.items())
+    state.consume(
+        rf'\b(?:(?:sort(?:ed)?|order(?:ed)?|rank(?:ed)?)\s)?(?:by\s)?(?:(?:{directions})\s)?(?:{_SORT_FIELD})\b'
+        rf'(?:,?\s(?:in\s)?(?:{trailing})(?:\s(?:order|first))?\b)?',
+        lambda match: explicit(match) if re.search(r'sort|order|rank|by|highest|lowest|most|least|biggest|largest|smallest|top|greatest|fewest', match.group(0)) else False
+    )
+
+def _parse_genres(state):
+    found = []
+    for genre, pattern in GENRE_PATTERNS.items():
+        def add(match, genre=genre):
+            if genre not in found:
+                found.append(genre)
+        state.consume(rf'\b(?:{pattern})\b', add)
+    if found:
+        state.filters['genres'] = found
+
+def _content_words(text):
+    return [word for word in re.findall(r"[a-z0-9$]+", text) if word not in STOPWORDS]
+
+def parse_with_rules(nl_query):
+    """
+    Parse a query with the rule grammar
+
+    Returns (parsed, confidence) where parsed has the parse_nl_to_filters shape and
+    confidence is in [0, 1]; 0 means no rule applied or the query negates something.
+    """
+    state = _Parse(str(nl_query or ''))
+    original_words = _content_words(state.text)
+
+    _parse_money(state)
+    _parse_runtime(state)
+    _parse_years(state)
+    _parse_gender(state)
+    _parse_sort(state)
+    _parse_genres(state)
+
+    parsed = {'filters': state.filters, 'sort': state.sort}
+    if not original_words or not (state.filters or state.sort):
+        return parsed, 0.0
+    if NEGATIONS.intersection(re.findall(r'[a-z]+', state.text)):
+        return parsed, 0.0
+
+    leftover = _content_words(state.text)
+    return parsed, 1.0 - len(leftover) / len(original_words)
+
+def try_parse(nl_query, min_confidence=None):
+    """Return the rule parse when it is confident enough, otherwise None"""
+    if not NL_RULES_ENABLED:
+        return None
+    if min_confidence is None:
+        min_confidence = NL_RULES_MIN_CONFIDENCE
+    start = time.perf_counter()
+    parsed, confidence = parse_with_rules(nl_query)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    accepted = confidence >= min_confidence
+    with _stats_lock:
+        _stats['attempts'] += 1
+        _stats['accepted' if accepted else 'fallbacks'] += 1
+        _stats['total_ms'] += elapsed_ms
+    return parsed if accepted else None
+
+def get_rules_stats():
+    """Fast-path counters for the monitoring endpoint"""
+    with _stats_lock:
+        stats = dict(_stats)
+    attempts = stats['attempts']
+    stats['accept_rate'] = stats['accepted'] / attempts if attempts else 0.0
+    stats['mean_ms'] = stats.pop('total_ms') / attempts if attempts else 0.0
+    stats['enabled'] = NL_RULES_ENABLED
+    stats['min_confidence'] = NL_RULES_MIN_CONFIDENCE
+    return stats
@@ -0,0 +1,255 @@
+"""
+Persistent cache for parse_nl_to_filters results
+Entries live in the parse_cache table (so they survive restarts) behind an
+in-memory LRU front. Keys combine the normalized query text, the model,
+PROMPT_VERSION and the OPENAI_BASE_URL endpoint, so changing the model, the prompt
+or the server (e.g. llm_stub_server.py) never serves another one's parses.
+
+Configuration (environment):
+    PARSE_CACHE_ENABLED       1/0 (default 1)
+    PARSE_CACHE_TTL_SECONDS   entry lifetime (default 30 days; 0 = never expire)
+    PARSE_CACHE_MAX_ENTRIES   rows kept in the table, least recently used evicted (default 5000)
+    PARSE_CACHE_MEMORY_SIZE   entries kept in the in-memory front (default 1024)
+
+Hits are not written on the request path: hit counts and last-used times are
+collected in memory and written in one batch with the next store, once
+TOUCH_BATCH_SIZE entries are pending, or at exit.
+"""
+import atexit
+import calendar
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+from flask import current_app, has_app_context
+from sqlalchemy import select, delete, update, func, bindparam
+from sqlalchemy.orm import Session
+from caching import LRUCache
+from database import db
+from models import ParseCacheEntry
+
+PARSE_CACHE_ENABLED = os.getenv('PARSE_CACHE_ENABLED', '1') == '1'
+PARSE_CACHE_TTL_SECONDS = int(os.getenv('PARSE_CACHE_TTL_SECONDS', str(30 * 24 * 3600)))
+PARSE_CACHE_MAX_ENTRIES = int(os.getenv('PARSE_CACHE_MAX_ENTRIES', '5000'))
+DEFAULT_BASE_URL = 'https://api.openai.com/v1'
+
+# Values are (stored_at epoch seconds, parsed JSON string); decoding per hit keeps callers from sharing dicts
+_memory = LRUCache(int(os.getenv('PARSE_CACHE_MEMORY_SIZE', '1024')))
+
+# Hits not yet written to the table: cache_key -> [hits, last used]
+_touches = {}
+_touches_lock = threading.Lock()
+TOUCH_BATCH_SIZE = 100
+_app = None  # for the final write at exit
+
+_stats_lock = threading.Lock()
+_stats = {'hits': 0, 'memory_hits': 0, 'db_hits': 0, 'misses': 0, 'stores': 0, 'expired': 0, 'evictions': 0, 'errors': 0}
+
+def _count(name, amount=1):
+    with _stats_lock:
+        _stats[name] += amount
+
+def normalize_query(nl_query):
+    """Canonical form of an NL query: lower-cased, single-spaced, without trailing punctuation"""
+    text = ' '.join(str(nl_query or '').lower().split())
+    return re.sub(r'[\s.?!]+$', '', text)
+
+def llm_endpoint():
+    """The OPENAI_BASE_URL in use, or '' for the default OpenAI endpoint"""
+    base_url = (os.getenv('OPENAI_BASE_URL') or '').rstrip('/')
+    return '' if base_url == DEFAULT_BASE_URL else base_url
+
+def cache_key(nl_query, model, prompt_version, endpoint=None):
+    """Stable key for a query parsed by a model with a given prompt version on an endpoint"""
+    endpoint = llm_endpoint() if endpoint is None else endpoint
+    raw = f"{prompt_version}\x00{model}\x00{normalize_query(nl_query)}"
+    if endpoint:
+        # Default-endpoint keys keep their old form, so existing entries stay valid
+        raw = f"{endpoint}\x00{raw}"
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+def _epoch(utc_datetime):
+    """Epoch seconds of a naive UTC datetime (datetime.timestamp() would read it as local time)"""
+    return calendar.timegm(utc_datetime.utctimetuple()) + utc_datetime.microsecond / 1e6
+
+def _expired(stored_at):
+    return PARSE_CACHE_TTL_SECONDS > 0 and time.time() - stored_at > PARSE_CACHE_TTL_SECONDS
+
+def _persistent():
+    """The table is only reachable inside a Flask app context"""
+    return has_app_context()
+
+def get_cached_parse(nl_query, model, prompt_version):
+    """Return a cached parse (a fresh dict) or None"""
+    if not PARSE_CACHE_ENABLED:
+        return None
+    key = cache_key(nl_query, model, prompt_version)
+
+    entry = _memory.get(key)
+    if entry is not None:
+        stored_at, parsed_json = entry
+        if not _expired(stored_at):
+            _count('hits')
+            _count('memory_hits')
+            _touch(key)
+            return json.loads(parsed_json)
+        _memory.pop(key)
+
+    if _persistent():
+        try:
+            with Session(db.engine) as session:
+                row = session.get(ParseCacheEntry, key)
+                if row is not None:
+                    stored_at = _epoch(row.created_at) if row.created_at else 0
+                    if _expired(stored_at):
+                        session.delete(row)
+                        session.commit()
+                        _count('expired')
+                    else:
+                        parsed_json = row.parsed
+                        _memory.set(key, (stored_at, parsed_json))
+                        _count('hits')
+                        _count('db_hits')
+                        _touch(key)
+                        return json.loads(parsed_json)
+        except Exception as e:
+            _count('errors')
+            print(f"Parse cache lookup failed: {e}")
+
+    _count('misses')
+    return None
+
+def store_parse(nl_query, model, prompt_version, parsed):
+    """Cache a successful parse (callers must not store fallback results)"""
+    if not PARSE_CACHE_ENABLED:
+        return
+    key = cache_key(nl_query, model, prompt_version)
+    parsed_json = json.dumps(parsed, sort_keys=True)
+    now = datetime.utcnow()
+    _memory.set(key, (_epoch(now), parsed_json))
+    _count('stores')
+
+    if not _persistent():
+        return
+    try:
+        with Session(db.engine) as session:
+            session.merge(ParseCacheEntry(
+                cache_key=key,
+                query=normalize_query(nl_query),
+                model=model,
+                prompt_version=prompt_version,
+                parsed=parsed_json,
+                created_at=now,
+                last_used_at=now,
+                hit_count=0
+            ))
+            session.flush()
+            _write_touches(session)  # so eviction sees recent hits
+            _evict(session)
+            session.commit()
+    except Exception as e:
+        _count('errors')
+        print(f"Parse cache store failed: {e}")
+
+def _touch(key):
+    """Record a hit; writes the pending hits once TOUCH_BATCH_SIZE entries have some"""
+    global _app
+    if _app is None and has_app_context():
+        _app = current_app._get_current_object()
+    with _touches_lock:
+        touch = _touches.setdefault(key, [0, None])
+        touch[0] += 1
+        touch[1] = datetime.utcnow()
+        pending = len(_touches)
+    if pending >= TOUCH_BATCH_SIZE and _persistent():
+        flush_touches()
+
+def _take_touches():
+    global _touches
+    with _touches_lock:
+        touches, _touches = _touches, {}
+    return touches
+
+def _write_touches(session):
+    """Add pending hit counts and last-used times to their rows in the session's transaction"""
+    touches = _take_touches()
+    if not touches:
+        return
+    table = ParseCacheEntry.__table__
+    session.connection().execute(
+        update(table).where(table.c.cache_key == bindparam('key')).values(
+            hit_count=func.coalesce(table.c.hit_count, 0) + bindparam('hits'),
+            last_used_at=bindparam('used')
+        ),
+        [{'key': key, 'hits': hits, 'used': used} for key, (hits, used) in touches.items()]
+    )
+
+def flush_touches():
+    """Write pending hits (best-effort: they only steer eviction, so a failed batch is dropped)"""
+    if not _persistent():
+        return
+    try:
+        with Session(db.engine) as session:
+            _write_touches(session)
+            session.commit()
+    except Exception as e:
+        _count('errors')
+        print(f"Parse cache hit update failed: {e}")
+
+def _flush_touches_at_exit():
+    if _app is not None:
+        with _app.app_context():
+            flush_touches()
+
+atexit.register(_flush_touches_at_exit)
+
+def _evict(session):
+    """Drop expired rows and the least recently used rows beyond PARSE_CACHE_MAX_ENTRIES"""
+    if PARSE_CACHE_TTL_SECONDS > 0:
+        cutoff = datetime.utcnow() - timedelta(seconds=PARSE_CACHE_TTL_SECONDS)
+        result = session.execute(delete(ParseCacheEntry).where(ParseCacheEntry.created_at < cutoff))
+        _count('expired', result.rowcount or 0)
+
+    if PARSE_CACHE_MAX_ENTRIES > 0:
+        total = session.scalar(select(func.count()).select_from(ParseCacheEntry))
+        excess = total - PARSE_CACHE_MAX_ENTRIES
+        if excess > 0:
+            oldest = select(ParseCacheEntry.cache_key).order_by(
+                ParseCacheEntry.last_used_at.asc()
+            ).limit(excess)
+            result = session.execute(
+                delete(ParseCacheEntry).where(ParseCacheEntry.cache_key.in_(oldest))
+            )
+            _count('evictions', result.rowcount or 0)
+
+def clear_parse_cache():
+    """Remove every cached parse (memory and table)"""
+    _memory.clear()
+    _take_touches()
+    if _persistent():
+        with Session(db.engine) as session:
+            session.execute(delete(ParseCacheEntry))
+            session.commit()
+
+def get_parse_cache_stats():
+    """Hit/miss counters for the monitoring endpoint"""
+    with _stats_lock:
+        stats = dict(_stats)
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+    stats['enabled'] = PARSE_CACHE_ENABLED
+    stats['ttl_seconds'] = PARSE_CACHE_TTL_SECONDS
+    stats['max_entries'] = PARSE_CACHE_MAX_ENTRIES
+    stats['memory'] = _memory.stats()
+    with _touches_lock:
+        stats['pending_touches'] = len(_touches)
+    if _persistent():
+        try:
+            with Session(db.engine) as session:
+                stats['entries'] = session.scalar(select(func.count()).select_from(ParseCacheEntry))
+        except Exception:
+            stats['entries'] = None
+    return stats
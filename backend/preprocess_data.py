@@ -6,7 +6,11 @@ import pandas as pd
 import json
 from app import app
 from database import db
-from models import Movie, Task
+from models import Movie, MovieGenre, Task, LogEntry
+from full_text import build_full_text_index
+from semantic_index import build_semantic_index
+from data_access import bump_data_version
+from sqlalchemy import text
 import os
 
 def extract_genres(genres_str):
@@ -51,7 +55,6 @@ def load_movies_from_csv(csv_path):
                 title=row.get('title', 'Unknown'),
                 release_year=int(row.get('release_date', '1900')[:4]) if pd.notna(row.get('release_date')) else None,
                 runtime=int(row.get('runtime', 0)) if pd.notna(row.get('runtime')) else None,
-                genres=json.dumps(genres),
                 lead_gender=determine_lead_gender(row),  # Placeholder
                 budget=float(row.get('budget', 0)) if pd.notna(row.get('budget')) and row.get('budget') > 0 else None,
                 revenue=float(row.get('revenue', 0)) if pd.notna(row.get('revenue')) and row.get('revenue') > 0 else None,
@@ -59,6 +62,7 @@ def load_movies_from_csv(csv_path):
                 overview=row.get('overview', ''),
                 tmdb_id=int(row.get('id', idx)) if pd.notna(row.get('id')) else None
             )
+            movie.set_genres(genres)
             
             db.session.add(movie)
             movies_added += 1
@@ -75,6 +79,40 @@ def load_movies_from_csv(csv_path):
     print(f"Successfully loaded {movies_added} movies into database")
     return movies_added
 
+def sync_movie_genres():
+    """Backfill the movie_genres table for movies loaded before it existed"""
+    if MovieGenre.query.first() is not None:
+        return 0
+    
+    movies = Movie.query.all()
+    for movie in movies:
+        try:
+            genres = json.loads(movie.genres) if movie.genres else []
+        except (TypeError, ValueError):
+            genres = []
+        movie.set_genres(genres)
+    
+    db.session.commit()
+    print(f"Indexed genres for {len(movies)} movies")
+    return len(movies)
+
+def ensure_movie_indexes():
+    """Create movie indexes missing from databases built before they were defined"""
+    for table in (Movie.__table__, MovieGenre.__table__):
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+    
+    # Refresh planner statistics so the new indexes are actually chosen
+    db.session.execute(text('ANALYZE'))
+    db.session.commit()
+
+def ensure_log_indexes():
+    """Create log_entries indexes missing from databases built before they were defined"""
+    for index in LogEntry.__table__.indexes:
+        index.create(db.engine, checkfirst=True)
+    db.session.execute(text('ANALYZE log_entries'))
+    db.session.commit()
+
 def create_sample_tasks():
     """Create sample tasks for the experiment"""
     tasks = [
@@ -143,6 +181,7 @@ if __name__ == '__main__':
         # Check if movies already exist
         if Movie.query.count() > 0:
             print("Movies already loaded. Skipping data load.")
+            sync_movie_genres()
         else:
             # Look for TMDB CSV file
             csv_path = os.getenv('TMDB_CSV_PATH', 'tmdb_5000_movies.csv')
@@ -153,6 +192,14 @@ if __name__ == '__main__':
                 print("Please download TMDB 5000 dataset and specify path in TMDB_CSV_PATH env var")
                 print("Or place the CSV file in the backend directory as 'tmdb_5000_movies.csv'")
         
+        ensure_movie_indexes()
+        ensure_log_indexes()
+        build_full_text_index()
+        build_semantic_index()
+        
+        # Running servers drop their cached movie data on their next request
+        bump_data_version()
+        
         # Create sample tasks
         if Task.query.count() == 0:
             create_sample_tasks()
@@ -0,0 +1,126 @@
+"""
+Token-budgeted context for RAG answers
+Chooses the movie columns a parsed query actually refers to and packs retrieved
+rows into a table until RAG_CONTEXT_TOKENS is reached. Only the prompt is
+budgeted: retrieval, the displayed results and the logs keep every row.
+
+Token counts use tiktoken when it is installed and otherwise estimate about
+four characters per token.
+
+Configuration (environment):
+    RAG_CONTEXT_TOKENS    token budget for the movies table (default 2000)
+    RAG_MAX_ROWS          upper bound on rows in the table (default 50)
+"""
+import math
+import os
+
+RAG_CONTEXT_TOKENS = int(os.getenv('RAG_CONTEXT_TOKENS', '2000'))
+RAG_MAX_ROWS = int(os.getenv('RAG_MAX_ROWS', '50'))
+
+# Overview text is cut to this many characters when it is included
+OVERVIEW_CHARS = 240
+
+# Column -> table header
+COLUMNS = {
+    'id': 'ID',
+    'title': 'Title',
+    'release_year': 'Year',
+    'runtime': 'Runtime',
+    'genres': 'Genres',
+    'lead_gender': 'Lead Gender',
+    'budget': 'Budget',
+    'revenue': 'Revenue',
+    'overview': 'Overview',
+}
+
+# Filter keys -> the column they refer to
+FILTER_COLUMNS = {
+    'genres': 'genres', 'lead_gender': 'lead_gender',
+    'release_year_min': 'release_year', 'release_year_max': 'release_year',
+    'runtime_min': 'runtime', 'runtime_max': 'runtime',
+    'budget_min': 'budget', 'budget_max': 'budget',
+    'revenue_min': 'revenue', 'revenue_max': 'revenue',
+    'text': 'overview',
+}
+
+_encoder = None
+_encoder_loaded = False
+
+def _get_encoder():
+    """tiktoken encoder for OPENAI_MODEL, or None when tiktoken is not installed"""
+    global _encoder, _encoder_loaded
+    if not _encoder_loaded:
+        _encoder_loaded = True
+        try:
+            import tiktoken
+            try:
+                _encoder = tiktoken.encoding_for_model(os.getenv('OPENAI_MODEL', 'gpt-4'))
+            except KeyError:
+                _encoder = tiktoken.get_encoding('cl100k_base')
+        except Exception:
+            _encoder = None
+    return _encoder
+
+def count_tokens(text):
+    """Number of tokens in text (exact with tiktoken, otherwise ~4 characters per token)"""
+    encoder = _get_encoder()
+    if encoder is not None:
+        return len(encoder.encode(text))
+    return math.ceil(len(text) / 4)
+
+def select_columns(parsed):
+    """
+    Columns the answer needs for a parsed query: id, title and year always, plus
+    every filtered or sorted field. Queries with no structured constraints are
+    topical, so they get genres and the overview instead.
+    """
+    parsed = parsed or {}
+    filters = parsed.get('filters') or {}
+    sort = parsed.get('sort') or {}
+
+    columns = {'id', 'title', 'release_year'}
+    columns.update(FILTER_COLUMNS[key] for key, value in filters.items()
+                   if key in FILTER_COLUMNS and value not in (None, '', []))
+    if sort.get('field') in COLUMNS:
+        columns.add(sort['field'])
+    elif sort.get('field') == 'relevance':
+        columns.add('overview')
+    if not (set(filters) & set(FILTER_COLUMNS)) and not sort.get('field'):
+        columns.update(('genres', 'overview'))
+    return [column for column in COLUMNS if column in columns]
+
+def format_cell(movie, column):
+    """Table cell text for one movie field"""
+    value = movie.get(column)
+    if column == 'genres':
+        return ", ".join(value or [])
+    if column in ('budget', 'revenue'):
+        return f"${value:,.0f}" if value else "N/A"
+    if column == 'runtime':
+        return f"{value} min" if value is not None else "N/A"
+    if column == 'overview':
+        text = ' '.join(str(value or '').split())
+        return text if len(text) <= OVERVIEW_CHARS else text[:OVERVIEW_CHARS].rsplit(' ', 1)[0] + '...'
+    return str(value) if value is not None else "N/A"
+
+def build_movies_table(rows, columns, budget=None):
+    """
+    Pipe-separated table of as many rows as fit the token budget
+
+    Returns (table text, number of rows included).
+    """
+    budget = RAG_CONTEXT_TOKENS if budget is None else budget
+    header = " | ".join(COLUMNS[column] for column in columns)
+    lines = [header, "-" * len(header)]
+    used = count_tokens(header) + count_tokens(lines[1]) + 2
+
+    included = 0
+    for movie in rows[:RAG_MAX_ROWS]:
+        line = " | ".join(format_cell(movie, column) for column in columns)
+        line_tokens = count_tokens(line) + 1
+        if included and used + line_tokens > budget:
+            break
+        lines.append(line)
+        used += line_tokens
+        included += 1
+    return "\n".join(lines) + "\n", included
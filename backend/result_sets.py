@@ -0,0 +1,132 @@
+"""
+Content-addressed storage of logged result ID lists
+query_executed and retrieval_completed events used to carry their full ID lists
+(up to 1000 ints of JSON each). Instead, each distinct ordered list is stored
+once in the result_sets table, encoded as zigzag delta varints, and the log
+payload references it by hash:
+
+    {'result_ids': [...]}     ->  {'result_set': '<sha256>'}
+    {'retrieved_ids': [...]}  ->  {'retrieved_set': '<sha256>'}
+
+The result_sets rows are not written on the request path: reference_result_sets
+hands them to the log sink, which inserts them in the same transaction as the
+log entry referencing them (see log_sink.log_event). resolve_logs() puts the ID
+lists back for analysis.
+
+Configuration (environment):
+    RESULT_SETS_ENABLED    1/0 (default 1; 0 logs ID lists inline as before)
+"""
+import hashlib
+import os
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql, sqlite
+from caching import LRUCache
+from database import db
+from models import ResultSet
+
+RESULT_SETS_ENABLED = os.getenv('RESULT_SETS_ENABLED', '1') == '1'
+
+# Payload key holding an ID list -> key holding its result set hash
+REFERENCE_KEYS = {'result_ids': 'result_set', 'retrieved_ids': 'retrieved_set'}
+
+# Hashes known to be stored (committed), so repeated result sets are not written again
+_stored = LRUCache(4096)
+
+def encode_ids(ids):
+    """Ordered ints -> bytes: deltas between neighbours, zigzag-mapped to unsigned, as varints"""
+    out = bytearray()
+    previous = 0
+    for value in ids:
+        delta = int(value) - previous
+        previous = int(value)
+        unsigned = delta * 2 if delta >= 0 else -delta * 2 - 1
+        while unsigned >= 0x80:
+            out.append((unsigned & 0x7F) | 0x80)
+            unsigned >>= 7
+        out.append(unsigned)
+    return bytes(out)
+
+def decode_ids(data):
+    """Inverse of encode_ids"""
+    ids = []
+    previous = unsigned = shift = 0
+    for byte in data:
+        unsigned |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        previous += unsigned >> 1 if not unsigned & 1 else -((unsigned + 1) >> 1)
+        ids.append(previous)
+        unsigned = shift = 0
+    return ids
+
+def result_set_row(ids):
+    """(hash, result_sets row) of an ordered ID list; the row is None when it is known to be stored"""
+    data = encode_ids(ids)
+    digest = hashlib.sha256(data).hexdigest()
+    if _stored.get(digest):
+        return digest, None
+    return digest, {'hash': digest, 'count': len(ids), 'data': data}
+
+def insert_result_sets(session, rows):
+    """Insert result_sets rows in the session's transaction, skipping hashes already stored"""
+    rows = list({row['hash']: row for row in rows}.values())
+    if not rows:
+        return
+    dialect = session.get_bind().dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        insert = sqlite.insert if dialect == 'sqlite' else postgresql.insert
+        session.execute(insert(ResultSet).on_conflict_do_nothing(index_elements=['hash']), rows)
+    else:
+        existing = set(session.execute(
+            select(ResultSet.hash).where(ResultSet.hash.in_([row['hash'] for row in rows]))).scalars())
+        session.add_all(ResultSet(**row) for row in rows if row['hash'] not in existing)
+
+def mark_stored(rows):
+    """Remember result_sets rows as stored once their transaction has committed"""
+    for row in rows:
+        _stored.set(row['hash'], True)
+
+def reference_result_sets(payload):
+    """
+    Log payload with its ID lists replaced by result set hashes
+
+    Returns (payload, result_sets rows to write with the log entry).
+    """
+    if not RESULT_SETS_ENABLED:
+        return payload, []
+    payload = dict(payload)
+    rows = []
+    for key, reference in REFERENCE_KEYS.items():
+        if isinstance(payload.get(key), list):
+            payload[reference], row = result_set_row(payload.pop(key))
+            if row is not None:
+                rows.append(row)
+    return payload, rows
+
+def load_result_sets(hashes):
+    """hash -> ID list for the given hashes (needs an app context)"""
+    hashes = list(set(hashes))
+    result = {}
+    for start in range(0, len(hashes), 500):
+        rows = db.session.execute(
+            select(ResultSet.hash, ResultSet.data).where(ResultSet.hash.in_(hashes[start:start + 500]))
+        )
+        result.update((digest, decode_ids(data)) for digest, data in rows)
+    return result
+
+def resolve_logs(logs):
+    """Put the ID lists back into LogEntry.to_dict() payloads that reference result sets (in place)"""
+    wanted = [log['payload'][reference] for log in logs for reference in REFERENCE_KEYS.values()
+              if isinstance(log.get('payload'), dict) and log['payload'].get(reference)]
+    if not wanted:
+        return logs
+    sets = load_result_sets(wanted)
+    for log in logs:
+        payload = log.get('payload')
+        if not isinstance(payload, dict):
+            continue
+        for key, reference in REFERENCE_KEYS.items():
+            if payload.get(reference) in sets:
+                payload[key] = sets[payload[reference]]
+    return logs
@@ -1,17 +1,25 @@
 """
 Logging routes: for logging various events
 """
+import math
+from datetime import datetime, timedelta
 from flask import Blueprint, request, jsonify
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError
 from database import db
-from models import LogEntry
-from datetime import datetime
-import json
+from models import LogEntry, ClientEventSeq
+import log_sink
 
 bp = Blueprint('logging', __name__, url_prefix='/api/log')
 
 @bp.route('', methods=['POST'])
 def log_event():
-    """Generic event logging endpoint"""
+    """
+    Generic event logging endpoint
+    
+    Answers {'status': 'queued'} while the log sink buffers entries (the default), and
+    {'status': 'logged', 'log_id': ...} with LOG_SINK_MODE=sync.
+    """
     data = request.json
     participant_id = data.get('participant_id')
     interface_type = data.get('interface_type')
@@ -22,18 +30,140 @@ def log_event():
     if not participant_id or not event_type:
         return jsonify({'error': 'participant_id and event_type required'}), 400
     
-    log_entry = LogEntry(
-        participant_id=participant_id,
-        interface_type=interface_type,
-        task_id=task_id,
-        event_type=event_type,
-        payload=json.dumps(payload) if payload else None
-    )
+    return log_event_internal(participant_id, interface_type, task_id, event_type, payload)
+
+# Upper bound on events per /api/log/batch request
+MAX_BATCH_EVENTS = 1000
+
+EPOCH = datetime(1970, 1, 1)
+
+def client_millis(value):
+    """A client timestamp (epoch milliseconds) as a float, or None if it is not one"""
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return value if math.isfinite(value) and value > 0 else None
+
+def client_clock_offset(sent_ts, client_times, server_ms):
+    """
+    Milliseconds to add to the client's clock to read the server's
+    
+    Estimated from the batch's send time (sent_ts), or, for clients that do not
+    send it, by assuming the latest event happened as the batch arrived.
+    """
+    sent_ms = client_millis(sent_ts)
+    if sent_ms is not None:
+        return server_ms - sent_ms
+    return server_ms - max(client_times) if client_times else 0.0
+
+@bp.route('/batch', methods=['POST'])
+def log_batch():
+    """
+    Log a batch of client-side events in one transaction
+    
+    Body: participant_id, session_id (random per page load), sent_ts (client clock
+    when sending) and events, each with event_type, optional interface_type/task_id/
+    payload (interface_type and task_id default to the batch's), the client timestamp
+    `client_ts` (epoch milliseconds) and sequence number `seq`. Timestamp and seq are
+    kept under payload['_client']; events whose (participant, session, seq) was
+    already logged are skipped, so a batch can be resent safely after a failed request.
     
-    db.session.add(log_entry)
-    db.session.commit()
+    An event's timestamp is its client_ts moved onto the server clock by the batch's
+    clock offset and capped at the time the batch arrived, so events keep the order
+    and spacing they happened in, before the server events they caused. Events
+    without a usable client_ts get the arrival time.
+    """
+    data = request.json or {}
+    participant_id = data.get('participant_id')
+    session_id = data.get('session_id')
+    events = data.get('events')
+    
+    if not participant_id or not isinstance(events, list):
+        return jsonify({'error': 'participant_id and events required'}), 400
+    if len(events) > MAX_BATCH_EVENTS:
+        return jsonify({'error': f'at most {MAX_BATCH_EVENTS} events per batch'}), 400
+    if any(not isinstance(event, dict) or not event.get('event_type') for event in events):
+        return jsonify({'error': 'every event needs an event_type'}), 400
+    if session_id is not None:
+        session_id = str(session_id)[:64]
+    
+    # Order by sequence number; the first copy of a seq repeated within the batch wins
+    def seq_of(event):
+        try:
+            return int(event['seq'])
+        except (KeyError, TypeError, ValueError):
+            return None
+    
+    received_at = datetime.utcnow()
+    server_ms = (received_at - EPOCH).total_seconds() * 1000
+    offset_ms = client_clock_offset(data.get('sent_ts'), [
+        ts for ts in (client_millis(event.get('client_ts')) for event in events) if ts is not None
+    ], server_ms)
     
-    return jsonify({'status': 'logged', 'log_id': log_entry.id}), 200
+    def timestamp_of(event):
+        client_ms = client_millis(event.get('client_ts'))
+        if client_ms is None:
+            return received_at
+        return EPOCH + timedelta(milliseconds=min(client_ms + offset_ms, server_ms))
+    
+    unique, seen = [], set()
+    for event in sorted(events, key=lambda event: (seq_of(event) is None, seq_of(event) or 0)):
+        seq = seq_of(event)
+        if seq is not None and session_id and seq in seen:
+            continue
+        seen.add(seq)
+        unique.append((seq, event))
+    
+    for attempt in range(2):
+        try:
+            logged = set()
+            if session_id:
+                seqs = [seq for seq, _ in unique if seq is not None]
+                logged = set(db.session.execute(
+                    select(ClientEventSeq.seq).where(
+                        ClientEventSeq.participant_id == participant_id,
+                        ClientEventSeq.client_session == session_id,
+                        ClientEventSeq.seq.in_(seqs)
+                    )
+                ).scalars()) if seqs else set()
+            
+            rows, seq_rows = [], []
+            for seq, event in unique:
+                if seq is not None and seq in logged:
+                    continue
+                payload = event.get('payload') or {}
+                payload = dict(payload) if isinstance(payload, dict) else {'value': payload}
+                payload['_client'] = {'ts': event.get('client_ts'), 'seq': seq, 'session': session_id}
+                rows.append(log_sink.make_row(
+                    participant_id,
+                    event.get('interface_type', data.get('interface_type')),
+                    event.get('task_id', data.get('task_id')),
+                    event['event_type'],
+                    payload,
+                    timestamp_of(event)
+                ))
+                if session_id and seq is not None:
+                    seq_rows.append({'participant_id': participant_id, 'client_session': session_id, 'seq': seq})
+            
+            if rows:
+                db.session.execute(insert(LogEntry), rows)
+            if seq_rows:
+                db.session.execute(insert(ClientEventSeq), seq_rows)
+            db.session.commit()
+            break
+        except IntegrityError:
+            # A concurrent resend of the same events won; re-check which are logged now
+            db.session.rollback()
+            if attempt:
+                raise
+    
+    return jsonify({
+        'status': 'logged',
+        'received': len(events),
+        'logged': len(rows),
+        'duplicates': len(events) - len(rows)
+    }), 200
 
 @bp.route('/task/start', methods=['POST'])
 def start_task():
@@ -57,17 +187,11 @@ def end_task():
     return log_event_internal(participant_id, interface_type, task_id, 'task_completed', submission)
 
 def log_event_internal(participant_id, interface_type, task_id, event_type, payload):
-    """Internal helper for logging"""
-    log_entry = LogEntry(
-        participant_id=participant_id,
-        interface_type=interface_type,
-        task_id=task_id,
-        event_type=event_type,
-        payload=json.dumps(payload) if payload else None
-    )
-    
-    db.session.add(log_entry)
-    db.session.commit()
-    
-    return jsonify({'status': 'logged', 'log_id': log_entry.id}), 200
+    """Internal helper for logging (the entry is written by the log sink)"""
+    log_id = log_sink.log_event(participant_id, interface_type, task_id, event_type, payload)
+    
+    # Buffered entries get their id when the sink writes them
+    if log_id is None:
+        return jsonify({'status': 'queued'}), 200
+    return jsonify({'status': 'logged', 'log_id': log_id}), 200
 
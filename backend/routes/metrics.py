@@ -0,0 +1,31 @@
+"""
+Metrics routes: cache and performance counters for monitoring
+"""
+from flask import Blueprint, jsonify
+from data_access import get_query_cache_stats, get_row_json_cache_stats
+from parse_cache import get_parse_cache_stats
+from nl_rules import get_rules_stats
+from llm_client import get_llm_client_stats
+from speculation import get_speculation_stats
+from llm_integration import get_coalescing_stats
+from llm_metrics import get_llm_metrics
+from answer_cache import get_answer_cache_stats
+from log_sink import get_log_sink_stats
+
+bp = Blueprint('metrics', __name__, url_prefix='/api/metrics')
+
+@bp.route('', methods=['GET'])
+def get_metrics():
+    """Get process-level performance counters"""
+    return jsonify({
+        'query_cache': get_query_cache_stats(),
+        'row_json_cache': get_row_json_cache_stats(),
+        'parse_cache': get_parse_cache_stats(),
+        'nl_rules': get_rules_stats(),
+        'llm_client': get_llm_client_stats(),
+        'speculation': get_speculation_stats(),
+        'llm_coalescing': get_coalescing_stats(),
+        'llm_calls': get_llm_metrics(),
+        'answer_cache': get_answer_cache_stats(),
+        'log_sink': get_log_sink_stats()
+    }), 200
@@ -1,27 +1,96 @@
 """
 Search routes: faceted, LLM-assisted, and LLM-only search endpoints
 """
-from flask import Blueprint, request, jsonify
-from database import db
-from models import LogEntry
-from data_access import run_structured_query
-from llm_integration import parse_nl_to_filters, answer_with_rag, retrieve_movies_for_rag
+from flask import Blueprint, request, jsonify, Response, stream_with_context
+import log_sink
+from result_sets import reference_result_sets
+from data_access import run_structured_query, run_paginated_query, paginate_rows, project_rows, get_facet_counts, serialize_movie_rows, semantic_search_movies, get_result_ids
+from llm_integration import parse_nl_to_filters, parse_nl_query, answer_with_rag, answer_with_rag_stream, retrieve_movies_for_rag, lookup_cached_answer
+from speculation import start_speculation, claim_speculation, first_page_limit, QUERY_LIMIT
+from llm_metrics import set_request_context
 from datetime import datetime
 import json
+import os
 
 bp = Blueprint('search', __name__, url_prefix='/api/search')
 
 def log_event(participant_id, interface_type, task_id, event_type, payload):
-    """Helper to log events"""
-    log_entry = LogEntry(
-        participant_id=participant_id,
-        interface_type=interface_type,
-        task_id=task_id,
-        event_type=event_type,
-        payload=json.dumps(payload) if payload else None
-    )
-    db.session.add(log_entry)
-    db.session.commit()
+    """Helper to log events (queued for the log sink's next bulk insert)"""
+    result_sets = []
+    if payload:
+        # ID lists are stored once and referenced by hash, written with the entry
+        payload, result_sets = reference_result_sets(payload)
+    log_sink.log_event(participant_id, interface_type, task_id, event_type, payload, result_sets=result_sets)
+
+def search_response(results, **fields):
+    """
+    JSON response with movie results plus extra top-level fields
+    
+    With FAST_JSON_RESPONSES enabled (the default) the body is assembled from
+    pre-encoded row fragments instead of re-encoding every row with jsonify.
+    """
+    if os.getenv('FAST_JSON_RESPONSES', '1') == '0':
+        return jsonify({'results': results, **fields}), 200
+    
+    parts = ['"results":' + serialize_movie_rows(results)]
+    for key, value in fields.items():
+        parts.append(json.dumps(key) + ':' + json.dumps(value, separators=(',', ':')))
+    return Response('{' + ','.join(parts) + '}', mimetype='application/json'), 200
+
+# Upper bound for the page_size request option
+MAX_PAGE_SIZE = 1000
+
+def requested_page_size(data):
+    """The page_size request option within 1..MAX_PAGE_SIZE, or None; raises ValueError if invalid"""
+    page_size = data.get('page_size')
+    if not page_size:
+        return None
+    try:
+        page_size = int(page_size)
+    except (ValueError, TypeError):
+        raise ValueError('page_size must be an integer')
+    return max(1, min(page_size, MAX_PAGE_SIZE))
+
+def run_search(data, filters, sort, rows=None):
+    """
+    Run a structured search honouring the optional request options:
+    page_size/cursor for keyset pagination and fields for projection
+    
+    rows may hold the start of the query's result when it is already known, e.g.
+    from speculative execution (fetched with first_page_limit); it is used for
+    the first page whenever it decides whether more rows follow.
+    
+    Returns (results, next_cursor); raises ValueError for invalid options
+    """
+    fields = data.get('fields')
+    page_size = requested_page_size(data)
+    if page_size:
+        if rows is not None and not data.get('cursor') and (len(rows) > page_size or len(rows) < QUERY_LIMIT):
+            return paginate_rows(rows, sort, page_size, fields)
+        return run_paginated_query(filters=filters, sort=sort, page_size=page_size,
+                                   cursor=data.get('cursor'), fields=fields)
+    if rows is None:
+        rows = run_structured_query(filters=filters, sort=sort)
+    return project_rows(rows, fields), None
+
+def whole_result_ids(filters, sort, results, next_cursor):
+    """
+    Ids of the rows matching the query, in order and up to QUERY_LIMIT, given the first page
+    
+    result_count/result_ids in query_executed describe this result whatever the page
+    size, capped like the unpaginated query was, so counts stay comparable.
+    """
+    if next_cursor is None:
+        return [row['id'] for row in results]
+    return get_result_ids(filters=filters, sort=sort, limit=QUERY_LIMIT)
+
+def page_payload(results, next_cursor):
+    """Log payload of a results_page_loaded event (a later page of an executed query)"""
+    return {
+        'page_count': len(results),
+        'page_ids': [r['id'] for r in results],
+        'has_more': next_cursor is not None
+    }
 
 @bp.route('/faceted', methods=['POST'])
 def faceted_search():
@@ -31,26 +100,51 @@ def faceted_search():
     task_id = data.get('task_id')
     filters = data.get('filters', {})
     sort = data.get('sort')
+    cursor = data.get('cursor')
     
-    # Log filter change
-    log_event(participant_id, 'faceted', task_id, 'filter_change', {
-        'filters': filters,
-        'sort': sort
-    })
+    # Log filter change (a cursor means "load more" for the same filters)
+    if not cursor:
+        log_event(participant_id, 'faceted', task_id, 'filter_change', {
+            'filters': filters,
+            'sort': sort
+        })
     
     # Execute query
-    results = run_structured_query(filters=filters, sort=sort)
+    try:
+        results, next_cursor = run_search(data, filters, sort)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
-    # Log query execution
+    if cursor:
+        log_event(participant_id, 'faceted', task_id, 'results_page_loaded', page_payload(results, next_cursor))
+        return search_response(results, count=len(results), next_cursor=next_cursor)
+    
+    # Log query execution (the whole result, not just the first page)
+    result_ids = whole_result_ids(filters, sort, results, next_cursor)
     log_event(participant_id, 'faceted', task_id, 'query_executed', {
-        'result_count': len(results),
-        'result_ids': [r['id'] for r in results]
+        'result_count': len(result_ids),
+        'result_ids': result_ids,
+        'page_count': len(results),
+        'has_more': next_cursor is not None
     })
     
-    return jsonify({
-        'results': results,
-        'count': len(results)
-    }), 200
+    return search_response(results, count=len(results), next_cursor=next_cursor,
+                           result_count=len(result_ids))
+
+@bp.route('/facets', methods=['POST'])
+def facet_counts():
+    """Live facet counts for the faceted interface's current filter state"""
+    data = request.json or {}
+    filters = data.get('filters', {})
+    
+    return jsonify(get_facet_counts(filters)), 200
+
+@bp.route('/result_ids', methods=['POST'])
+def result_ids():
+    """Ids of a query's rows (up to QUERY_LIMIT), for "Select All" over rows not loaded yet"""
+    data = request.json or {}
+    ids = get_result_ids(filters=data.get('filters', {}), sort=data.get('sort'), limit=QUERY_LIMIT)
+    return jsonify({'result_ids': ids, 'result_count': len(ids)}), 200
 
 @bp.route('/llm_assist/parse', methods=['POST'])
 def llm_assist_parse():
@@ -62,23 +156,35 @@ def llm_assist_parse():
     
     if not nl_query:
         return jsonify({'error': 'nl_query required'}), 400
+    # Checked before parsing, so a bad option costs no LLM call
+    try:
+        page_size = requested_page_size(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
     # Log NL query
     log_event(participant_id, 'llm_assist', task_id, 'nl_query_sent', {
         'query': nl_query
     })
     
-    # Parse query
-    parsed = parse_nl_to_filters(nl_query)
+    # Parse query (LLM calls are logged against this participant/task)
+    set_request_context(participant_id, 'llm_assist', task_id)
+    parsed, source = parse_nl_query(nl_query)
     
-    # Log parsed preview
+    # Start running the query (its first page) while the participant reviews the preview
+    preview_token = start_speculation(parsed, first_page_limit(page_size))
+    
+    # Log parsed preview (source: 'rules', 'cache', 'llm' or 'fallback')
     log_event(participant_id, 'llm_assist', task_id, 'parsed_preview', {
-        'parsed_query': parsed
+        'parsed_query': parsed,
+        'source': source,
+        'preview_token': preview_token
     })
     
     return jsonify({
         'parsed_query': parsed,
-        'human_readable': format_parsed_query(parsed)
+        'human_readable': format_parsed_query(parsed),
+        'preview_token': preview_token
     }), 200
 
 @bp.route('/llm_assist/execute', methods=['POST'])
@@ -91,25 +197,42 @@ def llm_assist_execute():
     
     filters = parsed_query.get('filters', {})
     sort = parsed_query.get('sort')
+    cursor = data.get('cursor')
     
-    # Log confirmation
-    log_event(participant_id, 'llm_assist', task_id, 'query_confirmed', {
-        'parsed_query': parsed_query
-    })
+    # Log confirmation (a cursor means "load more" for an already confirmed query)
+    if not cursor:
+        log_event(participant_id, 'llm_assist', task_id, 'query_confirmed', {
+            'parsed_query': parsed_query
+        })
     
-    # Execute query
-    results = run_structured_query(filters=filters, sort=sort)
+    # Execute query, using the rows speculated at parse time if the confirmed query is unchanged
+    speculated_rows, speculation = None, None
+    try:
+        if data.get('preview_token') and not cursor:
+            speculated_rows, speculation = claim_speculation(data['preview_token'], filters, sort,
+                                                             first_page_limit(requested_page_size(data)))
+        results, next_cursor = run_search(data, filters, sort, rows=speculated_rows)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
-    # Log execution
-    log_event(participant_id, 'llm_assist', task_id, 'query_executed', {
-        'result_count': len(results),
-        'result_ids': [r['id'] for r in results]
-    })
+    if cursor:
+        log_event(participant_id, 'llm_assist', task_id, 'results_page_loaded', page_payload(results, next_cursor))
+        return search_response(results, count=len(results), next_cursor=next_cursor)
     
-    return jsonify({
-        'results': results,
-        'count': len(results)
-    }), 200
+    # Log execution (the whole result, not just the first page)
+    result_ids = whole_result_ids(filters, sort, results, next_cursor)
+    payload = {
+        'result_count': len(result_ids),
+        'result_ids': result_ids,
+        'page_count': len(results),
+        'has_more': next_cursor is not None
+    }
+    if speculation:
+        payload['speculation'] = speculation
+    log_event(participant_id, 'llm_assist', task_id, 'query_executed', payload)
+    
+    return search_response(results, count=len(results), next_cursor=next_cursor,
+                           result_count=len(result_ids))
 
 @bp.route('/llm_only', methods=['POST'])
 def llm_only_search():
@@ -122,13 +245,19 @@ def llm_only_search():
     if not nl_query:
         return jsonify({'error': 'nl_query required'}), 400
     
-    # Log NL query
-    log_event(participant_id, 'llm_only', task_id, 'nl_query_sent', {
-        'query': nl_query
-    })
+    # Log NL query, unless this retries a streamed request that logged it already
+    # (a second nl_query_sent would count as a reformulation)
+    if not data.get('retry'):
+        log_event(participant_id, 'llm_only', task_id, 'nl_query_sent', {
+            'query': nl_query
+        })
+    
+    # Parse once; retrieval and the answer's context both use it
+    set_request_context(participant_id, 'llm_only', task_id)
+    parsed = parse_nl_to_filters(nl_query)
     
     # Retrieve relevant movies
-    retrieved_movies = retrieve_movies_for_rag(nl_query, run_structured_query)
+    retrieved_movies = retrieve_movies_for_rag(nl_query, run_structured_query, semantic_search_movies, parsed=parsed)
     
     # Log retrieval
     log_event(participant_id, 'llm_only', task_id, 'retrieval_completed', {
@@ -136,26 +265,98 @@ def llm_only_search():
         'retrieved_ids': [m['id'] for m in retrieved_movies]
     })
     
-    # Generate RAG answer
-    answer = answer_with_rag(nl_query, retrieved_movies)
+    # Generate RAG answer (unless the same question over the same rows was answered before)
+    answer, cache_match = lookup_cached_answer(nl_query, retrieved_movies)
+    if answer is None:
+        answer = answer_with_rag(nl_query, retrieved_movies, parsed=parsed)
     
     # Log answer generation
-    log_event(participant_id, 'llm_only', task_id, 'answer_generated', {
+    payload = {
         'answer': answer,
         'result_count': len(retrieved_movies)
+    }
+    if cache_match:
+        payload['answer_cache'] = cache_match
+    log_event(participant_id, 'llm_only', task_id, 'answer_generated', payload)
+    
+    return search_response(retrieved_movies, answer=answer, count=len(retrieved_movies))
+
+def sse_event(event, data):
+    """One server-sent event; data may be a dict or an already-encoded JSON string"""
+    if not isinstance(data, str):
+        data = json.dumps(data, separators=(',', ':'))
+    return f"event: {event}\ndata: {data}\n\n"
+
+@bp.route('/llm_only/stream', methods=['POST'])
+def llm_only_search_stream():
+    """
+    LLM-only search with the answer streamed as server-sent events
+    
+    Sends a `results` event as soon as retrieval finishes, one `token` event per
+    answer chunk and a final `done` event with the complete answer.
+    """
+    data = request.json
+    participant_id = data.get('participant_id')
+    task_id = data.get('task_id')
+    nl_query = data.get('nl_query')
+    
+    if not nl_query:
+        return jsonify({'error': 'nl_query required'}), 400
+    
+    log_event(participant_id, 'llm_only', task_id, 'nl_query_sent', {
+        'query': nl_query
     })
     
-    return jsonify({
-        'answer': answer,
-        'results': retrieved_movies,
-        'count': len(retrieved_movies)
-    }), 200
+    set_request_context(participant_id, 'llm_only', task_id)
+    parsed = parse_nl_to_filters(nl_query)
+    retrieved_movies = retrieve_movies_for_rag(nl_query, run_structured_query, semantic_search_movies, parsed=parsed)
+    
+    log_event(participant_id, 'llm_only', task_id, 'retrieval_completed', {
+        'retrieved_count': len(retrieved_movies),
+        'retrieved_ids': [m['id'] for m in retrieved_movies]
+    })
+    
+    cached_answer, cache_match = lookup_cached_answer(nl_query, retrieved_movies)
+    
+    def generate():
+        yield sse_event('results', '{"results":' + serialize_movie_rows(retrieved_movies)
+                        + f',"count":{len(retrieved_movies)}}}')
+        
+        chunks = []
+        completed = False
+        try:
+            # A cached answer is sent as a single token event
+            source = [cached_answer] if cached_answer is not None else answer_with_rag_stream(
+                nl_query, retrieved_movies, parsed=parsed)
+            for text in source:
+                chunks.append(text)
+                yield sse_event('token', {'text': text})
+            completed = True
+            yield sse_event('done', {'answer': ''.join(chunks).strip(), 'count': len(retrieved_movies)})
+        finally:
+            # Also runs when the client disconnects mid-stream
+            payload = {
+                'answer': ''.join(chunks).strip(),
+                'result_count': len(retrieved_movies),
+                'streamed': True,
+                'stream_completed': completed
+            }
+            if cache_match:
+                payload['answer_cache'] = cache_match
+            log_event(participant_id, 'llm_only', task_id, 'answer_generated', payload)
+    
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # keep reverse proxies from buffering the stream
+    })
 
 def format_parsed_query(parsed):
     """Format parsed query into human-readable string"""
     parts = []
     
     filters = parsed.get('filters', {})
+    if filters.get('text'):
+        parts.append(f"Keywords: {filters['text']}")
     if filters.get('genres'):
         parts.append(f"Genres: {', '.join(filters['genres'])}")
     if filters.get('lead_gender'):
@@ -178,7 +379,9 @@ def format_parsed_query(parsed):
         parts.append(f"Revenue: ≥${filters['revenue_min']:,.0f}")
     
     sort = parsed.get('sort', {})
-    if sort.get('field'):
+    if sort.get('field') == 'relevance':
+        parts.append("Sort: relevance (best matches first)")
+    elif sort.get('field'):
         direction = "descending" if sort.get('direction') == 'desc' else "ascending"
         parts.append(f"Sort: {sort['field']} ({direction})")
     
@@ -0,0 +1,309 @@
+"""
+Semantic retrieval index over movie titles and overviews (no network required)
+Documents are embedded with hashed TF-IDF features reduced by a randomized SVD
+(latent semantic analysis). The document matrix is stored as a memory-mapped
+.npy file; queries are embedded the same way and ranked by cosine similarity
+with an argpartition top-k, optionally restricted to a set of candidate ids.
+
+Build it with `python preprocess_data.py` (or build_semantic_index()); the files
+go to SEMANTIC_INDEX_DIR (default backend/semantic_index). Every step works on
+row chunks, so memory stays bounded for large tables.
+
+Configuration (environment):
+    SEMANTIC_INDEX_DIR        index directory
+    SEMANTIC_DIMENSIONS       embedding dimensions (default 128)
+    SEMANTIC_HASH_BITS        log2 of the hashed vocabulary size (default 17)
+"""
+import json
+import os
+import re
+import threading
+import time
+import zlib
+from collections import Counter
+import numpy as np
+from database import db
+from models import Movie
+
+SEMANTIC_INDEX_DIR = os.getenv('SEMANTIC_INDEX_DIR',
+                               os.path.join(os.path.dirname(os.path.abspath(__file__)), 'semantic_index'))
+SEMANTIC_DIMENSIONS = int(os.getenv('SEMANTIC_DIMENSIONS', '128'))
+SEMANTIC_HASH_BITS = int(os.getenv('SEMANTIC_HASH_BITS', '17'))
+
+# Rows per chunk for the sparse products and the embedding pass
+CHUNK_ROWS = 4096
+OVERSAMPLING = 10
+POWER_ITERATIONS = 3
+# The SVD is fitted on at most this many evenly spaced rows; every row is still embedded
+SVD_SAMPLE_ROWS = 200000
+
+STOPWORDS = {
+    'a', 'an', 'the', 'and', 'or', 'but', 'of', 'in', 'on', 'at', 'to', 'for', 'from', 'by',
+    'with', 'about', 'as', 'into', 'after', 'before', 'over', 'under', 'is', 'are', 'was',
+    'were', 'be', 'been', 'being', 'has', 'have', 'had', 'his', 'her', 'their', 'its', 'he',
+    'she', 'they', 'it', 'this', 'that', 'these', 'those', 'who', 'whom', 'which', 'what',
+    'when', 'where', 'while', 'than', 'then', 'so', 'not', 'no', 'all', 'any', 'some', 'me',
+    'i', 'you', 'we', 'my', 'your', 'our', 'show', 'find', 'give', 'list', 'movie', 'movies',
+    'film', 'films', 'one', 'ones', 'like', 'want', 'looking', 'see',
+}
+
+def tokenize(text):
+    """Lower-cased word tokens without stopwords, numbers or single letters"""
+    return [token for token in re.findall(r'[a-z][a-z\']+', str(text or '').lower())
+            if token not in STOPWORDS]
+
+_bucket_memo = {}
+
+def token_bucket(token, hash_bits):
+    """Stable feature bucket of a token (crc32 is identical across processes)"""
+    key = (token, hash_bits)
+    bucket = _bucket_memo.get(key)
+    if bucket is None:
+        bucket = zlib.crc32(token.encode('utf-8')) & ((1 << hash_bits) - 1)
+        if len(_bucket_memo) < 500000:
+            _bucket_memo[key] = bucket
+    return bucket
+
+def _rows_dot(indptr, columns, values, matrix):
+    """(sparse rows) @ matrix for one CSR chunk whose indptr starts at 0"""
+    out = np.zeros((len(indptr) - 1, matrix.shape[1]), dtype=matrix.dtype)
+    nonempty = np.flatnonzero(np.diff(indptr))
+    if len(nonempty):
+        contributions = values[:, None] * matrix[columns]
+        out[nonempty] = np.add.reduceat(contributions, indptr[nonempty], axis=0)
+    return out
+
+def _rows_transpose_dot(indptr, columns, values, matrix, out):
+    """out += (sparse rows).T @ matrix for one CSR chunk whose indptr starts at 0"""
+    if not len(columns):
+        return
+    rows = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+    order = np.argsort(columns, kind='stable')
+    sorted_columns = columns[order]
+    unique_columns, starts = np.unique(sorted_columns, return_index=True)
+    contributions = values[order, None] * matrix[rows[order]]
+    out[unique_columns] += np.add.reduceat(contributions, starts, axis=0)
+
+class SparseRows:
+    """Row-normalized TF-IDF matrix in CSR form with chunked products"""
+
+    def __init__(self, indptr, columns, values, n_columns):
+        self.indptr = indptr
+        self.columns = columns
+        self.values = values
+        self.n_rows = len(indptr) - 1
+        self.n_columns = n_columns
+
+    def chunks(self):
+        """(row slice, local indptr, columns, values) per CHUNK_ROWS rows"""
+        for start in range(0, self.n_rows, CHUNK_ROWS):
+            stop = min(start + CHUNK_ROWS, self.n_rows)
+            lo, hi = self.indptr[start], self.indptr[stop]
+            yield (slice(start, stop), self.indptr[start:stop + 1] - lo,
+                   self.columns[lo:hi], self.values[lo:hi])
+
+    def sample(self, count):
+        """SparseRows with `count` evenly spaced rows of this matrix"""
+        positions = np.unique(np.linspace(0, self.n_rows - 1, count).astype(np.int64))
+        lengths = np.diff(self.indptr)[positions]
+        indptr = np.concatenate(([0], np.cumsum(lengths)))
+        gather = np.repeat(self.indptr[positions] - indptr[:-1], lengths) + np.arange(indptr[-1])
+        return SparseRows(indptr, self.columns[gather], self.values[gather], self.n_columns)
+
+    def gram_dot(self, matrix):
+        """(X.T @ X) @ matrix without forming X.T @ X"""
+        out = np.zeros((self.n_columns, matrix.shape[1]), dtype=np.float64)
+        for _, indptr, columns, values in self.chunks():
+            projected = _rows_dot(indptr, columns, values, matrix)
+            _rows_transpose_dot(indptr, columns, values, projected, out)
+        return out
+
+    def projected_gram(self, basis):
+        """basis.T @ X.T @ X @ basis"""
+        out = np.zeros((basis.shape[1], basis.shape[1]), dtype=np.float64)
+        for _, indptr, columns, values in self.chunks():
+            projected = _rows_dot(indptr, columns, values, basis)
+            out += projected.T @ projected
+        return out
+
+def randomized_components(matrix, dimensions, seed=0):
+    """
+    Top right singular vectors of a SparseRows matrix (columns x dimensions)
+
+    Randomized range finder with power iterations on X.T @ X, followed by an exact
+    eigendecomposition of the small projected matrix.
+    """
+    rng = np.random.default_rng(seed)
+    width = min(dimensions + OVERSAMPLING, matrix.n_columns)
+    basis, _ = np.linalg.qr(matrix.gram_dot(rng.standard_normal((matrix.n_columns, width))))
+    for _ in range(POWER_ITERATIONS):
+        basis, _ = np.linalg.qr(matrix.gram_dot(basis))
+    eigenvalues, eigenvectors = np.linalg.eigh(matrix.projected_gram(basis))
+    order = np.argsort(eigenvalues)[::-1][:dimensions]
+    return (basis @ eigenvectors[:, order]).astype(np.float32)
+
+def _document_text(title, overview):
+    return f"{title or ''} {overview or ''}"
+
+def build_semantic_index(index_dir=None, dimensions=None, hash_bits=None):
+    """Embed every movie and write the index files (requires an app context)"""
+    index_dir = index_dir or SEMANTIC_INDEX_DIR
+    dimensions = dimensions or SEMANTIC_DIMENSIONS
+    hash_bits = hash_bits or SEMANTIC_HASH_BITS
+    start_time = time.perf_counter()
+
+    # Hashed term counts in CSR form
+    ids = []
+    indptr = [0]
+    buckets = []
+    counts = []
+    rows = db.session.query(Movie.id, Movie.title, Movie.overview).order_by(Movie.id).yield_per(10000)
+    for movie_id, title, overview in rows:
+        term_counts = Counter(token_bucket(token, hash_bits) for token in tokenize(_document_text(title, overview)))
+        ids.append(movie_id)
+        buckets.extend(term_counts.keys())
+        counts.extend(term_counts.values())
+        indptr.append(len(buckets))
+    if not ids:
+        print("No movies to index; semantic index not built")
+        return False
+
+    ids = np.asarray(ids, dtype=np.int64)
+    indptr = np.asarray(indptr, dtype=np.int64)
+    buckets = np.asarray(buckets, dtype=np.int64)
+    counts = np.asarray(counts, dtype=np.float32)
+
+    # Compact the used buckets into dense feature columns and weight by TF-IDF
+    document_frequency = np.bincount(buckets, minlength=1 << hash_bits)
+    used_buckets = np.flatnonzero(document_frequency)
+    column_of = np.full(1 << hash_bits, -1, dtype=np.int64)
+    column_of[used_buckets] = np.arange(len(used_buckets))
+    columns = column_of[buckets]
+    idf = (np.log((1 + len(ids)) / (1 + document_frequency[used_buckets])) + 1).astype(np.float32)
+    values = (1 + np.log(counts)) * idf[columns]
+
+    nonempty = np.flatnonzero(np.diff(indptr))
+    norms = np.ones(len(ids), dtype=np.float32)
+    if len(nonempty):
+        norms[nonempty] = np.sqrt(np.add.reduceat(values ** 2, indptr[nonempty]))
+    values /= np.repeat(norms, np.diff(indptr))
+
+    matrix = SparseRows(indptr, columns, values, len(used_buckets))
+    dimensions = max(1, min(dimensions, len(used_buckets), len(ids)))
+    sample = matrix.sample(SVD_SAMPLE_ROWS) if matrix.n_rows > SVD_SAMPLE_ROWS else matrix
+    components = randomized_components(sample, dimensions)
+
+    # Document embeddings, unit length, written chunk by chunk into the memmap
+    os.makedirs(index_dir, exist_ok=True)
+    embeddings_path = os.path.join(index_dir, 'embeddings.npy')
+    embeddings = np.lib.format.open_memmap(os.path.join(index_dir, 'embeddings.tmp.npy'), mode='w+', dtype=np.float32,
+                                           shape=(len(ids), dimensions))
+    for row_slice, chunk_indptr, chunk_columns, chunk_values in matrix.chunks():
+        chunk = _rows_dot(chunk_indptr, chunk_columns, chunk_values, components)
+        lengths = np.linalg.norm(chunk, axis=1, keepdims=True)
+        embeddings[row_slice] = chunk / np.where(lengths > 0, lengths, 1)
+    embeddings.flush()
+    del embeddings
+
+    np.save(os.path.join(index_dir, 'ids.tmp.npy'), ids)
+    np.savez(os.path.join(index_dir, 'vocabulary.tmp.npz'),
+             buckets=used_buckets, idf=idf, components=components)
+    with open(os.path.join(index_dir, 'meta.json.tmp'), 'w') as f:
+        json.dump({'count': len(ids), 'dimensions': dimensions, 'hash_bits': hash_bits,
+                   'features': len(used_buckets), 'built_at': time.time()}, f)
+
+    os.replace(os.path.join(index_dir, 'embeddings.tmp.npy'), embeddings_path)
+    os.replace(os.path.join(index_dir, 'ids.tmp.npy'), os.path.join(index_dir, 'ids.npy'))
+    os.replace(os.path.join(index_dir, 'vocabulary.tmp.npz'), os.path.join(index_dir, 'vocabulary.npz'))
+    os.replace(os.path.join(index_dir, 'meta.json.tmp'), os.path.join(index_dir, 'meta.json'))
+    reset_semantic_index()
+
+    print(f"Semantic index built: {len(ids)} movies, {len(used_buckets)} features, "
+          f"{dimensions} dimensions in {time.perf_counter() - start_time:.1f}s")
+    return True
+
+class SemanticIndex:
+    """Read-only view of a built index; the embedding matrix stays memory-mapped"""
+
+    def __init__(self, index_dir):
+        with open(os.path.join(index_dir, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.hash_bits = self.meta['hash_bits']
+        self.ids = np.load(os.path.join(index_dir, 'ids.npy'))
+        self.embeddings = np.load(os.path.join(index_dir, 'embeddings.npy'), mmap_mode='r')
+        vocabulary = np.load(os.path.join(index_dir, 'vocabulary.npz'))
+        self.buckets = vocabulary['buckets']
+        self.idf = vocabulary['idf']
+        self.components = vocabulary['components']
+
+    def embed(self, query_text):
+        """Unit-length query embedding, or None when no query word is in the vocabulary"""
+        term_counts = Counter(token_bucket(token, self.hash_bits) for token in tokenize(query_text))
+        if not term_counts:
+            return None
+        buckets = np.fromiter(term_counts.keys(), dtype=np.int64)
+        counts = np.fromiter(term_counts.values(), dtype=np.float32)
+        positions = np.searchsorted(self.buckets, buckets)
+        known = (positions < len(self.buckets)) & (self.buckets[np.minimum(positions, len(self.buckets) - 1)] == buckets)
+        if not known.any():
+            return None
+        positions = positions[known]
+        weights = (1 + np.log(counts[known])) * self.idf[positions]
+        vector = weights @ self.components[positions]
+        length = np.linalg.norm(vector)
+        return vector / length if length > 0 else None
+
+    def search(self, query_text, k=50, allowed_ids=None):
+        """
+        Top-k (movie id, similarity) pairs, best first
+
+        allowed_ids restricts the ranking to those movies (a structured pre-filter).
+        """
+        vector = self.embed(query_text)
+        if vector is None:
+            return []
+
+        if allowed_ids is None:
+            positions = None
+            scores = np.asarray(self.embeddings @ vector)
+        else:
+            allowed = np.asarray(allowed_ids, dtype=np.int64)
+            if len(allowed) > 1 and (allowed[1:] < allowed[:-1]).any():
+                allowed = np.sort(allowed)
+            positions = np.searchsorted(self.ids, allowed)
+            in_range = positions < len(self.ids)
+            positions = positions[in_range][self.ids[positions[in_range]] == allowed[in_range]]
+            if not len(positions):
+                return []
+            if len(positions) * 16 > len(self.ids):
+                # Large candidate sets: one sequential scan beats gathering rows
+                scores = np.asarray(self.embeddings @ vector)[positions]
+            else:
+                scores = np.asarray(self.embeddings[positions] @ vector)
+
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.lexsort((top, -scores[top]))]
+        rows = top if positions is None else positions[top]
+        return [(int(self.ids[row]), float(scores[position])) for row, position in zip(rows, top)]
+
+_semantic_index = None
+_semantic_index_lock = threading.Lock()
+
+def get_semantic_index():
+    """The process-wide semantic index, or None if it has not been built"""
+    global _semantic_index
+    if _semantic_index is None:
+        with _semantic_index_lock:
+            if _semantic_index is None and os.path.exists(os.path.join(SEMANTIC_INDEX_DIR, 'meta.json')):
+                try:
+                    _semantic_index = SemanticIndex(SEMANTIC_INDEX_DIR)
+                except Exception as e:
+                    print(f"Failed to load semantic index: {e}")
+    return _semantic_index
+
+def reset_semantic_index():
+    """Forget the loaded index so the files are re-read on next use"""
+    global _semantic_index
+    with _semantic_index_lock:
+        _semantic_index = None
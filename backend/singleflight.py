@@ -0,0 +1,81 @@
+"""
+Single-flight coalescing of identical in-flight calls
+While a call for a key is running, further callers with the same key wait for
+it and share its result (or its exception) instead of starting their own. Used
+to make simultaneous identical LLM requests cost one completion.
+
+Configuration (environment):
+    LLM_COALESCING_ENABLED    1/0 (default 1)
+"""
+import os
+import threading
+
+LLM_COALESCING_ENABLED = os.getenv('LLM_COALESCING_ENABLED', '1') == '1'
+
+class _Call:
+    """One in-flight call and the callers waiting for it"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """Runs at most one call per key at a time; enabled=False runs every call"""
+
+    def __init__(self, enabled=None):
+        self.enabled = LLM_COALESCING_ENABLED if enabled is None else enabled
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.coalesced = 0
+
+    def do(self, key, function):
+        """
+        Run function() unless a call with the same key is already in flight
+
+        Returns (result, shared); shared is True when the result came from another
+        caller's call. Exceptions of the shared call are raised to every waiter.
+        """
+        if not self.enabled:
+            with self._lock:
+                self.calls += 1
+            return function(), False
+
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.calls += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = function()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    def stats(self):
+        """Counters for monitoring: upstream calls made and calls saved by coalescing"""
+        with self._lock:
+            requested = self.calls + self.coalesced
+            return {
+                'enabled': self.enabled,
+                'in_flight': len(self._calls),
+                'calls': self.calls,
+                'coalesced': self.coalesced,
+                'saved_rate': self.coalesced / requested if requested else 0.0
+            }
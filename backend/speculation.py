@@ -0,0 +1,121 @@
+"""
+Speculative execution of LLM-assisted parses
+/llm_assist/parse starts running the parsed query in the background and hands
+out a preview token. When /llm_assist/execute confirms the same query (compared
+by canonical_query_key) with that token, the stashed rows are used instead of
+running the query again; a modified query falls back to normal execution. Only
+the first page the client will ask for is speculated (page_size + 1 rows, or the
+default 1000 without pagination).
+
+Configuration (environment):
+    SPECULATIVE_EXECUTION       1/0 (default 1)
+    SPECULATION_TTL_SECONDS     how long a preview token stays valid (default 600)
+    SPECULATION_MAX_ENTRIES     stashed results kept, least recently issued evicted (default 256)
+    SPECULATION_WORKERS         background threads (default 2)
+    SPECULATION_WAIT_SECONDS    how long execute waits for a query still running before
+                                running it itself (default 2)
+"""
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from flask import current_app
+from caching import LRUCache
+from data_access import run_structured_query, canonical_query_key
+
+SPECULATIVE_EXECUTION = os.getenv('SPECULATIVE_EXECUTION', '1') == '1'
+SPECULATION_TTL_SECONDS = int(os.getenv('SPECULATION_TTL_SECONDS', '600'))
+SPECULATION_WAIT_SECONDS = float(os.getenv('SPECULATION_WAIT_SECONDS', '2'))
+
+# Default limit of run_structured_query, speculated when the client does not paginate
+QUERY_LIMIT = 1000
+
+# token -> (issued_at, canonical query key, future of the result rows)
+_stash = LRUCache(int(os.getenv('SPECULATION_MAX_ENTRIES', '256')))
+_executor = None
+_executor_lock = threading.Lock()
+
+_stats_lock = threading.Lock()
+_stats = {'started': 0, 'hits': 0, 'modified': 0, 'expired': 0, 'failed': 0, 'timeouts': 0}
+
+def _count(name, amount=1):
+    with _stats_lock:
+        _stats[name] += amount
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=int(os.getenv('SPECULATION_WORKERS', '2')),
+                                               thread_name_prefix='speculation')
+    return _executor
+
+def first_page_limit(page_size=None):
+    """Rows to fetch for a first page: one more than page_size tells whether more follow"""
+    return page_size + 1 if page_size else QUERY_LIMIT
+
+def _run(app, filters, sort, limit):
+    with app.app_context():
+        return run_structured_query(filters=filters, sort=sort, limit=limit)
+
+def start_speculation(parsed_query, limit=QUERY_LIMIT):
+    """
+    Run a parsed query in the background (needs an app context)
+
+    limit is the row count the confirming execute will need (see first_page_limit).
+    Returns the preview token for claim_speculation, or None when disabled.
+    """
+    if not SPECULATIVE_EXECUTION or not _stash.enabled:
+        return None
+    parsed_query = parsed_query or {}
+    filters = parsed_query.get('filters') or {}
+    sort = parsed_query.get('sort')
+    token = uuid.uuid4().hex
+    future = _get_executor().submit(_run, current_app._get_current_object(), filters, sort, limit)
+    _stash.set(token, (time.time(), canonical_query_key(filters, sort, limit), future))
+    _count('started')
+    return token
+
+def claim_speculation(token, filters, sort, limit=QUERY_LIMIT, timeout=None):
+    """
+    Take the stashed result for a confirmed query
+
+    Returns (rows, status): rows is the result list (fetched with limit) or None,
+    status is 'hit', 'modified' (query or limit changed since the preview),
+    'expired' (unknown or stale token), 'failed' or 'timeout'. A query still
+    running is waited for up to timeout seconds (default SPECULATION_WAIT_SECONDS);
+    on 'timeout' the caller runs the query itself.
+    """
+    timeout = SPECULATION_WAIT_SECONDS if timeout is None else timeout
+    entry = _stash.pop(token) if token else None
+    if entry is None or time.time() - entry[0] > SPECULATION_TTL_SECONDS:
+        _count('expired')
+        return None, 'expired'
+    _, key, future = entry
+    if key != canonical_query_key(filters, sort, limit):
+        future.cancel()
+        _count('modified')
+        return None, 'modified'
+    try:
+        rows = future.result(timeout=timeout)
+    except FutureTimeoutError:
+        future.cancel()
+        _count('timeouts')
+        return None, 'timeout'
+    except Exception as e:
+        print(f"Speculative query failed: {e}")
+        _count('failed')
+        return None, 'failed'
+    _count('hits')
+    return rows, 'hit'
+
+def get_speculation_stats():
+    """Speculation counters for the monitoring endpoint"""
+    with _stats_lock:
+        stats = dict(_stats)
+    claimed = stats['hits'] + stats['modified'] + stats['expired'] + stats['failed'] + stats['timeouts']
+    stats['pending'] = len(_stash)
+    stats['hit_rate'] = stats['hits'] / claimed if claimed else 0.0
+    return stats
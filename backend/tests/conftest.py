@@ -0,0 +1,73 @@
+"""
+Shared fixtures: the Flask app on a scratch SQLite database with a small synthetic catalog
+The environment is set before the backend is imported, because modules read
+their configuration at import time. No test reaches a real LLM.
+"""
+import os
+import random
+import sys
+import tempfile
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+_scratch = tempfile.mkdtemp(prefix='hci-tests-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_scratch, 'test.db')}"
+os.environ['SEMANTIC_INDEX_DIR'] = os.path.join(_scratch, 'semantic_index')
+os.environ['OPENAI_API_KEY'] = ''  # set (so .env is not loaded) but empty: LLM calls fail fast
+os.environ.setdefault('LOG_SINK_MODE', 'sync')
+
+GENRES = ['Drama', 'Thriller', 'Comedy', 'Action', 'Science Fiction', 'Horror']
+TITLE_WORDS = ['Dark', 'Last', 'Silent', 'Red', 'Lost']
+TITLE_NOUNS = ['River', 'Planet', 'Night', 'Garden']
+OVERVIEW_WORDS = ['space', 'robot', 'love', 'war', 'city', 'family', 'secret', 'ocean', 'detective', 'storm']
+
+def synthetic_movies(count=240, seed=7):
+    """Movie column values with NULLs, repeated values (ties) and duplicate titles in every sortable field"""
+    rng = random.Random(seed)
+    maybe = lambda value, null_rate=0.15: None if rng.random() < null_rate else value
+    movies = []
+    for number in range(1, count + 1):
+        movies.append({
+            'id': number,
+            'title': f"{rng.choice(TITLE_WORDS)} {rng.choice(TITLE_NOUNS)}",
+            'release_year': maybe(rng.randint(1995, 2005)),
+            'runtime': maybe(rng.choice([85, 90, 90, 95, 120, 150])),
+            'lead_gender': maybe(rng.choice(['female', 'male', 'mixed', 'unknown']), 0.1),
+            'budget': maybe(float(rng.choice([1e6, 5e6, 5e6, 2e7, 1e8]))),
+            'revenue': maybe(float(rng.randint(0, 20) * 1e7), 0.3),
+            'language': 'en',
+            'overview': ' '.join(rng.choice(OVERVIEW_WORDS) for _ in range(rng.randint(3, 12))),
+            'tmdb_id': 10000 + number,
+            'genres': rng.sample(GENRES, rng.randint(0, 3)),
+        })
+    return movies
+
+@pytest.fixture(scope='session')
+def app():
+    from app import app as flask_app
+    from database import db
+    from models import Movie
+    from full_text import build_full_text_index
+
+    with flask_app.app_context():
+        db.create_all()
+        for values in synthetic_movies():
+            values = dict(values)
+            genres = values.pop('genres')
+            movie = Movie(**values)
+            movie.set_genres(genres)
+            db.session.add(movie)
+        db.session.commit()
+        build_full_text_index()
+    return flask_app
+
+@pytest.fixture
+def app_context(app):
+    with app.app_context():
+        yield app
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
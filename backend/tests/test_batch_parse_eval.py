@@ -0,0 +1,44 @@
+"""
+Batch parse evaluation: one cache lookup per query, and sources that say who answered
+"""
+import batch_parse_eval
+from batch_parse_eval import batch_parse
+from llm_integration import PROMPT_VERSION
+from parse_cache import clear_parse_cache, get_parse_cache_stats, store_parse
+
+class CountingLimiter:
+    def __init__(self):
+        self.acquired = 0
+
+    def acquire(self):
+        self.acquired += 1
+
+def fake_llm(calls):
+    def parse_with_llm(nl_query, model=None, store=True):
+        calls.append(nl_query)
+        if 'broken' in nl_query:
+            return {'filters': {}, 'sort': {}}, 'fallback'
+        parsed = {'filters': {'text': nl_query}, 'sort': {}}
+        if store:
+            store_parse(nl_query, model, PROMPT_VERSION, parsed)
+        return parsed, 'llm'
+    return parse_with_llm
+
+def test_sources_and_single_cache_lookup(app, monkeypatch):
+    calls = []
+    monkeypatch.setattr(batch_parse_eval, 'parse_with_llm', fake_llm(calls))
+    clear_parse_cache()
+    queries = ['dramas after 2015', 'movies about lighthouses', 'a broken query']
+
+    misses = get_parse_cache_stats()['misses']
+    first = batch_parse(queries, workers=1, use_cache=True, use_rules=True)
+    assert [parse['source'] for parse in first.values()] == ['rules', 'llm', 'fallback']
+    assert get_parse_cache_stats()['misses'] - misses == 2  # one lookup per LLM-bound query
+    assert calls == ['movies about lighthouses', 'a broken query']
+
+    limiter = CountingLimiter()
+    second = {key: batch_parse_eval.parse_one(parse['query'], limiter, use_cache=True, use_rules=True)
+              for key, parse in first.items()}
+    assert [parse['source'] for parse in second.values()] == ['rules', 'cache', 'fallback']
+    assert limiter.acquired == 1  # only the query that still needs the LLM waits for the rate limit
+    assert calls[-1] == 'a broken query' and len(calls) == 3
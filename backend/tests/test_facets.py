@@ -0,0 +1,49 @@
+"""
+Facet counts from the movie index's bitsets
+"""
+import threading
+import pytest
+from movie_index import MovieIndex, get_movie_index
+from data_access import build_movie_query
+from models import Movie
+
+def test_facets_on_empty_table():
+    counts = MovieIndex([]).facet_counts({'genres': ['Drama'], 'runtime_max': 100})
+    assert counts['total'] == 0
+    assert counts['genres'] == {}
+    assert counts['lead_gender'] == {}
+    assert all(bucket['count'] == 0 for buckets in counts['histograms'].values() for bucket in buckets)
+
+@pytest.mark.parametrize('filters', [{}, {'genres': ['Drama', 'Comedy'], 'lead_gender': 'female'},
+                                     {'runtime_max': 95, 'release_year_min': 2000}])
+def test_facet_counts_match_sql(app_context, filters):
+    counts = get_movie_index().facet_counts(filters)
+    assert counts['total'] == build_movie_query(filters=filters).count()
+    # Each genre is counted with every other filter applied, but not the genre filter itself
+    others = {key: value for key, value in filters.items() if key != 'genres'}
+    for genre, count in counts['genres'].items():
+        assert count == build_movie_query(filters=dict(others, genres=[genre])).count()
+    others = {key: value for key, value in filters.items() if key != 'lead_gender'}
+    for gender, count in counts['lead_gender'].items():
+        assert count == build_movie_query(filters=dict(others, lead_gender=gender)).count()
+
+def test_concurrent_first_requests_build_one_index(app_context):
+    rows = [movie.to_dict() for movie in Movie.query.all()]
+    index = MovieIndex(rows)
+    bitsets = index.facet_bitsets
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(index.facet_counts({'genres': ['Drama']})))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert index.facet_bitsets is bitsets
+    assert all(result == results[0] for result in results)
+
+def test_facets_endpoint_empty_table(app, client, monkeypatch):
+    import movie_index
+    monkeypatch.setattr(movie_index, '_index', MovieIndex([]))
+    response = client.post('/api/search/facets', json={'filters': {'genres': ['Drama']}})
+    assert response.status_code == 200
+    assert response.get_json()['total'] == 0
@@ -0,0 +1,62 @@
+"""
+Sampling parameters are only dropped for a model when it clearly rejected them
+"""
+from types import SimpleNamespace
+import pytest
+import llm_client
+from llm_client import chat_completion, rejected_sampling_param
+
+class APIError(Exception):
+    """Stand-in for the SDK's status errors: status_code plus the parsed error body"""
+    def __init__(self, message, status_code=None, body=None):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+        self.body = body
+
+@pytest.mark.parametrize('error, rejected', [
+    (APIError('Error code: 400', 400, {'message': "Unsupported value: 'temperature' does not support 0.1 with this model.",
+                                       'param': 'temperature'}), True),
+    (APIError('Error code: 400', 400, {'message': "Unsupported parameter: 'top_p' is not supported with this model."}), True),
+    (APIError("Error code: 400 - 'top_p' is not supported", 400), True),
+    (APIError('Error code: 400', 400, {'message': 'Unsupported value: messages[0].role', 'param': 'messages'}), False),
+    (APIError("Error code: 422 - 'temperature' is unsupported", 422), False),
+    (APIError("Error code: 500 - temperature", 500), False),
+    (ConnectionError('unsupported protocol while sending temperature'), False),
+])
+def test_rejected_sampling_param(error, rejected):
+    assert rejected_sampling_param(error) is rejected
+
+def fake_client(errors):
+    """A client whose create() raises the given errors in turn, then succeeds; records the requests"""
+    requests = []
+    def create(**request):
+        requests.append(request)
+        if errors:
+            raise errors.pop(0)
+        return 'completion'
+    return SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create))), requests
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(llm_client, '_unsupported_params', {})
+    monkeypatch.setattr(llm_client, 'backoff_delay', lambda attempt, error=None: 0)
+    def install(*errors):
+        client, requests = fake_client(list(errors))
+        monkeypatch.setattr(llm_client, 'get_client', lambda: client)
+        return requests
+    return install
+
+def test_rejected_temperature_is_dropped_and_remembered(client):
+    requests = client(APIError('Error code: 400', 400, {'message': 'bad value', 'param': 'temperature'}))
+    assert chat_completion([], model='m1', temperature=0.1) == 'completion'
+    assert chat_completion([], model='m1', temperature=0.1) == 'completion'
+    assert ['temperature' in request for request in requests] == [True, False, False]
+
+def test_other_errors_keep_sampling_params(client):
+    requests = client(APIError('unsupported', 422), APIError('Error code: 503', 503))
+    with pytest.raises(APIError):
+        chat_completion([], model='m2', temperature=0.1)
+    assert chat_completion([], model='m2', temperature=0.1) == 'completion'  # the 503 is retried
+    assert all('temperature' in request for request in requests)
+    assert 'm2' not in llm_client.get_llm_client_stats()['unsupported_params']
@@ -0,0 +1,40 @@
+"""
+LLM-only search: the token budget limits the prompt, not the retrieved rows, and a
+non-streaming retry of a streamed search does not log the query a second time
+"""
+from data_access import run_structured_query
+from llm_integration import build_rag_messages, retrieve_movies_for_rag
+from models import LogEntry
+
+def search(client, participant_id, **options):
+    response = client.post('/api/search/llm_only', json=dict(
+        participant_id=participant_id, task_id='T01', nl_query='dramas after 2015', **options))
+    assert response.status_code == 200
+    return response.get_json()
+
+def sent_queries(app, participant_id):
+    with app.app_context():
+        return LogEntry.query.filter_by(participant_id=participant_id, event_type='nl_query_sent').count()
+
+def test_retry_is_not_logged_again(app, client):
+    search(client, 'LLMONLY01')
+    search(client, 'LLMONLY01', retry=True)
+    assert sent_queries(app, 'LLMONLY01') == 1
+
+def test_new_query_is_logged(app, client):
+    search(client, 'LLMONLY02')
+    search(client, 'LLMONLY02')
+    assert sent_queries(app, 'LLMONLY02') == 2
+
+def test_budget_limits_the_prompt_not_the_retrieval(app_context):
+    parsed = {'filters': {}, 'sort': {'field': 'id', 'direction': 'asc'}}
+    movies = retrieve_movies_for_rag('every movie by id', run_structured_query, parsed=parsed)
+    assert len(movies) == 100
+    prompt = build_rag_messages('every movie by id', movies, parsed)[1]['content']
+    assert 'of 100 retrieved movies' in prompt
+    assert f"\n{movies[0]['id']} | " in prompt and f"\n{movies[-1]['id']} | " not in prompt
+
+def test_results_are_not_cut_to_the_budget(client):
+    body = client.post('/api/search/llm_only', json={
+        'participant_id': 'LLMONLY03', 'task_id': 'T01', 'nl_query': 'movies sorted by budget'}).get_json()
+    assert len(body['results']) == 100
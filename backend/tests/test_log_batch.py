@@ -0,0 +1,74 @@
+"""
+/api/log/batch: entries are timed by the client clock, corrected for its skew
+"""
+import time
+from datetime import datetime, timedelta
+from log_sink import log_event
+from models import LogEntry
+
+HOUR_MS = 3600 * 1000
+
+def post(client, participant_id, events, sent_ts=None, session_id='session-1'):
+    body = {'participant_id': participant_id, 'session_id': session_id, 'task_id': 'T01',
+            'interface_type': 'faceted', 'events': events}
+    if sent_ts is not None:
+        body['sent_ts'] = sent_ts
+    response = client.post('/api/log/batch', json=body)
+    assert response.status_code == 200
+    return response.get_json()
+
+def timestamps(app, participant_id):
+    with app.app_context():
+        entries = LogEntry.query.filter_by(participant_id=participant_id).order_by(LogEntry.timestamp, LogEntry.id).all()
+        return [(entry.event_type, entry.timestamp) for entry in entries]
+
+def test_skewed_client_clock_is_corrected(app, client):
+    client_now = time.time() * 1000 - HOUR_MS  # the participant's clock is an hour behind
+    before = datetime.utcnow()
+    post(client, 'BATCH01', [
+        {'event_type': 'filter_change', 'client_ts': client_now - 1500, 'seq': 1},
+        {'event_type': 'hover', 'client_ts': client_now - 500, 'seq': 2},
+    ], sent_ts=client_now)
+    after = datetime.utcnow()
+    with app.app_context():
+        log_event('BATCH01', 'faceted', 'T01', 'query_executed', {})
+
+    logged = timestamps(app, 'BATCH01')
+    assert [event_type for event_type, _ in logged] == ['filter_change', 'hover', 'query_executed']
+    (_, first), (_, second), _ = logged
+    assert before - timedelta(milliseconds=1600) <= first <= after - timedelta(milliseconds=1400)
+    assert abs(second - first - timedelta(milliseconds=1000)) < timedelta(milliseconds=1)
+
+def test_timestamps_are_capped_at_arrival(app, client):
+    client_now = time.time() * 1000
+    post(client, 'BATCH02', [
+        {'event_type': 'hover', 'client_ts': client_now + HOUR_MS, 'seq': 1},
+    ], sent_ts=client_now)
+    assert timestamps(app, 'BATCH02')[0][1] <= datetime.utcnow()
+
+def test_without_sent_ts_the_last_event_is_the_arrival(app, client):
+    client_now = time.time() * 1000 + HOUR_MS  # clock ahead, older client without sent_ts
+    before = datetime.utcnow()
+    post(client, 'BATCH03', [
+        {'event_type': 'scroll', 'client_ts': client_now - 2000, 'seq': 1},
+        {'event_type': 'hover', 'client_ts': client_now, 'seq': 2},
+    ])
+    after = datetime.utcnow()
+    (_, first), (_, last) = timestamps(app, 'BATCH03')
+    assert before <= last <= after
+    assert abs(last - first - timedelta(milliseconds=2000)) < timedelta(milliseconds=1)
+
+def test_missing_or_invalid_client_ts_gets_the_arrival_time(app, client):
+    before = datetime.utcnow()
+    post(client, 'BATCH04', [
+        {'event_type': 'hover', 'seq': 1},
+        {'event_type': 'scroll', 'client_ts': 'yesterday', 'seq': 2},
+    ], sent_ts=time.time() * 1000)
+    after = datetime.utcnow()
+    assert all(before <= timestamp <= after for _, timestamp in timestamps(app, 'BATCH04'))
+
+def test_resent_batch_is_not_logged_twice(app, client):
+    events = [{'event_type': 'hover', 'client_ts': time.time() * 1000, 'seq': number} for number in (1, 2)]
+    assert post(client, 'BATCH05', events)['logged'] == 2
+    assert post(client, 'BATCH05', events)['logged'] == 0
+    assert len(timestamps(app, 'BATCH05')) == 2
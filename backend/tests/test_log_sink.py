@@ -0,0 +1,140 @@
+"""
+Buffered log sink: batches by size and interval, falls back to single inserts, retries then drops,
+flushes on shutdown
+"""
+import logging
+import time
+from collections import deque
+import pytest
+import log_sink
+from log_sink import log_event, flush, shutdown, get_log_sink_stats, MAX_ATTEMPTS
+from models import LogEntry
+
+@pytest.fixture
+def buffered(app_context, monkeypatch):
+    """A fresh buffered sink (no writer thread yet) with a long flush interval"""
+    monkeypatch.setattr(log_sink, 'LOG_SINK_MODE', 'buffered')
+    monkeypatch.setattr(log_sink, 'LOG_SINK_BATCH_SIZE', 5)
+    monkeypatch.setattr(log_sink, 'LOG_SINK_FLUSH_SECONDS', 30)
+    monkeypatch.setattr(log_sink, '_queue', deque())
+    monkeypatch.setattr(log_sink, '_stats', dict.fromkeys(log_sink._stats, 0))
+    monkeypatch.setattr(log_sink, '_app', None)
+    monkeypatch.setattr(log_sink, '_thread', None)
+    monkeypatch.setattr(log_sink, '_stopping', False)
+    yield
+    shutdown()
+
+def stored(participant_id):
+    return LogEntry.query.filter_by(participant_id=participant_id).count()
+
+def wait_for(condition, seconds=5):
+    deadline = time.monotonic() + seconds
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+def log(participant_id, count, event_type='hover'):
+    for number in range(count):
+        log_event(participant_id, 'faceted', 'T01', event_type, {'n': number})
+
+def test_full_batch_is_written_at_once(buffered):
+    log('SINK01', 4)
+    time.sleep(0.2)
+    assert stored('SINK01') == 0
+    assert get_log_sink_stats()['pending'] == 4
+    log('SINK01', 1)
+    assert wait_for(lambda: get_log_sink_stats()['written'] == 5)
+    assert get_log_sink_stats()['batches'] == 1
+    assert stored('SINK01') == 5
+
+def test_partial_batch_waits_for_the_flush_interval(buffered, monkeypatch):
+    monkeypatch.setattr(log_sink, 'LOG_SINK_FLUSH_SECONDS', 0.1)
+    log('SINK02', 2)
+    assert wait_for(lambda: get_log_sink_stats()['written'] == 2)
+    assert stored('SINK02') == 2
+
+@pytest.fixture
+def failing_inserts(monkeypatch):
+    """Make the next `failures` bulk inserts raise"""
+    remaining = {'failures': 0}
+    real_insert = log_sink.insert
+    def insert(table):
+        if remaining['failures'] > 0:
+            remaining['failures'] -= 1
+            raise RuntimeError('database unavailable')
+        return real_insert(table)
+    monkeypatch.setattr(log_sink, 'insert', insert)
+    return remaining
+
+def test_failed_batch_is_retried(buffered, failing_inserts, caplog):
+    failing_inserts['failures'] = 4  # the bulk insert and each of the three single inserts
+    log('SINK03', 3, 'filter_change')
+    assert flush() is False
+    assert flush() is True
+    stats = get_log_sink_stats()
+    assert (stats['failures'], stats['dropped'], stats['written']) == (1, 0, 3)
+    assert stored('SINK03') == 3
+    errors = [record.getMessage() for record in caplog.records if record.levelno == logging.ERROR]
+    assert errors == ['Failed to write 3 log entries (filter_change x3): database unavailable',
+                      'Failed to write 3 of 3 log entries one at a time (filter_change x3): database unavailable']
+
+def test_failed_bulk_insert_is_written_one_at_a_time(buffered, failing_inserts):
+    failing_inserts['failures'] = 1
+    log('SINK07', 3)
+    assert flush() is True
+    stats = get_log_sink_stats()
+    assert (stats['failures'], stats['dropped'], stats['written'], stats['batches']) == (1, 0, 3, 3)
+    assert stored('SINK07') == 3
+
+def test_only_the_bad_event_is_dropped(buffered, caplog):
+    log('SINK08', 2)
+    log_event('SINK08', 'faceted', 'T01', None, {'n': 2})  # event_type is NOT NULL
+    log('SINK08', 1)
+    for _ in range(MAX_ATTEMPTS):
+        flush()
+    assert flush() is True
+    stats = get_log_sink_stats()
+    assert (stats['dropped'], stats['written'], stats['pending']) == (1, 3, 0)
+    assert stored('SINK08') == 3
+    errors = [record.getMessage() for record in caplog.records if record.levelno == logging.ERROR]
+    assert errors[-1] == f'Dropped 1 log entries after {MAX_ATTEMPTS} attempts (None x1)'
+
+def test_events_are_dropped_after_max_attempts(buffered, failing_inserts, caplog):
+    failing_inserts['failures'] = 4 * MAX_ATTEMPTS  # each attempt: one bulk and three single inserts
+    log('SINK04', 2, 'scroll')
+    log('SINK04', 1, 'hover')
+    for _ in range(MAX_ATTEMPTS):
+        assert flush() is False
+    assert flush() is True  # nothing left
+    stats = get_log_sink_stats()
+    assert (stats['failures'], stats['dropped'], stats['written'], stats['pending']) == (MAX_ATTEMPTS, 3, 0, 0)
+    assert stored('SINK04') == 0
+    errors = [record.getMessage() for record in caplog.records if record.levelno == logging.ERROR]
+    assert errors[-1] == f'Dropped 3 log entries after {MAX_ATTEMPTS} attempts (scroll x2, hover x1)'
+
+def test_shutdown_flushes_buffered_events(buffered, failing_inserts):
+    failing_inserts['failures'] = 1  # shutdown retries a failed batch rather than abandoning it
+    log('SINK05', 3)
+    assert stored('SINK05') == 0
+    shutdown()
+    assert stored('SINK05') == 3
+    assert get_log_sink_stats()['pending'] == 0
+
+def test_shutdown_in_sync_mode(app_context, monkeypatch):
+    monkeypatch.setattr(log_sink, 'LOG_SINK_MODE', 'sync')
+    monkeypatch.setattr(log_sink, '_app', None)
+    monkeypatch.setattr(log_sink, '_thread', None)
+    monkeypatch.setattr(log_sink, '_stopping', False)
+    entry_id = log_event('SINK06', 'faceted', 'T01', 'hover', {'n': 0})
+    assert entry_id is not None
+    assert stored('SINK06') == 1  # written before log_event returned
+    shutdown()
+    assert stored('SINK06') == 1
+    assert get_log_sink_stats()['pending'] == 0
+
+def test_log_endpoint_answers_by_mode(buffered, client, monkeypatch):
+    event = {'participant_id': 'SINK09', 'interface_type': 'faceted', 'task_id': 'T01', 'event_type': 'hover'}
+    assert client.post('/api/log', json=event).get_json() == {'status': 'queued'}
+    monkeypatch.setattr(log_sink, 'LOG_SINK_MODE', 'sync')
+    body = client.post('/api/log', json=event).get_json()
+    assert body['status'] == 'logged' and LogEntry.query.filter_by(id=body['log_id']).one().participant_id == 'SINK09'
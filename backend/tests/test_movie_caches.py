@@ -0,0 +1,69 @@
+"""
+Cached movie data: callers get their own copies, and changes made by another process are picked up
+"""
+from sqlalchemy import text
+import data_access
+from data_access import run_structured_query, bump_data_version
+from database import db
+
+def test_cached_rows_are_copies(app_context, monkeypatch):
+    for engine in ('sql', 'index'):
+        monkeypatch.setenv('MOVIE_QUERY_ENGINE', engine)
+        filters, sort = {'genres': ['Drama']}, {'field': 'runtime', 'direction': 'desc'}
+        first = run_structured_query(filters=filters, sort=sort)
+        expected = [dict(row, genres=list(row['genres'])) for row in first]
+        first[0]['title'] = 'changed by a caller'
+        first[0]['genres'].append('Western')
+        first.pop()
+        assert run_structured_query(filters=filters, sort=sort) == expected
+
+def faceted_languages(client):
+    response = client.post('/api/search/faceted', json={'participant_id': 'TEST', 'task_id': 'T01', 'filters': {}})
+    return {row['id']: row['language'] for row in response.get_json()['results']}
+
+def test_changes_from_another_process_invalidate_caches(app, client, monkeypatch):
+    monkeypatch.setattr(data_access, 'DATA_VERSION_CHECK_SECONDS', 0)
+    assert faceted_languages(client)[1] == 'en'
+
+    # Another process (e.g. preprocess_data.py) writes without this process's session listeners
+    with app.app_context():
+        with db.engine.begin() as connection:
+            connection.execute(text("UPDATE movies SET language = 'xx' WHERE id = 1"))
+        try:
+            assert faceted_languages(client)[1] == 'en'  # still cached: nothing announced the change
+            bump_data_version()
+            assert faceted_languages(client)[1] == 'xx'
+        finally:
+            with db.engine.begin() as connection:
+                connection.execute(text("UPDATE movies SET language = 'en' WHERE id = 1"))
+            bump_data_version()
+    assert faceted_languages(client)[1] == 'en'
+
+def test_own_commits_bump_the_data_version(app_context):
+    from models import Movie, DataVersion
+    before = db.session.get(DataVersion, 'movies')
+    before = before.version if before else 0
+    movie = db.session.get(Movie, 2)
+    original = movie.language
+    movie.language = 'yy'
+    db.session.commit()
+    try:
+        assert run_structured_query(filters={}, sort=None)[1]['language'] == 'yy'
+        db.session.expire_all()
+        assert db.session.get(DataVersion, 'movies').version == before + 1
+    finally:
+        movie.language = original
+        db.session.commit()
+
+def test_data_version_change_reloads_semantic_index(app_context, monkeypatch):
+    """preprocess_data.py rebuilds the semantic index files, then bumps the version"""
+    import semantic_index
+    monkeypatch.setattr(data_access, 'DATA_VERSION_CHECK_SECONDS', 0)
+    data_access.check_data_version()
+    stale = object()
+    monkeypatch.setattr(semantic_index, '_semantic_index', stale)
+    data_access.check_data_version()
+    assert semantic_index.get_semantic_index() is stale  # no change announced
+    bump_data_version()
+    data_access.check_data_version()
+    assert semantic_index.get_semantic_index() is not stale
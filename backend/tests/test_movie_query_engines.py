@@ -0,0 +1,65 @@
+"""
+The in-memory MovieIndex must return exactly the rows, in exactly the order, of the SQL query
+"""
+import itertools
+import pytest
+from data_access import build_movie_query
+from movie_index import get_movie_index, normalize_sort
+
+FILTERS = [
+    None,
+    {},
+    {'genres': ['Drama']},
+    {'genres': ['drama', 'THRILLER']},                      # OR within genres, case-insensitive
+    {'genres': ['Drama', 'No Such Genre']},
+    {'genres': ['No Such Genre']},
+    {'genres': ['Comedy'], 'lead_gender': 'female'},        # AND across filter groups
+    {'genres': ['Action', 'Horror'], 'runtime_max': 95, 'budget_min': 5e6},
+    {'lead_gender': 'unknown'},
+    {'lead_gender': 'nobody'},
+    {'release_year_min': 2000},
+    {'release_year_min': 1998, 'release_year_max': 2001},
+    {'runtime_min': 90, 'runtime_max': 90},
+    {'budget_max': 5e6, 'revenue_min': 1e8},
+    {'revenue_max': 0.5e8},
+    {'release_year_min': 0, 'runtime_max': '', 'genres': []},  # empty values are ignored
+    {'text': 'robot'},
+    {'text': 'space robot'},
+    {'text': 'ocean', 'genres': ['Drama'], 'release_year_max': 2002},
+    {'text': 'nosuchword'},
+    {'text': '  '},
+]
+
+SORTS = [None, {'field': 'relevance'}, {'field': 'unknown_field', 'direction': 'desc'}] + [
+    {'field': field, 'direction': direction}
+    for field, direction in itertools.product(['release_year', 'runtime', 'budget', 'revenue', 'title', 'id'],
+                                              ['asc', 'desc'])
+]
+
+def sql_rows(filters, sort, limit):
+    rows = build_movie_query(filters=filters, sort=sort).limit(limit).all()
+    if normalize_sort(sort)[0] == 'relevance':
+        return [(movie.id, float(score)) for movie, score in rows]
+    return [(movie.id, None) for movie in rows]
+
+def index_rows(filters, sort, limit):
+    return [(row['id'], row.get('relevance')) for row in get_movie_index().query(filters=filters, sort=sort, limit=limit)]
+
+@pytest.mark.parametrize('sort', SORTS, ids=lambda sort: str(sort and tuple(sort.values())))
+@pytest.mark.parametrize('filters', FILTERS, ids=str)
+def test_index_matches_sql(app_context, filters, sort):
+    for limit in (1000, 7):
+        expected = sql_rows(filters, sort, limit)
+        actual = index_rows(filters, sort, limit)
+        assert [movie_id for movie_id, _ in actual] == [movie_id for movie_id, _ in expected]
+        if normalize_sort(sort)[0] == 'relevance':
+            assert [score for _, score in actual] == pytest.approx([score for _, score in expected])
+
+def test_grid_covers_nulls_and_ties(app_context):
+    """The catalog must exercise NULL placement and id tie-breaking for the comparison to mean anything"""
+    rows = get_movie_index().query(limit=None)
+    for field in ('release_year', 'runtime', 'budget', 'revenue'):
+        values = [row[field] for row in rows]
+        assert None in values
+        assert len(set(values)) < len(values) - values.count(None)
+    assert len({row['title'] for row in rows}) < len(rows)
@@ -0,0 +1,83 @@
+"""
+The rule parser on the study's sample queries, and the parse source logged with each preview
+"""
+import json
+import pytest
+from benchmark_nl_parser import load_logged_pairs
+from log_sink import log_event
+from models import LogEntry
+from nl_rules import parse_with_rules, try_parse
+
+SAMPLE_QUERIES = [
+    ('Find all drama or thriller movies with a female lead, budget under $10M, sorted by highest revenue.',
+     {'filters': {'genres': ['Drama', 'Thriller'], 'lead_gender': 'female', 'budget_max': 10000000},
+      'sort': {'field': 'revenue', 'direction': 'desc'}}),
+    ('Find all movies released after 2015 with runtime under 100 minutes.',
+     {'filters': {'release_year_min': 2016, 'runtime_max': 99}, 'sort': {}}),
+    ('dramas after 2015', {'filters': {'genres': ['Drama'], 'release_year_min': 2016}, 'sort': {}}),
+    ('under 100 minutes', {'filters': {'runtime_max': 99}, 'sort': {}}),
+    ('budget under $10M', {'filters': {'budget_max': 10000000}, 'sort': {}}),
+    ('sorted by highest revenue', {'filters': {}, 'sort': {'field': 'revenue', 'direction': 'desc'}}),
+    ('revenue over 1 billion', {'filters': {'revenue_min': 1000000000}, 'sort': {}}),
+    ('sci-fi films before 2000 longer than 2 hours',
+     {'filters': {'genres': ['Science Fiction'], 'release_year_max': 1999, 'runtime_min': 121}, 'sort': {}}),
+    ('horror movies from the 1990s',
+     {'filters': {'genres': ['Horror'], 'release_year_min': 1990, 'release_year_max': 1999}, 'sort': {}}),
+    ('movies between 2010 and 2012 sorted by runtime',
+     {'filters': {'release_year_min': 2010, 'release_year_max': 2012}, 'sort': {'field': 'runtime', 'direction': 'asc'}}),
+    ('action movies with a male lead sorted by budget ascending',
+     {'filters': {'genres': ['Action'], 'lead_gender': 'male'}, 'sort': {'field': 'budget', 'direction': 'asc'}}),
+]
+
+# Queries the rules cannot fully account for; they must go to the LLM
+LLM_QUERIES = ['movies about space robots', 'comedies that are not romantic', 'best movies ever']
+
+@pytest.mark.parametrize('query, expected', SAMPLE_QUERIES, ids=[query for query, _ in SAMPLE_QUERIES])
+def test_sample_queries(query, expected):
+    parsed, confidence = parse_with_rules(query)
+    assert confidence == 1.0
+    assert parsed['sort'] == expected['sort']
+    assert parsed['filters'] == expected['filters']
+    assert try_parse(query) == parsed
+
+@pytest.mark.parametrize('query', LLM_QUERIES)
+def test_uncertain_queries_are_left_to_the_llm(query):
+    assert try_parse(query) is None
+
+def logged(participant_id, event_type):
+    entries = LogEntry.query.filter_by(participant_id=participant_id, event_type=event_type).order_by(LogEntry.id).all()
+    return [json.loads(entry.payload) for entry in entries]
+
+def parse(client, participant_id, query):
+    response = client.post('/api/search/llm_assist/parse',
+                           json={'participant_id': participant_id, 'task_id': 'T01', 'nl_query': query})
+    assert response.status_code == 200
+    return response.get_json()
+
+def test_preview_logs_its_source(app, client):
+    parse(client, 'RULES01', 'dramas after 2015')
+    parse(client, 'RULES01', 'movies about space robots')  # no API key: the LLM call fails
+    with app.app_context():
+        previews = logged('RULES01', 'parsed_preview')
+    assert [preview['source'] for preview in previews] == ['rules', 'fallback']
+    assert previews[0]['parsed_query']['filters'] == {'genres': ['Drama'], 'release_year_min': 2016}
+
+def test_benchmark_reference_is_llm_parses_only(app, client, monkeypatch):
+    import llm_integration
+    monkeypatch.setattr(llm_integration, 'parse_with_llm',
+                        lambda nl_query, model=None, store=True: ({'filters': {'text': 'robot'}, 'sort': {}}, 'llm'))
+    parse(client, 'RULES02', 'horror movies from the 1990s')
+    parse(client, 'RULES02', 'robot movies for the benchmark')
+    queries = [query for query, _, _ in load_logged_pairs()]
+    assert 'robot movies for the benchmark' in queries
+    assert 'horror movies from the 1990s' not in queries
+    assert 'movies about space robots' not in queries
+
+def test_previews_without_source_count_as_llm_parses(app):
+    """Study data logged before parsed_preview recorded its source"""
+    with app.app_context():
+        log_event('RULES03', 'llm_assist', 'T01', 'nl_query_sent', {'query': 'old logged robot query'})
+        log_event('RULES03', 'llm_assist', 'T01', 'parsed_preview',
+                  {'parsed_query': {'filters': {'text': 'robot'}, 'sort': {}}})
+    pairs = {query: parsed for query, parsed, _ in load_logged_pairs()}
+    assert pairs['old logged robot query'] == {'filters': {'text': 'robot'}, 'sort': {}}
@@ -0,0 +1,111 @@
+"""
+Keyset pagination: walking every page returns exactly the unpaginated result
+"""
+import itertools
+import json
+import pytest
+import data_access
+from data_access import run_structured_query, run_paginated_query, encode_cursor, decode_cursor
+from database import db
+from models import LogEntry
+
+SORTS = [None, {'field': 'relevance'}] + [
+    {'field': field, 'direction': direction}
+    for field, direction in itertools.product(['release_year', 'runtime', 'budget', 'revenue', 'title', 'id'],
+                                              ['asc', 'desc'])
+]
+FILTERS = [{}, {'genres': ['Drama', 'Comedy']}, {'text': 'love'}, {'runtime_max': 90, 'lead_gender': 'male'}]
+
+def walk(filters, sort, page_size):
+    rows, cursor, pages = [], None, 0
+    while True:
+        page, cursor = run_paginated_query(filters=filters, sort=sort, page_size=page_size, cursor=cursor)
+        rows.extend(page)
+        pages += 1
+        if cursor is None:
+            return rows, pages
+        assert len(page) == page_size
+
+@pytest.mark.parametrize('engine', ['sql', 'index'])
+@pytest.mark.parametrize('sort', SORTS, ids=lambda sort: str(sort and tuple(sort.values())))
+@pytest.mark.parametrize('filters', FILTERS, ids=str)
+def test_pages_concatenate_to_the_full_result(app_context, monkeypatch, engine, filters, sort):
+    monkeypatch.setenv('MOVIE_QUERY_ENGINE', engine)
+    expected = [row['id'] for row in run_structured_query(filters=filters, sort=sort, limit=None)]
+    for page_size in (1, 7, 50, len(expected) or 1):
+        rows, pages = walk(filters, sort, page_size)
+        assert [row['id'] for row in rows] == expected
+        assert pages == max(1, -(-len(expected) // page_size))
+
+def test_sort_values_include_nulls_and_ties(app_context):
+    """Page boundaries must land inside runs of NULLs and of equal values for the walk to prove anything"""
+    rows = run_structured_query(sort={'field': 'budget', 'direction': 'asc'}, limit=None)
+    budgets = [row['budget'] for row in rows]
+    assert budgets.count(None) > 7
+    assert max(budgets.count(value) for value in set(budgets) if value is not None) > 7
+
+def test_cursor_is_tied_to_its_sort(app_context):
+    sort = {'field': 'runtime', 'direction': 'desc'}
+    cursor = encode_cursor(sort, {'id': 5, 'runtime': None})
+    assert decode_cursor(cursor, sort) == (None, 5)
+    with pytest.raises(ValueError):
+        decode_cursor(cursor, {'field': 'runtime', 'direction': 'asc'})
+    with pytest.raises(ValueError):
+        decode_cursor('not a cursor', sort)
+
+def logged(participant_id, event_type):
+    entries = LogEntry.query.filter_by(participant_id=participant_id, event_type=event_type).order_by(LogEntry.id).all()
+    return [json.loads(entry.payload) for entry in entries]
+
+def test_query_executed_logs_the_whole_result(app, client, monkeypatch):
+    monkeypatch.setattr('result_sets.RESULT_SETS_ENABLED', False)  # keep ID lists inline for the check
+    request = {'participant_id': 'PAGES', 'task_id': 'T01', 'filters': {'genres': ['Drama']},
+               'sort': {'field': 'revenue', 'direction': 'desc'}, 'page_size': 10}
+    first = client.post('/api/search/faceted', json=request).get_json()
+    second = client.post('/api/search/faceted', json=dict(request, cursor=first['next_cursor'])).get_json()
+
+    with app.app_context():
+        expected = [row['id'] for row in run_structured_query(filters=request['filters'], sort=request['sort'],
+                                                               limit=None)]
+        assert len(expected) > 20
+        assert first['result_count'] == len(expected)
+        assert 'result_ids' not in first and 'result_ids' not in second  # only the log needs them
+
+        executed, = logged('PAGES', 'query_executed')
+        assert executed['result_ids'] == expected
+        assert executed['result_count'] == len(expected)
+        assert executed['page_count'] == 10 and executed['has_more']
+        page, = logged('PAGES', 'results_page_loaded')
+        assert page['page_ids'] == [row['id'] for row in second['results']] == expected[10:20]
+
+@pytest.mark.parametrize('engine', ['sql', 'index'])
+@pytest.mark.parametrize('sort', SORTS, ids=lambda sort: str(sort and tuple(sort.values())))
+def test_result_ids_match_the_rows(app_context, monkeypatch, engine, sort):
+    monkeypatch.setenv('MOVIE_QUERY_ENGINE', engine)
+    data_access._query_cache.clear()
+    filters = {'text': 'war', 'release_year_min': 1998}
+    expected = [row['id'] for row in run_structured_query(filters=filters, sort=sort, limit=None)]
+    assert data_access.get_result_ids(filters=filters, sort=sort) == expected
+
+def test_logged_result_is_capped_at_the_query_limit(app, client, monkeypatch):
+    """result_count stays comparable to the unpaginated query, which stopped at QUERY_LIMIT rows"""
+    monkeypatch.setattr('result_sets.RESULT_SETS_ENABLED', False)
+    monkeypatch.setattr('routes.search.QUERY_LIMIT', 15)
+    request = {'participant_id': 'PAGECAP', 'task_id': 'T01', 'filters': {}, 'sort': {'field': 'id'}, 'page_size': 5}
+    first = client.post('/api/search/faceted', json=request).get_json()
+    assert len(first['results']) == 5 and first['result_count'] == 15
+
+    with app.app_context():
+        expected = [row['id'] for row in run_structured_query(filters={}, sort=request['sort'], limit=15)]
+        executed, = logged('PAGECAP', 'query_executed')
+    assert executed['result_ids'] == expected and executed['result_count'] == 15
+
+    ids = client.post('/api/search/result_ids', json={'filters': {}, 'sort': request['sort']}).get_json()
+    assert ids == {'result_ids': expected, 'result_count': 15}
+
+@pytest.mark.parametrize('page_size', ['ten', [10], {'size': 10}])
+def test_invalid_page_size_is_rejected(client, page_size):
+    response = client.post('/api/search/faceted', json={
+        'participant_id': 'PAGEBAD', 'task_id': 'T01', 'filters': {}, 'page_size': page_size})
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'page_size must be an integer'}
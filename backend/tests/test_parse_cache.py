@@ -0,0 +1,78 @@
+"""
+Persistent parse cache: TTL in UTC whatever the host's time zone, hits written in batches
+"""
+import time
+from datetime import datetime, timedelta
+import pytest
+import parse_cache
+from parse_cache import get_cached_parse, store_parse, flush_touches, cache_key, clear_parse_cache
+from database import db
+from models import ParseCacheEntry
+
+PARSED = {'filters': {'genres': ['Drama']}, 'sort': {}}
+
+@pytest.fixture
+def local_time_zone(monkeypatch):
+    """Run with the host clock 9 hours ahead of UTC"""
+    monkeypatch.setenv('TZ', 'Etc/GMT-9')
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+def row(query):
+    db.session.expire_all()
+    return db.session.get(ParseCacheEntry, cache_key(query, 'gpt-test', '1'))
+
+def test_ttl_ignores_host_time_zone(app_context, local_time_zone, monkeypatch):
+    clear_parse_cache()
+    monkeypatch.setattr(parse_cache, 'PARSE_CACHE_TTL_SECONDS', 3600)
+    store_parse('dramas from last year', 'gpt-test', '1', PARSED)
+    entry = row('dramas from last year')
+    entry.created_at = datetime.utcnow() - timedelta(minutes=30)
+    db.session.commit()
+
+    parse_cache._memory.clear()  # read the row's created_at
+    assert get_cached_parse('dramas from last year', 'gpt-test', '1') == PARSED
+
+    entry = row('dramas from last year')
+    entry.created_at = datetime.utcnow() - timedelta(minutes=90)
+    db.session.commit()
+    parse_cache._memory.clear()
+    assert get_cached_parse('dramas from last year', 'gpt-test', '1') is None
+
+def test_hits_are_written_in_batches(app_context):
+    clear_parse_cache()
+    store_parse('thrillers please', 'gpt-test', '1', PARSED)
+    parse_cache._memory.clear()
+    for _ in range(3):
+        assert get_cached_parse('thrillers please', 'gpt-test', '1') == PARSED  # one table read, then memory
+    assert row('thrillers please').hit_count == 0  # nothing written on the request path
+
+    flush_touches()
+    entry = row('thrillers please')
+    assert entry.hit_count == 3
+    assert entry.last_used_at > entry.created_at
+
+def test_pending_hits_are_written_with_the_next_store(app_context):
+    clear_parse_cache()
+    store_parse('comedies', 'gpt-test', '1', PARSED)
+    get_cached_parse('comedies', 'gpt-test', '1')
+    store_parse('horror films', 'gpt-test', '1', PARSED)
+    assert row('comedies').hit_count == 1
+
+def test_other_endpoints_do_not_share_entries(app_context, monkeypatch):
+    clear_parse_cache()
+    stub_parse = {'filters': {'text': 'stub'}, 'sort': {}}
+    monkeypatch.setenv('OPENAI_BASE_URL', 'http://localhost:8001/v1')
+    store_parse('comedies with a female lead', 'gpt-test', '1', stub_parse)
+    assert get_cached_parse('comedies with a female lead', 'gpt-test', '1') == stub_parse
+
+    for default in ('', 'https://api.openai.com/v1/'):
+        monkeypatch.setenv('OPENAI_BASE_URL', default)
+        assert get_cached_parse('comedies with a female lead', 'gpt-test', '1') is None
+    store_parse('comedies with a female lead', 'gpt-test', '1', PARSED)
+    monkeypatch.delenv('OPENAI_BASE_URL')
+    assert get_cached_parse('comedies with a female lead', 'gpt-test', '1') == PARSED
+    monkeypatch.setenv('OPENAI_BASE_URL', 'http://localhost:8001/v1/')
+    assert get_cached_parse('comedies with a female lead', 'gpt-test', '1') == stub_parse
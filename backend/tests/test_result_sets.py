@@ -0,0 +1,103 @@
+"""
+Result sets: ID lists survive encoding, are written with the log entry that references them, and resolve back
+"""
+import json
+import random
+from collections import deque
+import pytest
+import log_sink
+import result_sets
+from result_sets import encode_ids, decode_ids, reference_result_sets, resolve_logs
+from data_access import run_structured_query
+from models import LogEntry, ResultSet
+
+@pytest.mark.parametrize('ids', [
+    [],
+    [7],
+    [1, 2, 3, 4],
+    [900, 12, 11, 3, 1],                     # negative deltas
+    [5, 5, 5, 2, 2],                         # repeats
+    [-3, 0, -1_000_000, 4],                  # negative IDs
+    [2 ** 31 - 1, 0, 2 ** 40, 2 ** 62, 1],   # large IDs and large jumps both ways
+    random.Random(3).sample(range(1, 10 ** 9), 1000),
+], ids=lambda ids: f'{len(ids)} ids')
+def test_round_trip(ids):
+    assert decode_ids(encode_ids(ids)) == ids
+
+def test_encoding_is_compact():
+    assert encode_ids([]) == b''
+    assert len(encode_ids(range(1, 1001))) == 1000  # deltas of 1: one byte each
+    assert encode_ids([3, 2]) != encode_ids([3, 4])  # sign of the delta is kept
+
+def stored_sets(digests):
+    return {row.hash: decode_ids(row.data) for row in ResultSet.query.filter(ResultSet.hash.in_(digests))}
+
+def logged_entries(participant_id):
+    entries = LogEntry.query.filter_by(participant_id=participant_id).order_by(LogEntry.id).all()
+    return [entry.to_dict() for entry in entries]
+
+def test_search_logs_reference_and_resolve(app, client):
+    response = client.post('/api/search/faceted', json={
+        'participant_id': 'RSET01', 'task_id': 'T01', 'filters': {'genres': ['Drama']}, 'page_size': 10})
+    assert len(response.get_json()['results']) == 10
+    with app.app_context():
+        expected = [row['id'] for row in run_structured_query(filters={'genres': ['Drama']})]
+        assert len(expected) > 10
+        logs = logged_entries('RSET01')
+        executed = [log for log in logs if log['event_type'] == 'query_executed'][0]
+        assert 'result_ids' not in executed['payload']
+        digest = executed['payload']['result_set']
+        assert stored_sets([digest]) == {digest: expected}
+        resolve_logs(logs)
+    assert executed['payload']['result_ids'] == expected
+    assert executed['payload']['result_set'] == digest
+
+def test_resolve_logs_leaves_other_payloads_alone(app_context):
+    logs = [{'payload': None}, {'payload': 'text'}, {'payload': {'result_set': 'unknown'}}, {'payload': {'n': 1}}]
+    before = json.dumps(logs)
+    assert resolve_logs(logs) is logs
+    assert json.dumps(logs) == before
+
+@pytest.fixture
+def buffered(app_context, monkeypatch):
+    """A buffered sink whose writer thread never flushes on its own"""
+    monkeypatch.setattr(log_sink, 'LOG_SINK_MODE', 'buffered')
+    monkeypatch.setattr(log_sink, 'LOG_SINK_BATCH_SIZE', 1000)
+    monkeypatch.setattr(log_sink, 'LOG_SINK_FLUSH_SECONDS', 30)
+    monkeypatch.setattr(log_sink, '_queue', deque())
+    monkeypatch.setattr(log_sink, '_stats', dict.fromkeys(log_sink._stats, 0))
+    monkeypatch.setattr(log_sink, '_app', None)
+    monkeypatch.setattr(log_sink, '_thread', None)
+    monkeypatch.setattr(log_sink, '_stopping', False)
+    monkeypatch.setattr(result_sets, '_stored', result_sets.LRUCache(16))
+    yield
+    log_sink.shutdown()
+
+def test_result_set_is_written_with_its_log_entry(buffered):
+    ids = [42, 17, 230, 1]
+    payload, rows = reference_result_sets({'result_ids': ids, 'result_count': 4})
+    assert [row['hash'] for row in rows] == [payload['result_set']]
+    log_sink.log_event('RSET02', 'faceted', 'T01', 'query_executed', payload, result_sets=rows)
+    # The same list logged again before the first is written carries its row too; stored once
+    again, rows_again = reference_result_sets({'result_ids': ids})
+    log_sink.log_event('RSET02', 'faceted', 'T01', 'query_executed', again, result_sets=rows_again)
+    assert rows_again
+
+    assert stored_sets([payload['result_set']]) == {}  # nothing written on the request path
+    assert log_sink.flush()
+    assert stored_sets([payload['result_set']]) == {payload['result_set']: ids}
+    assert len(logged_entries('RSET02')) == 2
+
+    # Once committed, later references carry no row
+    assert reference_result_sets({'result_ids': ids})[1] == []
+
+def test_dropped_batch_writes_no_result_set(buffered, monkeypatch):
+    def insert(table):
+        raise RuntimeError('database unavailable')
+    monkeypatch.setattr(log_sink, 'insert', insert)  # the log entry insert fails after the result set's
+    payload, rows = reference_result_sets({'result_ids': [3, 1, 2]})
+    log_sink.log_event('RSET03', 'faceted', 'T01', 'query_executed', payload, result_sets=rows)
+    for _ in range(log_sink.MAX_ATTEMPTS):
+        assert not log_sink.flush()
+    assert stored_sets([payload['result_set']]) == {}
+    assert reference_result_sets({'result_ids': [3, 1, 2]})[1]  # not believed stored
@@ -0,0 +1,45 @@
+"""
+Pre-encoded row fragments are only shared between full rows, never with projected or scored rows
+"""
+import data_access
+from data_access import MOVIE_FIELDS
+
+FIELDS_WITHOUT_OVERVIEW = [field for field in MOVIE_FIELDS if field != 'overview']
+TEXT_QUERY = {'filters': {'text': 'robot'}, 'sort': {'field': 'relevance'}}
+FULL_QUERY = {'filters': {}, 'sort': {'field': 'id'}}
+
+def search(client, query, **options):
+    response = client.post('/api/search/faceted', json=dict(query, participant_id='ROWJSON', task_id='T01', **options))
+    assert response.status_code == 200
+    return response.get_json()['results']
+
+def expected_rows(client, monkeypatch, query, **options):
+    """The same search answered by jsonify, without fragments"""
+    monkeypatch.setenv('FAST_JSON_RESPONSES', '0')
+    rows = search(client, query, **options)
+    monkeypatch.delenv('FAST_JSON_RESPONSES')
+    return rows
+
+def test_projected_relevance_rows_do_not_leak_into_full_rows(client, monkeypatch):
+    data_access._row_json_cache.clear()
+    projected = search(client, TEXT_QUERY, fields=FIELDS_WITHOUT_OVERVIEW)
+    # Nine fields plus relevance: as many keys as a full row
+    assert projected and all(len(row) == len(MOVIE_FIELDS) and 'relevance' in row for row in projected)
+
+    full = search(client, FULL_QUERY)
+    assert full == expected_rows(client, monkeypatch, FULL_QUERY)
+    assert all(set(row) == set(MOVIE_FIELDS) for row in full)
+
+def test_full_rows_do_not_leak_into_projected_relevance_rows(client, monkeypatch):
+    data_access._row_json_cache.clear()
+    search(client, FULL_QUERY)
+    projected = search(client, TEXT_QUERY, fields=FIELDS_WITHOUT_OVERVIEW)
+    assert projected == expected_rows(client, monkeypatch, TEXT_QUERY, fields=FIELDS_WITHOUT_OVERVIEW)
+    assert all('relevance' in row and 'overview' not in row for row in projected)
+
+def test_full_rows_reuse_fragments(client):
+    data_access._row_json_cache.clear()
+    first = search(client, FULL_QUERY)
+    hits = data_access.get_row_json_cache_stats()['hits']
+    assert search(client, FULL_QUERY) == first
+    assert data_access.get_row_json_cache_stats()['hits'] - hits == len(first)
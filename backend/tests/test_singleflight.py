@@ -0,0 +1,90 @@
+"""
+Single-flight coalescing: one call per key in flight, its result or error reaches every waiter
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+import pytest
+import llm_integration
+from singleflight import SingleFlight
+
+WAITERS = 5
+
+def run_together(flight, key, function, callers=WAITERS):
+    """Start callers concurrently while the leader's call is held open; returns their futures"""
+    started = threading.Event()
+    release = threading.Event()
+    def leader_call():
+        started.set()
+        release.wait(5)
+        return function()
+    executor = ThreadPoolExecutor(max_workers=callers)
+    futures = [executor.submit(flight.do, key, leader_call)]
+    started.wait(5)
+    futures += [executor.submit(flight.do, key, leader_call) for _ in range(callers - 1)]
+    while flight.stats()['coalesced'] < callers - 1:
+        time.sleep(0.001)
+    release.set()
+    executor.shutdown(wait=True)
+    return futures
+
+def test_waiters_share_one_call():
+    flight = SingleFlight(enabled=True)
+    result = {'filters': {'genres': ['Drama']}}
+    futures = run_together(flight, 'key', lambda: result)
+    outcomes = [future.result() for future in futures]
+    assert outcomes[0] == (result, False)
+    assert all(outcome == (result, True) for outcome in outcomes[1:])
+    stats = flight.stats()
+    assert (stats['calls'], stats['coalesced'], stats['in_flight']) == (1, WAITERS - 1, 0)
+
+    # Once finished, the next call for the key runs again
+    assert flight.do('key', lambda: 'again') == ('again', False)
+
+def test_error_reaches_every_waiter():
+    flight = SingleFlight(enabled=True)
+    def fail():
+        raise RuntimeError('upstream down')
+    futures = run_together(flight, 'key', fail)
+    for future in futures:
+        with pytest.raises(RuntimeError, match='upstream down'):
+            future.result()
+    assert flight.stats()['in_flight'] == 0
+    assert flight.do('key', lambda: 'recovered') == ('recovered', False)
+
+def test_disabled_runs_every_call():
+    flight = SingleFlight(enabled=False)
+    assert flight.do('key', lambda: 1) == (1, False)
+    assert flight.do('key', lambda: 2) == (2, False)
+    assert flight.stats()['calls'] == 2
+
+def test_coalesced_parses_are_isolated_copies(monkeypatch):
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+    def completion(messages, model=None, call=None, **params):
+        calls.append(model)
+        started.set()
+        release.wait(5)
+        content = '{"filters": {"genres": ["Drama"], "text": null}, "sort": {"field": "revenue"}}'
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))], usage=None)
+    monkeypatch.setattr(llm_integration, 'chat_completion', completion)
+    monkeypatch.setattr(llm_integration, '_parse_flight', SingleFlight(enabled=True))
+
+    parse = lambda: llm_integration.parse_with_llm('dramas by revenue, coalesced', 'gpt-test', store=False)
+    with ThreadPoolExecutor(max_workers=WAITERS) as executor:
+        futures = [executor.submit(parse)]
+        started.wait(5)
+        futures += [executor.submit(parse) for _ in range(WAITERS - 1)]
+        while llm_integration._parse_flight.stats()['coalesced'] < WAITERS - 1:
+            time.sleep(0.001)
+        release.set()
+    results = [future.result() for future in futures]
+
+    assert calls == ['gpt-test']
+    expected = {'filters': {'genres': ['Drama']}, 'sort': {'field': 'revenue'}}
+    assert all(result == (expected, 'llm') for result in results)
+    results[0][0]['filters']['genres'].append('Thriller')
+    assert all(parsed['filters']['genres'] == ['Drama'] for parsed, _ in results[1:])
+    assert len({id(parsed['filters']) for parsed, _ in results}) == WAITERS
@@ -0,0 +1,93 @@
+"""
+Speculative execution runs only the first page ahead, and execute never waits on it for long
+"""
+import json
+import threading
+import pytest
+import speculation
+from models import LogEntry
+
+QUERY = 'dramas before 2003'  # answered by the rule parser, no LLM involved
+
+def parse(client, participant_id, page_size=None):
+    response = client.post('/api/search/llm_assist/parse', json={
+        'participant_id': participant_id, 'task_id': 'T01', 'nl_query': QUERY, 'page_size': page_size})
+    assert response.status_code == 200
+    return response.get_json()
+
+def execute(client, participant_id, parsed, page_size=None):
+    response = client.post('/api/search/llm_assist/execute', json={
+        'participant_id': participant_id, 'task_id': 'T01', 'parsed_query': parsed['parsed_query'],
+        'preview_token': parsed['preview_token'], 'page_size': page_size})
+    assert response.status_code == 200
+    return response.get_json()
+
+def executed(app, participant_id):
+    with app.app_context():
+        entry = LogEntry.query.filter_by(participant_id=participant_id, event_type='query_executed') \
+            .order_by(LogEntry.id.desc()).first()
+        return json.loads(entry.payload)
+
+@pytest.fixture
+def speculated_limits(monkeypatch):
+    limits = []
+    run = speculation.run_structured_query
+    def recording(filters=None, sort=None, limit=None):
+        limits.append(limit)
+        return run(filters=filters, sort=sort, limit=limit)
+    monkeypatch.setattr(speculation, 'run_structured_query', recording)
+    return limits
+
+def test_speculates_one_page(app, client, speculated_limits):
+    expected = execute(client, 'SPEC00', {'parsed_query': parse(client, 'SPEC00')['parsed_query'],
+                                          'preview_token': None}, page_size=5)
+
+    parsed = parse(client, 'SPEC01', page_size=5)
+    body = execute(client, 'SPEC01', parsed, page_size=5)
+    assert speculated_limits[-1] == 6
+    assert executed(app, 'SPEC01')['speculation'] == 'hit'
+    assert body['results'] == expected['results']
+    assert body['next_cursor'] == expected['next_cursor'] is not None
+    assert body['result_count'] == expected['result_count']
+
+def test_unpaginated_speculation_keeps_the_default_limit(app, client, speculated_limits):
+    parsed = parse(client, 'SPEC02')
+    body = execute(client, 'SPEC02', parsed)
+    assert speculated_limits[-1] == speculation.QUERY_LIMIT
+    assert executed(app, 'SPEC02')['speculation'] == 'hit'
+    assert body['next_cursor'] is None
+
+def test_other_page_size_is_a_modified_query(app, client):
+    parsed = parse(client, 'SPEC03', page_size=5)
+    body = execute(client, 'SPEC03', parsed, page_size=10)
+    assert executed(app, 'SPEC03')['speculation'] == 'modified'
+    assert len(body['results']) == 10
+
+def test_slow_speculation_falls_back_to_running_the_query(app, client, monkeypatch):
+    release = threading.Event()
+    run = speculation._run
+    def stuck(*args):
+        release.wait(10)
+        return run(*args)
+    monkeypatch.setattr(speculation, '_run', stuck)
+    monkeypatch.setattr(speculation, 'SPECULATION_WAIT_SECONDS', 0.05)
+    try:
+        parsed = parse(client, 'SPEC04', page_size=5)
+        body = execute(client, 'SPEC04', parsed, page_size=5)
+    finally:
+        release.set()
+    assert executed(app, 'SPEC04')['speculation'] == 'timeout'
+    assert len(body['results']) == 5
+    assert speculation.get_speculation_stats()['timeouts'] >= 1
+
+def test_invalid_page_size_is_rejected_before_parsing(app, client, monkeypatch):
+    import routes.search
+    def parse_nl_query(nl_query):
+        raise AssertionError('parsed despite an invalid page_size')
+    monkeypatch.setattr(routes.search, 'parse_nl_query', parse_nl_query)
+    response = client.post('/api/search/llm_assist/parse', json={
+        'participant_id': 'SPEC05', 'task_id': 'T01', 'nl_query': QUERY, 'page_size': 'ten'})
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'page_size must be an integer'}
+    with app.app_context():
+        assert LogEntry.query.filter_by(participant_id='SPEC05').count() == 0
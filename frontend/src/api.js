@@ -23,59 +23,201 @@ export const getGenres = () =>
   api.get('/experiment/genres')
 
 // Search endpoints
-export const facetedSearch = (participantId, taskId, filters, sort) =>
+
+// Result tables fetch a compact first page (no overview text) and load more on demand
+export const RESULT_PAGE = {
+  page_size: 100,
+  fields: ['title', 'release_year', 'runtime', 'genres', 'lead_gender', 'budget', 'revenue']
+}
+
+export const facetedSearch = (participantId, taskId, filters, sort, page = {}) =>
   api.post('/search/faceted', {
     participant_id: participantId,
     task_id: taskId,
     filters,
-    sort
+    sort,
+    ...page
   })
 
-export const llmAssistParse = (participantId, taskId, nlQuery) =>
+export const getFacetCounts = (filters) =>
+  api.post('/search/facets', { filters })
+
+// Ids of every row of a query (up to the 1000-row query limit), for "Select All" beyond the loaded pages
+export const getResultIds = (filters, sort) =>
+  api.post('/search/result_ids', { filters, sort })
+
+// page_size tells the backend how much of the parsed query to run ahead of llmAssistExecute
+export const llmAssistParse = (participantId, taskId, nlQuery, page = {}) =>
   api.post('/search/llm_assist/parse', {
     participant_id: participantId,
     task_id: taskId,
-    nl_query: nlQuery
+    nl_query: nlQuery,
+    page_size: page.page_size
   })
 
-export const llmAssistExecute = (participantId, taskId, parsedQuery) =>
+// previewToken (from llmAssistParse) lets the backend reuse the query it started at parse time
+export const llmAssistExecute = (participantId, taskId, parsedQuery, page = {}, previewToken = null) =>
   api.post('/search/llm_assist/execute', {
     participant_id: participantId,
     task_id: taskId,
-    parsed_query: parsedQuery
+    parsed_query: parsedQuery,
+    preview_token: previewToken,
+    ...page
   })
 
-export const llmOnlySearch = (participantId, taskId, nlQuery) =>
+// retry: the query was already sent (and logged) by llmOnlySearchStream, so nl_query_sent is not logged again
+export const llmOnlySearch = (participantId, taskId, nlQuery, { retry = false } = {}) =>
   api.post('/search/llm_only', {
     participant_id: participantId,
     task_id: taskId,
-    nl_query: nlQuery
+    nl_query: nlQuery,
+    retry
   })
 
+// Streams the LLM-only answer: onResults(data) fires once retrieval is done, onToken(text)
+// for each answer chunk and onDone(data) with the complete answer. Resolves when the stream ends.
+// Errors carry status when the server answered with one, and accepted when the server took the
+// query but the browser cannot read the stream.
+export const llmOnlySearchStream = async (participantId, taskId, nlQuery, { onResults, onToken, onDone } = {}) => {
+  const response = await fetch(`${API_BASE_URL}/search/llm_only/stream`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({
+      participant_id: participantId,
+      task_id: taskId,
+      nl_query: nlQuery
+    })
+  })
+  if (!response.ok) {
+    const err = new Error(`Streaming search failed with status ${response.status}`)
+    err.status = response.status
+    throw err
+  }
+  if (!response.body) {
+    const err = new Error('Streaming responses are not supported by this browser')
+    err.accepted = true
+    throw err
+  }
+
+  const handlers = { results: onResults, token: onToken, done: onDone }
+  const reader = response.body.getReader()
+  const decoder = new TextDecoder()
+  let buffer = ''
+
+  const dispatch = (block) => {
+    let event = 'message'
+    const dataLines = []
+    block.split('\n').forEach(line => {
+      if (line.startsWith('event:')) event = line.slice(6).trim()
+      else if (line.startsWith('data:')) dataLines.push(line.slice(5).trimStart())
+    })
+    const handler = handlers[event]
+    if (handler && dataLines.length) {
+      const data = JSON.parse(dataLines.join('\n'))
+      handler(event === 'token' ? data.text : data)
+    }
+  }
+
+  while (true) {
+    const { value, done } = await reader.read()
+    if (done) break
+    buffer += decoder.decode(value, { stream: true })
+    let boundary
+    while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+      dispatch(buffer.slice(0, boundary))
+      buffer = buffer.slice(boundary + 2)
+    }
+  }
+  if (buffer.trim()) dispatch(buffer)
+}
+
 // Logging endpoints
-export const logEvent = (participantId, interfaceType, taskId, eventType, payload) =>
-  api.post('/log', {
+
+// UI events are queued and sent to /log/batch together: after EVENT_FLUSH_MS, when
+// EVENT_BATCH_SIZE events are waiting, before task start/end and when the page is hidden
+const EVENT_FLUSH_MS = 2000
+const EVENT_BATCH_SIZE = 100
+const clientSessionId = window.crypto?.randomUUID?.() ||
+  `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`
+let eventSeq = 0
+let eventQueue = []
+let flushTimer = null
+
+const takeBatches = () => {
+  const batches = {}
+  for (const { participant_id: participantId, ...event } of eventQueue) {
+    batches[participantId] = batches[participantId] || []
+    batches[participantId].push(event)
+  }
+  eventQueue = []
+  return Object.entries(batches).map(([participantId, events]) => ({
+    participant_id: participantId,
+    session_id: clientSessionId,
+    events
+  }))
+}
+
+export const flushEvents = async () => {
+  clearTimeout(flushTimer)
+  flushTimer = null
+  await Promise.all(takeBatches().map(async (batch) => {
+    try {
+      // sent_ts lets the backend correct client_ts for the skew of this browser's clock
+      await api.post('/log/batch', { ...batch, sent_ts: Date.now() })
+    } catch (err) {
+      // Requeue and retry later; the backend skips already logged sequence numbers when they are resent
+      console.error('Logging events failed:', err)
+      eventQueue = batch.events.map(event => ({ participant_id: batch.participant_id, ...event }))
+        .concat(eventQueue)
+      if (!flushTimer) flushTimer = setTimeout(flushEvents, EVENT_FLUSH_MS)
+    }
+  }))
+}
+
+export const logEvent = (participantId, interfaceType, taskId, eventType, payload) => {
+  eventQueue.push({
     participant_id: participantId,
     interface_type: interfaceType,
     task_id: taskId,
     event_type: eventType,
-    payload
+    payload,
+    client_ts: Date.now(),
+    seq: ++eventSeq
   })
+  if (eventQueue.length >= EVENT_BATCH_SIZE) {
+    flushEvents()
+  } else if (!flushTimer) {
+    flushTimer = setTimeout(flushEvents, EVENT_FLUSH_MS)
+  }
+  return Promise.resolve()
+}
+
+// sendBeacon survives page unloads, where a regular request may be cancelled
+window.addEventListener('pagehide', () => {
+  for (const batch of takeBatches()) {
+    const body = new Blob([JSON.stringify({ ...batch, sent_ts: Date.now() })], { type: 'application/json' })
+    navigator.sendBeacon(`${API_BASE_URL}/log/batch`, body)
+  }
+})
 
-export const startTask = (participantId, interfaceType, taskId) =>
-  api.post('/log/task/start', {
+export const startTask = async (participantId, interfaceType, taskId) => {
+  await flushEvents()
+  return api.post('/log/task/start', {
     participant_id: participantId,
     interface_type: interfaceType,
     task_id: taskId
   })
+}
 
-export const endTask = (participantId, interfaceType, taskId, submission) =>
-  api.post('/log/task/end', {
+export const endTask = async (participantId, interfaceType, taskId, submission) => {
+  await flushEvents()
+  return api.post('/log/task/end', {
     participant_id: participantId,
     interface_type: interfaceType,
     task_id: taskId,
     submission
   })
+}
 
 // Questionnaire endpoints
 export const submitQuestionnaire = (participantId, interfaceType, questionnaireType, responses) =>
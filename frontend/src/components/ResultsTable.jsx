@@ -1,20 +1,25 @@
 import React from 'react'
 
-function ResultsTable({ results, selectedMovies, onMovieSelect, onSelectAll }) {
+// resultCount: rows in the whole result, of which results holds the loaded pages;
+// resultIds: its ids once known (after "Select All"), so the button reflects every matching movie
+function ResultsTable({ results, resultCount, resultIds, selectedMovies, onMovieSelect, onSelectAll }) {
   const formatCurrency = (value) => {
     if (!value) return 'N/A'
     return `$${value.toLocaleString('en-US', { maximumFractionDigits: 0 })}`
   }
 
-  const allSelected = results.length > 0 && results.every(movie => selectedMovies.includes(movie.id))
-  const someSelected = results.some(movie => selectedMovies.includes(movie.id))
+  const selectableIds = resultIds || results.map(movie => movie.id)
+  const total = Math.max(resultCount || 0, selectableIds.length)
+  const selected = new Set(selectedMovies)
+  const allSelected = selectableIds.length === total && total > 0 && selectableIds.every(id => selected.has(id))
+  const someSelected = selectableIds.some(id => selected.has(id))
 
   const handleSelectAll = () => {
     if (onSelectAll) {
       onSelectAll()
     } else {
       // Fallback: select/deselect all manually
-      const allMovieIds = results.map(movie => movie.id)
+      const allMovieIds = selectableIds
       if (allSelected) {
         // Deselect all
         allMovieIds.forEach(id => {
@@ -52,7 +57,8 @@ function ResultsTable({ results, selectedMovies, onMovieSelect, onSelectAll }) {
             {allSelected ? 'Deselect All' : 'Select All'}
           </button>
           <span style={{ fontSize: '14px', color: '#666' }}>
-            {selectedMovies.length} of {results.length} selected
+            {selectedMovies.length} of {total} selected
+            {total > results.length && ` (${results.length} shown)`}
           </span>
         </div>
       )}
@@ -1,9 +1,22 @@
 import React, { useState, useEffect } from 'react'
-import { facetedSearch, getGenres } from '../../api'
+import { facetedSearch, getGenres, getFacetCounts, getResultIds, RESULT_PAGE } from '../../api'
 import ResultsTable from '../ResultsTable'
 
+// Drop empty filter values before sending them to the API
+const cleanFilters = (filters) => {
+  const cleaned = {}
+  Object.keys(filters).forEach(key => {
+    if (filters[key] !== '' && filters[key] !== null && 
+        !(Array.isArray(filters[key]) && filters[key].length === 0)) {
+      cleaned[key] = filters[key]
+    }
+  })
+  return cleaned
+}
+
 function FacetedInterface({ participantId, taskId, onSubmit }) {
   const [filters, setFilters] = useState({
+    text: '',
     genres: [],
     lead_gender: '',
     release_year_min: '',
@@ -18,6 +31,11 @@ function FacetedInterface({ participantId, taskId, onSubmit }) {
   const [loading, setLoading] = useState(false)
   const [selectedMovies, setSelectedMovies] = useState([])
   const [allGenres, setAllGenres] = useState([])
+  const [facetCounts, setFacetCounts] = useState(null)
+  const [nextCursor, setNextCursor] = useState(null)
+  const [resultCount, setResultCount] = useState(0)  // rows in the whole result, beyond the loaded pages
+  const [resultIds, setResultIds] = useState(null)  // their ids, fetched for "Select All"
+  const [lastQuery, setLastQuery] = useState(null)
 
   useEffect(() => {
     // Fetch available genres from API
@@ -40,6 +58,22 @@ function FacetedInterface({ participantId, taskId, onSubmit }) {
       })
   }, [])
 
+  useEffect(() => {
+    // Refresh live facet counts shortly after the filters stop changing
+    const timer = setTimeout(() => {
+      getFacetCounts(cleanFilters(filters))
+        .then(response => setFacetCounts(response.data))
+        .catch(() => setFacetCounts(null))
+    }, 150)
+    return () => clearTimeout(timer)
+  }, [filters])
+
+  const genreCount = (genre) =>
+    facetCounts && facetCounts.genres[genre] !== undefined ? ` (${facetCounts.genres[genre]})` : ''
+
+  const genderCount = (gender) =>
+    facetCounts && facetCounts.lead_gender[gender] !== undefined ? ` (${facetCounts.lead_gender[gender]})` : ''
+
   const handleFilterChange = (key, value) => {
     setFilters(prev => ({ ...prev, [key]: value }))
   }
@@ -56,18 +90,13 @@ function FacetedInterface({ participantId, taskId, onSubmit }) {
   const handleSearch = async () => {
     setLoading(true)
     try {
-      // Clean filters: remove empty strings
-      const cleanFilters = {}
-      Object.keys(filters).forEach(key => {
-        if (filters[key] !== '' && filters[key] !== null && 
-            !(Array.isArray(filters[key]) && filters[key].length === 0)) {
-          cleanFilters[key] = filters[key]
-        }
-      })
-
-      const response = await facetedSearch(participantId, taskId, cleanFilters, 
-        sort.field ? sort : null)
+      const query = { filters: cleanFilters(filters), sort: sort.field ? sort : null }
+      const response = await facetedSearch(participantId, taskId, query.filters, query.sort, RESULT_PAGE)
       setResults(response.data.results || [])
+      setResultCount(response.data.result_count ?? (response.data.results || []).length)
+      setResultIds(null)
+      setNextCursor(response.data.next_cursor || null)
+      setLastQuery(query)
     } catch (err) {
       console.error('Search failed:', err)
       alert('Search failed. Please try again.')
@@ -76,6 +105,21 @@ function FacetedInterface({ participantId, taskId, onSubmit }) {
     }
   }
 
+  const handleLoadMore = async () => {
+    setLoading(true)
+    try {
+      const response = await facetedSearch(participantId, taskId, lastQuery.filters, lastQuery.sort,
+        { ...RESULT_PAGE, cursor: nextCursor })
+      setResults(prev => [...prev, ...(response.data.results || [])])
+      setNextCursor(response.data.next_cursor || null)
+    } catch (err) {
+      console.error('Loading more results failed:', err)
+      alert('Loading more results failed. Please try again.')
+    } finally {
+      setLoading(false)
+    }
+  }
+
   const handleMovieSelect = (movieId) => {
     setSelectedMovies(prev => 
       prev.includes(movieId)
@@ -84,23 +128,34 @@ function FacetedInterface({ participantId, taskId, onSubmit }) {
     )
   }
 
-  const handleSelectAll = () => {
-    const allMovieIds = results.map(movie => movie.id)
-    const allSelected = allMovieIds.every(id => selectedMovies.includes(id))
+  const handleSelectAll = async () => {
+    // Rows beyond the loaded pages are fetched as ids only, once per query
+    let ids = resultIds
+    if (!ids) {
+      try {
+        ids = nextCursor
+          ? (await getResultIds(lastQuery.filters, lastQuery.sort)).data.result_ids
+          : results.map(movie => movie.id)
+      } catch (err) {
+        console.error('Fetching result ids failed:', err)
+        alert('Selecting all results failed. Please try again.')
+        return
+      }
+      setResultIds(ids)
+    }
+    // Sets keep this linear: the whole result can hold up to 1000 ids
+    const allMovieIds = new Set(ids)
+    const selected = new Set(selectedMovies)
+    const allSelected = ids.every(id => selected.has(id))
     
     if (allSelected) {
       // Deselect all
-      setSelectedMovies(prev => prev.filter(id => !allMovieIds.includes(id)))
+      setSelectedMovies(prev => prev.filter(id => !allMovieIds.has(id)))
     } else {
       // Select all
       setSelectedMovies(prev => {
-        const newSelection = [...prev]
-        allMovieIds.forEach(id => {
-          if (!newSelection.includes(id)) {
-            newSelection.push(id)
-          }
-        })
-        return newSelection
+        const previous = new Set(prev)
+        return prev.concat(ids.filter(id => !previous.has(id)))
       })
     }
   }
@@ -108,7 +163,7 @@ function FacetedInterface({ participantId, taskId, onSubmit }) {
   const handleSubmit = () => {
     onSubmit({
       selected_movie_ids: selectedMovies,
-      result_count: results.length
+      result_count: resultCount
     })
   }
 
@@ -119,6 +174,16 @@ function FacetedInterface({ participantId, taskId, onSubmit }) {
         <div className="card">
           <h3>Filters</h3>
           
+          <div className="form-group">
+            <label>Keywords (title or overview)</label>
+            <input
+              type="text"
+              value={filters.text}
+              onChange={(e) => handleFilterChange('text', e.target.value)}
+              placeholder="e.g., space robot"
+            />
+          </div>
+
           <div className="form-group">
             <label>Genres</label>
             <div style={{ maxHeight: '200px', overflowY: 'auto' }}>
@@ -129,7 +194,7 @@ function FacetedInterface({ participantId, taskId, onSubmit }) {
                     checked={filters.genres.includes(genre)}
                     onChange={() => handleGenreToggle(genre)}
                   />
-                  <span style={{ marginLeft: '8px' }}>{genre}</span>
+                  <span style={{ marginLeft: '8px' }}>{genre}{genreCount(genre)}</span>
                 </label>
               ))}
             </div>
@@ -142,10 +207,10 @@ function FacetedInterface({ participantId, taskId, onSubmit }) {
               onChange={(e) => handleFilterChange('lead_gender', e.target.value)}
             >
               <option value="">Any</option>
-              <option value="female">Female</option>
-              <option value="male">Male</option>
-              <option value="mixed">Mixed</option>
-              <option value="unknown">Unknown</option>
+              <option value="female">Female{genderCount('female')}</option>
+              <option value="male">Male{genderCount('male')}</option>
+              <option value="mixed">Mixed{genderCount('mixed')}</option>
+              <option value="unknown">Unknown{genderCount('unknown')}</option>
             </select>
           </div>
 
@@ -217,10 +282,11 @@ function FacetedInterface({ participantId, taskId, onSubmit }) {
               <option value="budget">Budget</option>
               <option value="revenue">Revenue</option>
               <option value="title">Title</option>
+              <option value="relevance">Keyword Relevance</option>
             </select>
           </div>
 
-          {sort.field && (
+          {sort.field && sort.field !== 'relevance' && (
             <div className="form-group">
               <label>Direction</label>
               <select
@@ -233,6 +299,12 @@ function FacetedInterface({ participantId, taskId, onSubmit }) {
             </div>
           )}
 
+          {facetCounts && (
+            <p style={{ marginTop: '10px', color: '#666' }}>
+              {facetCounts.total} movies match these filters
+            </p>
+          )}
+
           <button onClick={handleSearch} disabled={loading} style={{ width: '100%', marginTop: '20px' }}>
             {loading ? 'Searching...' : 'Apply Filters'}
           </button>
@@ -241,15 +313,22 @@ function FacetedInterface({ participantId, taskId, onSubmit }) {
         {/* Results Panel */}
         <div>
           <div className="card">
-            <h3>Results ({results.length})</h3>
+            <h3>Results ({results.length}{nextCursor ? '+' : ''})</h3>
             {results.length > 0 && (
             <ResultsTable
               results={results}
+              resultCount={resultCount}
+              resultIds={resultIds}
               selectedMovies={selectedMovies}
               onMovieSelect={handleMovieSelect}
               onSelectAll={handleSelectAll}
             />
             )}
+            {nextCursor && (
+              <button onClick={handleLoadMore} disabled={loading} style={{ width: '100%', marginTop: '10px' }}>
+                {loading ? 'Loading...' : 'Load More'}
+              </button>
+            )}
             {results.length === 0 && !loading && (
               <p style={{ marginTop: '20px', color: '#666' }}>
                 Click "Apply Filters" to search for movies.
@@ -1,16 +1,20 @@
 import React, { useState } from 'react'
-import { llmAssistParse, llmAssistExecute } from '../../api'
+import { llmAssistParse, llmAssistExecute, getResultIds, RESULT_PAGE } from '../../api'
 import ResultsTable from '../ResultsTable'
 
 function LLMAssistInterface({ participantId, taskId, onSubmit }) {
   const [nlQuery, setNlQuery] = useState('')
   const [parsedQuery, setParsedQuery] = useState(null)
   const [preview, setPreview] = useState('')
+  const [previewToken, setPreviewToken] = useState(null)
   const [results, setResults] = useState([])
   const [loading, setLoading] = useState(false)
   const [parsing, setParsing] = useState(false)
   const [selectedMovies, setSelectedMovies] = useState([])
   const [reformulations, setReformulations] = useState(0)
+  const [nextCursor, setNextCursor] = useState(null)
+  const [resultCount, setResultCount] = useState(0)  // rows in the whole result, beyond the loaded pages
+  const [resultIds, setResultIds] = useState(null)  // their ids, fetched for "Select All"
 
   const handleParse = async () => {
     if (!nlQuery.trim()) {
@@ -20,9 +24,10 @@ function LLMAssistInterface({ participantId, taskId, onSubmit }) {
 
     setParsing(true)
     try {
-      const response = await llmAssistParse(participantId, taskId, nlQuery)
+      const response = await llmAssistParse(participantId, taskId, nlQuery, RESULT_PAGE)
       setParsedQuery(response.data.parsed_query)
       setPreview(response.data.human_readable)
+      setPreviewToken(response.data.preview_token || null)
     } catch (err) {
       console.error('Parse failed:', err)
       alert('Failed to parse query. Please try again.')
@@ -39,8 +44,12 @@ function LLMAssistInterface({ participantId, taskId, onSubmit }) {
 
     setLoading(true)
     try {
-      const response = await llmAssistExecute(participantId, taskId, parsedQuery)
+      const response = await llmAssistExecute(participantId, taskId, parsedQuery, RESULT_PAGE, previewToken)
+      setPreviewToken(null)
       setResults(response.data.results || [])
+      setResultCount(response.data.result_count ?? (response.data.results || []).length)
+      setResultIds(null)
+      setNextCursor(response.data.next_cursor || null)
     } catch (err) {
       console.error('Search failed:', err)
       alert('Search failed. Please try again.')
@@ -49,11 +58,30 @@ function LLMAssistInterface({ participantId, taskId, onSubmit }) {
     }
   }
 
+  const handleLoadMore = async () => {
+    setLoading(true)
+    try {
+      const response = await llmAssistExecute(participantId, taskId, parsedQuery,
+        { ...RESULT_PAGE, cursor: nextCursor })
+      setResults(prev => [...prev, ...(response.data.results || [])])
+      setNextCursor(response.data.next_cursor || null)
+    } catch (err) {
+      console.error('Loading more results failed:', err)
+      alert('Loading more results failed. Please try again.')
+    } finally {
+      setLoading(false)
+    }
+  }
+
   const handleReformulate = () => {
     setReformulations(prev => prev + 1)
     setParsedQuery(null)
     setPreview('')
+    setPreviewToken(null)
     setResults([])
+    setResultCount(0)
+    setResultIds(null)
+    setNextCursor(null)
   }
 
   const handleMovieSelect = (movieId) => {
@@ -64,23 +92,34 @@ function LLMAssistInterface({ participantId, taskId, onSubmit }) {
     )
   }
 
-  const handleSelectAll = () => {
-    const allMovieIds = results.map(movie => movie.id)
-    const allSelected = allMovieIds.every(id => selectedMovies.includes(id))
+  const handleSelectAll = async () => {
+    // Rows beyond the loaded pages are fetched as ids only, once per query
+    let ids = resultIds
+    if (!ids) {
+      try {
+        ids = nextCursor
+          ? (await getResultIds(parsedQuery.filters, parsedQuery.sort)).data.result_ids
+          : results.map(movie => movie.id)
+      } catch (err) {
+        console.error('Fetching result ids failed:', err)
+        alert('Selecting all results failed. Please try again.')
+        return
+      }
+      setResultIds(ids)
+    }
+    // Sets keep this linear: the whole result can hold up to 1000 ids
+    const allMovieIds = new Set(ids)
+    const selected = new Set(selectedMovies)
+    const allSelected = ids.every(id => selected.has(id))
     
     if (allSelected) {
       // Deselect all
-      setSelectedMovies(prev => prev.filter(id => !allMovieIds.includes(id)))
+      setSelectedMovies(prev => prev.filter(id => !allMovieIds.has(id)))
     } else {
       // Select all
       setSelectedMovies(prev => {
-        const newSelection = [...prev]
-        allMovieIds.forEach(id => {
-          if (!newSelection.includes(id)) {
-            newSelection.push(id)
-          }
-        })
-        return newSelection
+        const previous = new Set(prev)
+        return prev.concat(ids.filter(id => !previous.has(id)))
       })
     }
   }
@@ -90,7 +129,7 @@ function LLMAssistInterface({ participantId, taskId, onSubmit }) {
       nl_query: nlQuery,
       parsed_query: parsedQuery,
       selected_movie_ids: selectedMovies,
-      result_count: results.length,
+      result_count: resultCount,
       reformulations: reformulations
     })
   }
@@ -130,13 +169,20 @@ function LLMAssistInterface({ participantId, taskId, onSubmit }) {
 
       {results.length > 0 && (
         <div className="card">
-          <h3>Results ({results.length})</h3>
+          <h3>Results ({results.length}{nextCursor ? '+' : ''})</h3>
           <ResultsTable
             results={results}
+            resultCount={resultCount}
+            resultIds={resultIds}
             selectedMovies={selectedMovies}
             onMovieSelect={handleMovieSelect}
             onSelectAll={handleSelectAll}
           />
+          {nextCursor && (
+            <button onClick={handleLoadMore} disabled={loading} style={{ width: '100%', marginTop: '10px' }}>
+              {loading ? 'Loading...' : 'Load More'}
+            </button>
+          )}
           <div style={{ marginTop: '20px' }}>
             <button onClick={handleSubmit} style={{ width: '100%' }}>
               Submit Answer ({selectedMovies.length} selected)
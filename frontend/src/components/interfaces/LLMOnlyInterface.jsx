@@ -1,5 +1,5 @@
 import React, { useState } from 'react'
-import { llmOnlySearch } from '../../api'
+import { llmOnlySearch, llmOnlySearchStream } from '../../api'
 import ResultsTable from '../ResultsTable'
 
 function LLMOnlyInterface({ participantId, taskId, onSubmit }) {
@@ -17,13 +17,39 @@ function LLMOnlyInterface({ participantId, taskId, onSubmit }) {
     }
 
     setLoading(true)
+    setAnswer('')
+    setResults([])
+    let received = false
     try {
-      const response = await llmOnlySearch(participantId, taskId, nlQuery)
-      setAnswer(response.data.answer || '')
-      setResults(response.data.results || [])
+      // Results arrive as soon as retrieval finishes; the answer streams in afterwards
+      await llmOnlySearchStream(participantId, taskId, nlQuery, {
+        onResults: (data) => {
+          received = true
+          setResults(data.results || [])
+        },
+        onToken: (text) => setAnswer(prev => prev + text),
+        onDone: (data) => setAnswer(data.answer || '')
+      })
     } catch (err) {
-      console.error('Search failed:', err)
-      alert('Search failed. Please try again.')
+      if (received) {
+        console.error('Answer stream interrupted:', err)
+      } else if (err.status) {
+        // The server handled (and logged) the query and failed: retrying would log it again
+        console.error('Search failed:', err)
+        alert('Search failed. Please try again.')
+      } else {
+        // Stream never reached (network error) or unreadable here: use the regular endpoint,
+        // telling it when the streamed request already logged the query
+        console.error('Streaming search failed, retrying without streaming:', err)
+        try {
+          const response = await llmOnlySearch(participantId, taskId, nlQuery, { retry: Boolean(err.accepted) })
+          setAnswer(response.data.answer || '')
+          setResults(response.data.results || [])
+        } catch (fallbackErr) {
+          console.error('Search failed:', fallbackErr)
+          alert('Search failed. Please try again.')
+        }
+      }
     } finally {
       setLoading(false)
     }